@@ -8,6 +8,8 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
 
+from api.money import Money, Quantity
+
 
 class AccountingService:
     """
@@ -85,7 +87,7 @@ class AccountingService:
             created_by=user
         )
         
-        amount = order.total_price or 0
+        amount = Money.of(order.total_price).to_decimal()
         
         # Debit: Accounts Receivable (increase asset)
         JournalEntryLine.objects.create(
@@ -127,7 +129,7 @@ class AccountingService:
             created_by=user
         )
         
-        amount = transaction_obj.amount
+        amount = Money.of(transaction_obj.amount).to_decimal()
         
         # Debit: Cash (increase asset)
         JournalEntryLine.objects.create(
@@ -169,7 +171,8 @@ class AccountingService:
             created_by=user
         )
         
-        amount = batch.initial_quantity * batch.cost_per_unit
+        # Rounded once to the tiyin so the debit and credit lines are identical
+        amount = (Money.of(batch.cost_per_unit) * Quantity.of(batch.initial_quantity)).to_decimal()
         
         # Debit: Materials (increase asset)
         JournalEntryLine.objects.create(
@@ -205,8 +208,8 @@ class AccountingService:
         accounts = ChartOfAccounts.objects.filter(is_active=True).order_by('code')
         
         trial_balance = []
-        total_debits = 0
-        total_credits = 0
+        total_debits = Money()
+        total_credits = Money()
         
         for account in accounts:
             # Get all journal entry lines for this account
@@ -240,15 +243,15 @@ class AccountingService:
                     'balance_type': balance_type
                 })
                 
-                total_debits += debit_sum
-                total_credits += credit_sum
+                total_debits += Money.of(debit_sum)
+                total_credits += Money.of(credit_sum)
         
         return {
             'as_of_date': as_of_date.isoformat(),
             'accounts': trial_balance,
             'total_debits': float(total_debits),
             'total_credits': float(total_credits),
-            'is_balanced': abs(total_debits - total_credits) < 0.01
+            'is_balanced': total_debits == total_credits
         }
     
     @staticmethod
@@ -396,12 +396,10 @@ class WorkflowAutomation:
     def auto_reserve_materials(order):
         """Auto-reserve materials when order approved"""
         from api.models import Reservation
-        from api.services import CalculationService
-        from django.forms.models import model_to_dict
+        from api.services import EngineeringJobService
         
-        # Calculate material needs
-        order_data = model_to_dict(order)
-        usage = CalculationService.calculate_material_usage(order_data)
+        # Material needs from the order's engineering job
+        usage = EngineeringJobService.get_job(order).material_usage
         
         reservations_created = []
         
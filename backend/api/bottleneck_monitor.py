@@ -0,0 +1,385 @@
+"""
+Bottleneck Monitor
+Rolling queue, wait, utilization and throughput statistics per step type
+and per machine, kept up to date from ProductionStep and WorkerTimeLog
+saves instead of re-scanning history.
+
+Each tracked key (a step type or a machine) holds its current queue and
+in-progress counts plus hourly ring buffers over the last WINDOW_HOURS:
+arrivals, completions and busy seconds (in-progress, unpaused work
+integrated over time up to the key's capacity). Waits - ready to started -
+feed an exponentially weighted mean. A status change touches at most two
+keys, so each event is O(1); detect() reads everything from memory.
+
+The monitor is seeded from the database once (a handful of queries over
+the window), updated by signals (see signals.py) and reseeded after
+MAX_AGE_SECONDS, which also absorbs changes made by bulk updates that
+bypass signals.
+"""
+
+import threading
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from api.delivery_forecast import STEP_MACHINE_TYPE
+from api.models import MachineSettings, ProductionStep, WorkerTimeLog
+
+WINDOW_HOURS = 24
+WAIT_ALPHA = 0.2
+WAIT_TARGET_HOURS = 8.0
+SEVERITY_THRESHOLD = 0.4
+
+STEP_LABELS = dict(ProductionStep.STEP_CHOICES)
+
+
+class RollingStats:
+    """Counters of one step type or machine"""
+
+    __slots__ = (
+        'kind', 'key', 'label', 'capacity', 'queue', 'in_progress', 'running',
+        'workers', 'wait_hours', 'wait_count', '_hour', '_arrivals',
+        '_completions', '_busy', '_last',
+    )
+
+    def __init__(self, kind, key, label, capacity=1, now=0.0):
+        self.kind = kind
+        self.key = key
+        self.label = label
+        self.capacity = max(capacity, 1)
+        self.queue = 0
+        self.in_progress = 0
+        self.running = 0
+        self.workers = {}
+        self.wait_hours = 0.0
+        self.wait_count = 0
+        self._hour = [None] * WINDOW_HOURS
+        self._arrivals = [0] * WINDOW_HOURS
+        self._completions = [0] * WINDOW_HOURS
+        self._busy = [0.0] * WINDOW_HOURS
+        self._last = now
+
+    def _bucket(self, hour):
+        slot = hour % WINDOW_HOURS
+        if self._hour[slot] != hour:
+            self._hour[slot] = hour
+            self._arrivals[slot] = 0
+            self._completions[slot] = 0
+            self._busy[slot] = 0.0
+        return slot
+
+    def advance(self, now):
+        """Integrate busy time from the last event up to now"""
+        if now <= self._last:
+            return
+        start = max(self._last, now - WINDOW_HOURS * 3600)
+        self._last = now
+        load = min(self.running, self.capacity)
+        if load <= 0:
+            return
+        while start < now:
+            hour = int(start // 3600)
+            end = min(now, (hour + 1) * 3600)
+            self._busy[self._bucket(hour)] += (end - start) * load
+            start = end
+
+    def add_busy(self, start, end, now):
+        """Busy interval from history (seeding)"""
+        start = max(start, now - WINDOW_HOURS * 3600)
+        while start < end:
+            hour = int(start // 3600)
+            stop = min(end, (hour + 1) * 3600)
+            self._busy[self._bucket(hour)] += stop - start
+            start = stop
+
+    def arrive(self, at):
+        self._arrivals[self._bucket(int(at // 3600))] += 1
+
+    def complete(self, at):
+        self._completions[self._bucket(int(at // 3600))] += 1
+
+    def record_wait(self, hours):
+        hours = max(hours, 0.0)
+        self.wait_hours = hours if not self.wait_count else (1 - WAIT_ALPHA) * self.wait_hours + WAIT_ALPHA * hours
+        self.wait_count += 1
+
+    def _window_sum(self, values, now):
+        first = int(now // 3600) - WINDOW_HOURS + 1
+        return sum(v for h, v in zip(self._hour, values) if h is not None and h >= first)
+
+    def metrics(self, now):
+        self.advance(now)
+        busy = self._window_sum(self._busy, now)
+        completions = self._window_sum(self._completions, now)
+        arrivals = self._window_sum(self._arrivals, now)
+        utilization = min(busy / (WINDOW_HOURS * 3600.0 * self.capacity), 1.0)
+        throughput = completions / WINDOW_HOURS
+        growth = (arrivals - completions) / WINDOW_HOURS
+
+        utilization_score = min(max((utilization - 0.6) / 0.4, 0.0), 1.0)
+        growth_score = min(max(growth / max(throughput, 1.0 / WINDOW_HOURS), 0.0), 1.0)
+        wait_score = min(self.wait_hours / WAIT_TARGET_HOURS, 1.0)
+        severity = 0.45 * utilization_score + 0.35 * growth_score + 0.2 * wait_score
+        if self.queue == 0:
+            severity *= 0.5
+
+        if utilization_score >= growth_score and utilization_score >= wait_score:
+            recommendation = "Qo'shimcha smena yoki stanok ajrating"
+        elif growth_score >= wait_score:
+            recommendation = "Navbat o'smoqda: ishlarni boshqa stanok/ishchilarga taqsimlang"
+        else:
+            recommendation = "Kutish uzoq: navbat ustuvorligini qayta ko'rib chiqing"
+
+        return {
+            'type': self.kind,
+            'key': str(self.key),
+            'stage': self.label,
+            'queue_length': self.queue,
+            'in_progress': self.in_progress,
+            'avg_wait_time': round(self.wait_hours, 1),
+            'workers_assigned': len(self.workers),
+            'utilization_percent': round(utilization * 100, 1),
+            'throughput_per_hour': round(throughput, 2),
+            'queue_growth_per_hour': round(growth, 2),
+            'severity': round(severity, 2),
+            'recommendation': recommendation,
+        }
+
+
+class TrackedStep:
+    """What the monitor remembers about an open step"""
+
+    __slots__ = ('status', 'step', 'machine_id', 'assigned_to_id', 'depends_on_id', 'ready_at', 'paused')
+
+    def __init__(self, status, step, machine_id, assigned_to_id, depends_on_id, ready_at, paused=False):
+        self.status = status
+        self.step = step
+        self.machine_id = machine_id
+        self.assigned_to_id = assigned_to_id
+        self.depends_on_id = depends_on_id
+        self.ready_at = ready_at
+        self.paused = paused
+
+
+class BottleneckMonitor:
+    MAX_AGE_SECONDS = 900
+
+    _lock = threading.RLock()
+    _instance = None
+
+    def __init__(self, now, machines):
+        """machines: {machine_id: (name, machine_type)}"""
+        self.built_at = time.monotonic()
+        self.now = now
+        self.machines = machines
+        self.stats = {}
+        self.steps = {}
+        self.successors = {}
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            instance = cls._instance
+            if instance is None or time.monotonic() - instance.built_at > cls.MAX_AGE_SECONDS:
+                instance = cls._instance = cls.build()
+            return instance
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        cls._instance = None
+
+    @classmethod
+    def build(cls, now=None):
+        """Seed from the database: machines, open steps, the window's history, pauses"""
+        now = now or timezone.now()
+        since = now - timedelta(hours=WINDOW_HOURS)
+        machines = {
+            row[0]: (row[1], row[2])
+            for row in MachineSettings.objects.filter(is_active=True).values_list('id', 'machine_name', 'machine_type')
+        }
+        monitor = cls(now.timestamp(), machines)
+
+        paused = {}
+        for step_id, action in WorkerTimeLog.objects.filter(
+            production_step__status='in_progress'
+        ).order_by('timestamp').values_list('production_step_id', 'action'):
+            paused[step_id] = action == 'pause'
+
+        for row in ProductionStep.objects.exclude(status='completed').values(
+            'id', 'status', 'step', 'machine_id', 'assigned_to_id', 'depends_on_step_id',
+            'created_at', 'started_at', 'depends_on_step__completed_at',
+        ):
+            ready = max(filter(None, (row['created_at'], row['depends_on_step__completed_at'])))
+            record = TrackedStep(
+                row['status'], row['step'], row['machine_id'], row['assigned_to_id'],
+                row['depends_on_step_id'], ready.timestamp(), paused.get(row['id'], False),
+            )
+            monitor._track(row['id'], record, +1)
+            if record.status == 'in_progress' and row['started_at'] and not record.paused:
+                for stats in monitor._stats_for(record):
+                    stats.add_busy(row['started_at'].timestamp(), monitor.now, monitor.now)
+
+        for row in ProductionStep.objects.filter(completed_at__gte=since, status='completed').values(
+            'step', 'machine_id', 'created_at', 'started_at', 'completed_at', 'depends_on_step__completed_at',
+        ):
+            record = TrackedStep('completed', row['step'], row['machine_id'], None, None, None)
+            for stats in monitor._stats_for(record):
+                stats.complete(row['completed_at'].timestamp())
+                if row['started_at']:
+                    stats.add_busy(row['started_at'].timestamp(), row['completed_at'].timestamp(), monitor.now)
+                    ready = max(filter(None, (row['created_at'], row['depends_on_step__completed_at'])))
+                    stats.record_wait((row['started_at'] - ready).total_seconds() / 3600)
+
+        for step, machine_id, created_at in ProductionStep.objects.filter(created_at__gte=since).values_list(
+            'step', 'machine_id', 'created_at'
+        ):
+            for stats in monitor._stats_for(TrackedStep('pending', step, machine_id, None, None, None)):
+                stats.arrive(created_at.timestamp())
+
+        for stats in monitor.stats.values():
+            stats._last = monitor.now
+        return monitor
+
+    # ------------------------------------------------------------------
+    # Bookkeeping
+    # ------------------------------------------------------------------
+
+    def _stats_for(self, record):
+        keys = [('step', record.step)]
+        if record.machine_id:
+            keys.append(('machine', record.machine_id))
+        result = []
+        for key in keys:
+            stats = self.stats.get(key)
+            if stats is None:
+                if key[0] == 'step':
+                    machine_type = STEP_MACHINE_TYPE.get(record.step)
+                    capacity = sum(1 for machine in self.machines.values() if machine[1] == machine_type) or 1
+                    stats = RollingStats('step', record.step, STEP_LABELS.get(record.step, record.step), capacity, self.now)
+                else:
+                    name = self.machines.get(record.machine_id, (str(record.machine_id),))[0]
+                    stats = RollingStats('machine', record.machine_id, name, 1, self.now)
+                self.stats[key] = stats
+            result.append(stats)
+        return result
+
+    def _track(self, step_id, record, sign, at=None):
+        """Add (+1) or remove (-1) an open step's contribution to its counters"""
+        for stats in self._stats_for(record):
+            if at is not None:
+                stats.advance(at)
+            if record.status == 'in_progress':
+                stats.in_progress += sign
+                if not record.paused:
+                    stats.running += sign
+            else:
+                stats.queue += sign
+            if record.assigned_to_id:
+                count = stats.workers.get(record.assigned_to_id, 0) + sign
+                if count > 0:
+                    stats.workers[record.assigned_to_id] = count
+                else:
+                    stats.workers.pop(record.assigned_to_id, None)
+        if sign > 0:
+            self.steps[step_id] = record
+            if record.depends_on_id:
+                self.successors.setdefault(record.depends_on_id, set()).add(step_id)
+        else:
+            self.steps.pop(step_id, None)
+            if record.depends_on_id:
+                self.successors.get(record.depends_on_id, set()).discard(step_id)
+
+    def step_saved(self, instance, created=False, at=None):
+        at = (at or timezone.now()).timestamp()
+        old = self.steps.get(instance.id)
+        if old is not None:
+            self._track(instance.id, old, -1, at)
+
+        if instance.status != 'completed':
+            ready_at = old.ready_at if old else (instance.created_at or timezone.now()).timestamp()
+            record = TrackedStep(
+                instance.status, instance.step, instance.machine_id, instance.assigned_to_id,
+                instance.depends_on_step_id, ready_at, old.paused if old else False,
+            )
+            if record.status != 'in_progress':
+                record.paused = False
+            self._track(instance.id, record, +1, at)
+        else:
+            record = TrackedStep('completed', instance.step, instance.machine_id, None, None, None)
+
+        if created:
+            for stats in self._stats_for(record):
+                stats.arrive(at)
+        if instance.status == 'in_progress' and old is not None and old.status != 'in_progress':
+            started = instance.started_at.timestamp() if instance.started_at else at
+            for stats in self._stats_for(record):
+                stats.record_wait((started - old.ready_at) / 3600)
+        if instance.status == 'completed' and old is not None:
+            for stats in self._stats_for(record):
+                stats.complete(at)
+            # Successors become ready now
+            for successor_id in self.successors.pop(instance.id, ()):
+                successor = self.steps.get(successor_id)
+                if successor is not None and successor.status == 'pending':
+                    successor.ready_at = max(successor.ready_at, at)
+
+    def step_deleted(self, instance, at=None):
+        old = self.steps.get(instance.id)
+        if old is not None:
+            self._track(instance.id, old, -1, (at or timezone.now()).timestamp())
+
+    def time_logged(self, log):
+        record = self.steps.get(log.production_step_id)
+        if record is None or record.status != 'in_progress':
+            return
+        paused = log.action == 'pause'
+        if paused != record.paused:
+            at = (log.timestamp or timezone.now()).timestamp()
+            self._track(log.production_step_id, record, -1, at)
+            record.paused = paused
+            self._track(log.production_step_id, record, +1, at)
+
+    # ------------------------------------------------------------------
+    # Signal entry points: no-ops until the monitor has been built
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def on_step_saved(cls, sender=None, instance=None, created=False, **kwargs):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.step_saved(instance, created)
+
+    @classmethod
+    def on_step_deleted(cls, sender=None, instance=None, **kwargs):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.step_deleted(instance)
+
+    @classmethod
+    def on_time_logged(cls, sender=None, instance=None, created=False, **kwargs):
+        if not created:
+            return
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.time_logged(instance)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def snapshot(self, now=None):
+        now = (now or timezone.now()).timestamp()
+        with self._lock:
+            return [stats.metrics(now) for stats in self.stats.values()]
+
+    def detect(self, now=None, threshold=SEVERITY_THRESHOLD):
+        """Keys whose severity reaches the threshold, worst first"""
+        return sorted(
+            (row for row in self.snapshot(now) if row['severity'] >= threshold),
+            key=lambda row: -row['severity'],
+        )
@@ -3,36 +3,39 @@ Calendar utilities for working days calculation and deadline management.
 """
 
 from datetime import datetime, timedelta, date
-from .models import Calendar, Shift
+from .models import Calendar
+
+
+def _calendar_changed():
+    """Bulk writes skip model signals: drop the cached calendar indexes here"""
+    from .work_calendar import WorkingTimeCalendar, WorkingDayIndex
+    WorkingTimeCalendar.invalidate()
+    WorkingDayIndex.invalidate()
 
 
 def populate_calendar_year(year):
     """
     Populate calendar for a given year with default working days (Mon-Fri).
-    Uzbekistan public holidays should be added manually.
+    Existing days are left as they are. One bulk insert.
     """
     start_date = date(year, 1, 1)
-    end_date = date(year, 12, 31)
-    
-    current_date = start_date
-    created_count = 0
+    days = (date(year + 1, 1, 1) - start_date).days
     
-    while current_date <= end_date:
+    rows = []
+    for offset in range(days):
+        current_date = start_date + timedelta(days=offset)
         # Check if weekend (Saturday=5, Sunday=6)
         is_working = current_date.weekday() < 5
-        
-        Calendar.objects.get_or_create(
+        rows.append(Calendar(
             date=current_date,
-            defaults={
-                'is_working_day': is_working,
-                'shift_count': 1 if is_working else 0,
-                'notes': 'Weekend' if not is_working else ''
-            }
-        )
-        created_count += 1
-        current_date += timedelta(days=1)
-    
-    return created_count
+            is_working_day=is_working,
+            shift_count=1 if is_working else 0,
+            notes='Weekend' if not is_working else ''
+        ))
+    
+    Calendar.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+    _calendar_changed()
+    return len(rows)
 
 
 def add_holiday(date_obj, name):
@@ -55,6 +58,25 @@ def add_holiday(date_obj, name):
     return calendar_day
 
 
+def add_holidays(holidays):
+    """
+    Mark many days as holidays in one upsert: [(date, name)].
+    Days that already exist are switched to non-working.
+    """
+    Calendar.objects.bulk_create(
+        [
+            Calendar(date=holiday_date, is_working_day=False, shift_count=0, notes=name)
+            for holiday_date, name in holidays
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=['is_working_day', 'shift_count', 'notes'],
+    )
+    _calendar_changed()
+    return len(holidays)
+
+
 def add_uzbekistan_holidays(year):
     """Add Uzbekistan public holidays for a given year"""
     holidays = [
@@ -68,10 +90,7 @@ def add_uzbekistan_holidays(year):
         # Note: Ramadan and Eid dates vary by year - should be updated manually
     ]
     
-    for holiday_date, holiday_name in holidays:
-        add_holiday(holiday_date, holiday_name)
-    
-    return len(holidays)
+    return add_holidays(holidays)
 
 
 def calculate_deadline(start_date, estimated_workdays, include_shifts=False):
@@ -100,34 +119,18 @@ def calculate_deadline(start_date, estimated_workdays, include_shifts=False):
 def get_production_capacity(start_date, end_date):
     """
     Calculate total production capacity between two dates.
-    Takes into account working days and shifts.
+    Takes into account working days and shifts (capacity multipliers included).
     
     Returns:
         Total capacity hours
     """
+    from .capacity_timeline import CapacityTimeline
+
     if isinstance(start_date, datetime):
         start_date = start_date.date()
     if isinstance(end_date, datetime):
         end_date = end_date.date()
+    if end_date < start_date:
+        return 0.0
     
-    # Get working days
-    working_days = Calendar.objects.filter(
-        date__gte=start_date,
-        date__lte=end_date,
-        is_working_day=True
-    )
-    
-    # Get active shifts
-    active_shifts = Shift.objects.filter(is_active=True)
-    
-    if not active_shifts.exists():
-        # Default: 8 hours per working day
-        return working_days.count() * 8
-    
-    # Calculate total capacity
-    total_capacity = 0
-    for day in working_days:
-        for shift in active_shifts[:day.shift_count]:
-            total_capacity += shift.duration_hours * float(shift.capacity_multiplier)
-    
-    return total_capacity
+    return CapacityTimeline.get(covering=(start_date, end_date)).shop_hours(start_date, end_date)
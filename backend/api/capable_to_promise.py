@@ -0,0 +1,261 @@
+"""
+Capable-to-Promise
+Earliest feasible completion of a quoted order against the current plan.
+
+The plan state - busy intervals of every active machine (downtimes and
+booked open steps, with unscheduled open work appended after each
+machine's last job), machines by type, free material per category
+(usable stock minus open reservations), the working-time calendar and
+the duration model - is loaded in a fixed handful of queries and cached
+per process. It is dropped whenever a plan is written or a machine,
+downtime or reservation changes (see signals.py), and expires after
+MAX_AGE_SECONDS.
+
+A promise copies only the machines it touches and tentatively places the
+order's routing on them: each step starts after the previous one, in
+working time, on whichever machine of the required type finishes it
+first, in the earliest gap long enough to hold it. A material shortfall
+delays the first step by MATERIAL_LEAD_DAYS working days. Nothing is
+written and, with a warm state, nothing is queried.
+
+The confidence band repeats the placement with every step stretched to
+the P10 / P50 / P90 of its log-normal actual/estimate ratio. Stretching
+all steps together is pessimistic for P90 and optimistic for P10, which
+is the safe direction for a quoted date.
+"""
+
+import threading
+import time
+from datetime import datetime, time as dt_time
+from time import perf_counter
+
+import numpy as np
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.delivery_forecast import STEP_MACHINE_TYPE, DurationModel
+from api.finite_scheduler import OPEN_STATUSES, DEFAULT_DURATION_MINUTES
+from api.machine_availability import AvailabilityIndex, MachineAvailability
+from api.models import Material, MachineSettings, ProductionStep, Reservation
+from api.work_calendar import WorkingTimeCalendar, add_working_days, add_working_hours
+
+# CalculationService.calculate_material_usage key -> Material.category
+USAGE_CATEGORY = {
+    'paper_kg': 'qogoz',
+    'ink_kg': 'siyoh',
+    'lacquer_kg': 'lak',
+}
+
+# Working days to restock a material category that is short
+MATERIAL_LEAD_DAYS = 3
+# z-scores of the standard normal for the band percentiles
+BAND = (('p10', -1.2816), ('p50', 0.0), ('p90', 1.2816))
+MAX_PLACEMENT_ATTEMPTS = 50
+
+
+class PromiseState:
+    """Cached machine plan, material availability and calendar for promises"""
+
+    MAX_AGE_SECONDS = 60
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, now, machines, index, unscheduled, free_material, calendar, model):
+        """
+        machines: {machine_type: [machine_id]}
+        index: AvailabilityIndex of the machines' busy time
+        unscheduled: {machine_id: open minutes without an estimate}
+        free_material: {category: free quantity}
+        """
+        self.now = now
+        self.built_at = time.monotonic()
+        self.machines = machines
+        self.free_material = free_material
+        self.calendar = calendar
+        self.model = model
+        self.index = index
+        for machine_id, minutes in unscheduled.items():
+            availability = index.machine(machine_id)
+            last_end = availability.last_end()
+            start = last_end if last_end is not None and last_end > now else now
+            availability.book(start, self.add_hours(start, minutes / 60.0))
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def get(cls):
+        instance = cls._instance
+        if instance is not None and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS:
+            return instance
+        with cls._lock:
+            instance = cls._instance
+            if instance is None or time.monotonic() - instance.built_at > cls.MAX_AGE_SECONDS:
+                instance = cls._instance = cls.build()
+            return instance
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        """Signal-compatible: drop the cached state"""
+        cls._instance = None
+
+    @classmethod
+    def build(cls, now=None):
+        """Machines, downtimes, booked steps, unscheduled totals, stock, reservations"""
+        now = now or timezone.now()
+        machines = {}
+        for machine_id, machine_type in MachineSettings.objects.filter(is_active=True).values_list(
+            'id', 'machine_type'
+        ):
+            machines.setdefault(machine_type, []).append(machine_id)
+        machine_ids = [m for ids in machines.values() for m in ids]
+
+        index = AvailabilityIndex.load(machine_ids, now)
+        unscheduled = dict(
+            ProductionStep.objects.filter(
+                machine_id__in=machine_ids, status__in=OPEN_STATUSES, estimated_end__isnull=True,
+            ).values('machine_id').annotate(
+                minutes=Sum(Coalesce('estimated_duration_minutes', Value(DEFAULT_DURATION_MINUTES)))
+            ).values_list('machine_id', 'minutes')
+        )
+
+        categories = list(USAGE_CATEGORY.values())
+        free_material = {
+            category: float(total or 0)
+            for category, total in Material.objects.filter(category__in=categories).values('category').annotate(
+                total=Sum('usable_stock')
+            ).values_list('category', 'total')
+        }
+        for category, reserved in Reservation.objects.filter(
+            consumed=False, material__category__in=categories,
+        ).values('material__category').annotate(total=Sum('reserved_qty')).values_list('material__category', 'total'):
+            free_material[category] = free_material.get(category, 0.0) - float(reserved or 0)
+
+        return cls(now, machines, index, unscheduled, free_material, WorkingTimeCalendar.get(), DurationModel.get())
+
+    # ------------------------------------------------------------------
+    # Working time
+    # ------------------------------------------------------------------
+
+    def add_hours(self, start, hours):
+        return self.calendar.add_working_hours(start, hours) or add_working_hours(start, hours)
+
+    def next_working(self, moment):
+        return self.calendar.next_working_moment(moment) or moment
+
+
+class CapableToPromise:
+    """Tentatively place a new order's routing on the cached plan state"""
+
+    def __init__(self, now=None, state=None):
+        self.state = state or PromiseState.get()
+        self.now = now or timezone.now()
+
+    # ------------------------------------------------------------------
+    # Materials
+    # ------------------------------------------------------------------
+
+    def material_check(self, usage):
+        """({category: shortfall}, moment the material is available)"""
+        shortages = {}
+        for key, category in USAGE_CATEGORY.items():
+            free = self.state.free_material.get(category)
+            if free is None:
+                continue  # category not stocked: not tracked
+            needed = float((usage or {}).get(key) or 0)
+            if needed > 0 and needed > free:
+                shortages[category] = round(needed - max(free, 0.0), 3)
+        if not shortages:
+            return shortages, self.now
+        today = timezone.localtime(self.now).date()
+        restock = self.state.calendar.add_working_days(today, MATERIAL_LEAD_DAYS) or add_working_days(
+            today, MATERIAL_LEAD_DAYS
+        )
+        ready = timezone.make_aware(datetime.combine(restock, dt_time(0, 0)), self.state.calendar.tz)
+        return shortages, max(ready, self.now)
+
+    # ------------------------------------------------------------------
+    # Placement
+    # ------------------------------------------------------------------
+
+    def _place(self, availability, after, hours):
+        """Earliest (start, end) at or after `after` holding `hours` of working time"""
+        state = self.state
+        start = after
+        for _ in range(MAX_PLACEMENT_ATTEMPTS):
+            start = state.next_working(start)
+            end = state.add_hours(start, hours)
+            if availability is None:
+                return start, end
+            slot = availability.earliest_slot(start, end - start)
+            if slot == start:
+                return start, end
+            start = slot
+        return start, state.add_hours(start, hours)
+
+    def _machine_copy(self, copies, machine_id):
+        if machine_id not in copies:
+            original = self.state.index.machines.get(machine_id)
+            copies[machine_id] = original.copy() if original is not None else MachineAvailability()
+        return copies[machine_id]
+
+    def _route(self, steps, ready, factors):
+        """Place steps in sequence on copies of the machine intervals"""
+        copies = {}
+        finish = ready
+        placed = []
+        for (step_name, hours), factor in zip(steps, factors):
+            hours = float(hours) * factor
+            candidates = self.state.machines.get(STEP_MACHINE_TYPE.get(step_name), [])
+            best = None
+            for machine_id in candidates:
+                start, end = self._place(self._machine_copy(copies, machine_id), finish, hours)
+                if best is None or end < best[2]:
+                    best = (machine_id, start, end)
+            if best is None:
+                start, end = self._place(None, finish, hours)
+                best = (None, start, end)
+            machine_id, start, end = best
+            if machine_id is not None:
+                copies[machine_id].book(start, end)
+            placed.append((step_name, machine_id, start, end))
+            finish = end
+        return finish, placed
+
+    def promise(self, steps, usage=None):
+        """
+        steps: [(step_name, estimated_hours)] in routing order (see
+        DeliveryForecast.steps_for_quote); usage: calculate_material_usage output.
+
+        Returns {'earliest_completion', 'confidence_band': {'p10', 'p50', 'p90'},
+                 'material_ready', 'material_shortages', 'steps', 'elapsed_ms'}
+        """
+        started = perf_counter()
+        shortages, ready = self.material_check(usage)
+        completion, placed = self._route(steps, ready, [1.0] * len(steps))
+
+        params = [self.state.model.lookup(step_name, None) for step_name, _ in steps]
+        band = {}
+        for label, z in BAND:
+            factors = [float(np.exp(mu + z * sigma)) for mu, sigma in params]
+            band[label] = self._route(steps, ready, factors)[0]
+
+        return {
+            'earliest_completion': completion,
+            'confidence_band': band,
+            'material_ready': ready,
+            'material_shortages': shortages,
+            'steps': [
+                {
+                    'step': step_name,
+                    'machine_id': str(machine_id) if machine_id else None,
+                    'start': start,
+                    'end': end,
+                }
+                for step_name, machine_id, start, end in placed
+            ],
+            'elapsed_ms': round((perf_counter() - started) * 1000, 2),
+        }
@@ -0,0 +1,275 @@
+"""
+Capacity Timeline
+Per-machine, per-day available hours minus scheduled load as NumPy arrays.
+
+Shop hours per day come from the working-time calendar (Calendar days and
+active Shifts, capacity multipliers applied). Every active machine starts
+from that row; working time lost to MachineDowntime is subtracted and the
+working time covered by open ProductionStep estimates is counted as load.
+Both are spread over days without a Python loop per step: partial first
+and last days come from the calendar's cumulative hours, whole days in
+between from a difference array.
+
+Cumulative sums over days are kept for shop, available and scheduled
+hours, so any date range total is two array reads and a dashboard row
+is a single slice. The timeline is cached per process, dropped when
+a plan is written or a machine/downtime changes (see signals.py) and
+expires after MAX_AGE_SECONDS.
+"""
+
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.finite_scheduler import OPEN_STATUSES, DEFAULT_DURATION_MINUTES, ShopSnapshot
+from api.models import MachineSettings, ProductionStep
+from api.work_calendar import WorkingTimeCalendar
+
+
+class CapacityTimeline:
+    MAX_AGE_SECONDS = 60
+    HORIZON_PAST_DAYS = 7
+    HORIZON_FUTURE_DAYS = 120
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, calendar, first_day, last_day, machines, downtimes, steps, unscheduled_minutes=None):
+        """
+        machines: [(id, name, type)]
+        downtimes / steps: [(machine_id, start, end)] with aware datetimes
+        unscheduled_minutes: {machine_id: open minutes without an estimate}
+        """
+        self.calendar = calendar
+        self.first_day = first_day
+        self.last_day = last_day
+        self.built_at = time.monotonic()
+        self.machines = machines
+        self.machine_index = {machine[0]: i for i, machine in enumerate(machines)}
+        self.unscheduled_minutes = unscheduled_minutes or {}
+
+        days = (last_day - first_day).days + 1
+        self.bounds = calendar.day_start_epochs(first_day, days)
+        self._bound_hours = calendar.cumulative_hours_at(self.bounds)
+        self.shop = np.diff(self._bound_hours)
+
+        rows = len(machines)
+        lost = self._spread(downtimes, rows)
+        self.available = np.clip(np.tile(self.shop, (rows, 1)) - lost, 0.0, None)
+        self.load = np.minimum(self._spread(steps, rows), self.available)
+
+        self._cum_shop = np.concatenate(([0.0], np.cumsum(self.shop)))
+        zeros = np.zeros((rows, 1))
+        self._cum_available = np.hstack((zeros, np.cumsum(self.available, axis=1)))
+        self._cum_load = np.hstack((zeros, np.cumsum(self.load, axis=1)))
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def get(cls, covering=None):
+        """
+        Process-wide timeline. `covering` is an optional (first_date, last_date)
+        that must be inside the horizon; the timeline is rebuilt wider if not.
+        It is also rebuilt when the working-time calendar was.
+        """
+        today = timezone.localdate()
+        first_day = today - timedelta(days=cls.HORIZON_PAST_DAYS)
+        last_day = today + timedelta(days=cls.HORIZON_FUTURE_DAYS)
+        if covering is not None:
+            first_day, last_day = min(first_day, covering[0]), max(last_day, covering[1])
+        calendar = WorkingTimeCalendar.get(covering=(first_day, last_day))
+
+        instance = cls._instance
+        if cls._usable(instance, calendar, covering):
+            return instance
+
+        with cls._lock:
+            instance = cls._instance
+            if cls._usable(instance, calendar, covering):
+                return instance
+            if instance is not None and instance.calendar is calendar:
+                first_day, last_day = min(first_day, instance.first_day), max(last_day, instance.last_day)
+            cls._instance = cls.build(calendar, first_day, last_day)
+            return cls._instance
+
+    @classmethod
+    def _usable(cls, instance, calendar, covering):
+        return (
+            instance is not None
+            and instance.calendar is calendar
+            and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS
+            and (covering is None or instance.covers(*covering))
+        )
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        """Signal-compatible: drop the cached timeline"""
+        cls._instance = None
+
+    @classmethod
+    def build(cls, calendar, first_day, last_day):
+        """Four queries: machines, downtimes, scheduled steps, unscheduled totals"""
+        range_start = timezone.make_aware(datetime.combine(first_day, dt_time(0, 0)), calendar.tz)
+        range_end = range_start + timedelta(days=(last_day - first_day).days + 1)
+
+        machines = list(
+            MachineSettings.objects.filter(is_active=True).order_by('machine_name').values_list(
+                'id', 'machine_name', 'machine_type'
+            )
+        )
+        machine_ids = [machine[0] for machine in machines]
+
+        downtimes = [
+            (machine_id, start, end)
+            for machine_id, windows in ShopSnapshot.downtime_windows(
+                machine_ids, timezone.now(), since=range_start
+            ).items()
+            for start, end in windows
+        ]
+        steps = list(
+            ProductionStep.objects.filter(
+                machine_id__in=machine_ids, status__in=OPEN_STATUSES,
+                estimated_start__lt=range_end, estimated_end__gt=range_start,
+            ).values_list('machine_id', 'estimated_start', 'estimated_end')
+        )
+        unscheduled = dict(
+            ProductionStep.objects.filter(
+                machine_id__in=machine_ids, status__in=OPEN_STATUSES, estimated_end__isnull=True,
+            ).values('machine_id').annotate(
+                minutes=Sum(Coalesce('estimated_duration_minutes', Value(DEFAULT_DURATION_MINUTES)))
+            ).values_list('machine_id', 'minutes')
+        )
+        return cls(calendar, first_day, last_day, machines, downtimes, steps, unscheduled)
+
+    def covers(self, first_day, last_day):
+        return self.first_day <= first_day and last_day <= self.last_day
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+
+    def _spread(self, intervals, rows):
+        """Working hours of each (machine_id, start, end) interval, summed per machine and day"""
+        days = len(self.shop)
+        result = np.zeros((rows, days))
+        intervals = [
+            (self.machine_index[machine_id], start.timestamp(), end.timestamp())
+            for machine_id, start, end in intervals
+            if machine_id in self.machine_index
+        ]
+        if not intervals:
+            return result
+
+        row, start, end = (np.array(column) for column in zip(*intervals))
+        start = np.clip(start.astype(float), self.bounds[0], self.bounds[-1])
+        end = np.clip(end.astype(float), self.bounds[0], self.bounds[-1])
+        keep = end > start
+        row, start, end = row[keep], start[keep], end[keep]
+        if not len(row):
+            return result
+
+        first = np.clip(np.searchsorted(self.bounds, start, side='right') - 1, 0, days - 1)
+        last = np.clip(np.searchsorted(self.bounds, end, side='left') - 1, 0, days - 1)
+        at_start = self.calendar.cumulative_hours_at(start)
+        at_end = self.calendar.cumulative_hours_at(end)
+
+        same = first == last
+        np.add.at(result, (row[same], first[same]), (at_end - at_start)[same])
+
+        spans = ~same
+        row, first, last = row[spans], first[spans], last[spans]
+        np.add.at(result, (row, first), self._bound_hours[first + 1] - at_start[spans])
+        np.add.at(result, (row, last), at_end[spans] - self._bound_hours[last])
+
+        # Whole days strictly between first and last
+        whole = np.zeros((rows, days + 1))
+        np.add.at(whole, (row, first + 1), 1)
+        np.add.at(whole, (row, last), -1)
+        result += np.cumsum(whole[:, :days], axis=1) * self.shop
+        return result
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _day_range(self, first_day, last_day):
+        """Clipped [a, b) day indices for an inclusive date range"""
+        a = max((first_day - self.first_day).days, 0)
+        b = min((last_day - self.first_day).days + 1, len(self.shop))
+        return a, max(a, b)
+
+    def _rows(self, machine_ids):
+        if machine_ids is None:
+            return slice(None)
+        return [self.machine_index[m] for m in machine_ids if m in self.machine_index]
+
+    def shop_hours(self, first_day, last_day):
+        """Calendar working hours (capacity-weighted) in the inclusive date range"""
+        a, b = self._day_range(first_day, last_day)
+        return float(self._cum_shop[b] - self._cum_shop[a])
+
+    def totals(self, first_day, last_day, machine_ids=None):
+        """Available, scheduled and free machine-hours summed over machines"""
+        a, b = self._day_range(first_day, last_day)
+        rows = self._rows(machine_ids)
+        available = float(np.sum(self._cum_available[rows, b] - self._cum_available[rows, a]))
+        load = float(np.sum(self._cum_load[rows, b] - self._cum_load[rows, a]))
+        return {
+            'available_hours': round(available, 2),
+            'scheduled_hours': round(load, 2),
+            'free_hours': round(available - load, 2),
+            'utilization_percent': round(load / available * 100, 1) if available > 0 else 0,
+        }
+
+    def machine_summary(self, first_day, last_day):
+        """Per-machine totals for the range"""
+        a, b = self._day_range(first_day, last_day)
+        available = self._cum_available[:, b] - self._cum_available[:, a]
+        load = self._cum_load[:, b] - self._cum_load[:, a]
+        return [
+            {
+                'machine_id': str(machine_id),
+                'machine_name': name,
+                'machine_type': machine_type,
+                'available_hours': round(float(available[i]), 2),
+                'scheduled_hours': round(float(load[i]), 2),
+                'free_hours': round(float(available[i] - load[i]), 2),
+                'utilization_percent': round(float(load[i] / available[i] * 100), 1) if available[i] > 0 else 0,
+                'unscheduled_hours': round(self.unscheduled_minutes.get(machine_id, 0) / 60, 2),
+            }
+            for i, (machine_id, name, machine_type) in enumerate(self.machines)
+        ]
+
+    def daily(self, first_day, last_day, machine_id=None):
+        """Per-day rows for a dashboard: one slice of the day arrays"""
+        a, b = self._day_range(first_day, last_day)
+        if machine_id is None:
+            available = self.available[:, a:b].sum(axis=0)
+            load = self.load[:, a:b].sum(axis=0)
+        else:
+            i = self.machine_index.get(machine_id)
+            if i is None:
+                return []
+            available = self.available[i, a:b]
+            load = self.load[i, a:b]
+        return [
+            {
+                'date': date.fromordinal(self.first_day.toordinal() + a + k),
+                'available_hours': round(float(available[k]), 2),
+                'scheduled_hours': round(float(load[k]), 2),
+                'free_hours': round(float(available[k] - load[k]), 2),
+            }
+            for k in range(b - a)
+        ]
+
+    def unscheduled_hours(self, machine_ids=None):
+        if machine_ids is None:
+            machine_ids = self.machine_index
+        return sum(self.unscheduled_minutes.get(m, 0) for m in machine_ids) / 60
@@ -0,0 +1,253 @@
+"""
+Material Cost Index
+Maintains a running weighted-average cost and usable quantity per material.
+
+Batch saves, deletes and FIFO deductions are applied as deltas to the
+denormalized Material.usable_stock / Material.stock_value columns and to a
+process-level in-memory copy, so price lookups in the quote path are plain
+dictionary accesses instead of scan + aggregate queries.
+"""
+
+import threading
+import time
+from decimal import Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+
+class MaterialCostIndex:
+    """
+    Process-level weighted-average cost index.
+
+    Entries: {material_id: {'name', 'category', 'price_per_unit',
+                            'usable_stock', 'stock_value'}}
+    """
+
+    # Other processes update the DB columns; reload periodically to converge
+    MAX_AGE_SECONDS = 60
+
+    _lock = threading.RLock()
+    _entries = None
+    _material_ids = []
+    _lookup_cache = {}
+    _loaded_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def invalidate(cls):
+        """Drop the in-memory copy; it is reloaded on next lookup"""
+        with cls._lock:
+            cls._entries = None
+            cls._material_ids = []
+            cls._lookup_cache = {}
+
+    @classmethod
+    def _load(cls):
+        from api.models import Material
+
+        rows = Material.objects.order_by('pk').values_list(
+            'id', 'name', 'category', 'price_per_unit', 'usable_stock', 'stock_value'
+        )
+        entries = {}
+        material_ids = []
+        for material_id, name, category, price, usable_stock, stock_value in rows:
+            entries[material_id] = {
+                'name': (name or '').lower(),
+                'category': category,
+                'price_per_unit': Decimal(str(price or 0)),
+                'usable_stock': Decimal(str(usable_stock or 0)),
+                'stock_value': Decimal(str(stock_value or 0)),
+            }
+            material_ids.append(material_id)
+
+        cls._entries = entries
+        cls._material_ids = material_ids
+        cls._lookup_cache = {}
+        cls._loaded_at = time.monotonic()
+
+    @classmethod
+    def _ensure_loaded(cls):
+        if cls._entries is None or time.monotonic() - cls._loaded_at > cls.MAX_AGE_SECONDS:
+            with cls._lock:
+                if cls._entries is None or time.monotonic() - cls._loaded_at > cls.MAX_AGE_SECONDS:
+                    cls._load()
+        return cls._entries
+
+    # ------------------------------------------------------------------
+    # Lookups (quote path)
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def resolve_material_id(cls, material_name, category=None):
+        """
+        Same semantics as Material.objects.filter(name__icontains=...,
+        category=...).first(), memoized per (name, category).
+        """
+        entries = cls._ensure_loaded()
+        key = ((material_name or '').lower(), category)
+
+        try:
+            return cls._lookup_cache[key]
+        except KeyError:
+            pass
+
+        needle, match = key[0], None
+        for material_id in cls._material_ids:
+            entry = entries[material_id]
+            if category and entry['category'] != category:
+                continue
+            if needle in entry['name']:
+                match = material_id
+                break
+
+        cls._lookup_cache[key] = match
+        return match
+
+    @classmethod
+    def get_entry(cls, material_id):
+        return cls._ensure_loaded().get(material_id)
+
+    @classmethod
+    def get_average_price(cls, material_name, category=None):
+        """
+        Weighted-average cost over usable batches, falling back to
+        Material.price_per_unit. Returns Decimal('0') if no material matches.
+        """
+        material_id = cls.resolve_material_id(material_name, category)
+        if material_id is None:
+            return Decimal('0')
+
+        entry = cls._entries.get(material_id)
+        if entry is None:
+            return Decimal('0')
+        if entry['usable_stock'] > 0:
+            return entry['stock_value'] / entry['usable_stock']
+        return entry['price_per_unit']
+
+    # ------------------------------------------------------------------
+    # Delta maintenance
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def apply_delta(cls, material_id, quantity_delta, value_delta):
+        """Apply a (quantity, value) delta to the DB columns and, on commit, to memory"""
+        from api.models import Material
+
+        if not material_id or (not quantity_delta and not value_delta):
+            return
+
+        Material.objects.filter(pk=material_id).update(
+            usable_stock=F('usable_stock') + quantity_delta,
+            stock_value=F('stock_value') + value_delta,
+        )
+        transaction.on_commit(partial(cls._apply_memory_delta, material_id, quantity_delta, value_delta))
+
+    @classmethod
+    def _apply_memory_delta(cls, material_id, quantity_delta, value_delta):
+        with cls._lock:
+            if cls._entries is None:
+                return
+            entry = cls._entries.get(material_id)
+            if entry is None:
+                # Unknown material: let the next lookup reload everything
+                cls._entries = None
+                return
+            entry['usable_stock'] += quantity_delta
+            entry['stock_value'] += value_delta
+            if entry['usable_stock'] <= 0:
+                entry['usable_stock'] = Decimal('0')
+                entry['stock_value'] = Decimal('0')
+
+    @classmethod
+    def on_batch_saved(cls, batch, created=False):
+        """Called from MaterialBatch post_save"""
+        new_state = batch.cost_index_contribution()
+        old_state = getattr(batch, '_cost_index_state', None)
+
+        if old_state is None and not created:
+            # Loaded without the fields we need: recompute this material exactly
+            cls.refresh_material(batch.material_id)
+        else:
+            old_material_id, old_qty, old_value = old_state or (None, Decimal('0'), Decimal('0'))
+            new_material_id, new_qty, new_value = new_state
+            if old_material_id and old_material_id != new_material_id:
+                cls.apply_delta(old_material_id, -old_qty, -old_value)
+                old_qty, old_value = Decimal('0'), Decimal('0')
+            cls.apply_delta(new_material_id, new_qty - old_qty, new_value - old_value)
+
+        batch._cost_index_state = new_state
+
+    @classmethod
+    def on_batch_deleted(cls, batch):
+        """Called from MaterialBatch post_delete"""
+        material_id, qty, value = getattr(batch, '_cost_index_state', None) or batch.cost_index_contribution()
+        cls.apply_delta(material_id, -qty, -value)
+
+    @classmethod
+    def on_material_saved(cls, material, created=False, update_fields=None):
+        """Called from Material post_save; only name/category/price changes matter"""
+        if created:
+            cls.invalidate()
+            return
+        if update_fields is not None and not {'name', 'category', 'price_per_unit'} & set(update_fields):
+            return
+        with cls._lock:
+            entry = cls._entries.get(material.pk) if cls._entries is not None else None
+            if entry is None:
+                cls.invalidate()
+                return
+            if entry['name'] != (material.name or '').lower() or entry['category'] != material.category:
+                cls.invalidate()
+                return
+            entry['price_per_unit'] = Decimal(str(material.price_per_unit or 0))
+
+    # ------------------------------------------------------------------
+    # Full rebuild
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _usable_totals(cls, material_ids=None):
+        from api.models import MaterialBatch
+
+        batches = MaterialBatch.objects.filter(is_active=True, current_quantity__gt=0)
+        if material_ids is not None:
+            batches = batches.filter(material_id__in=material_ids)
+        return {
+            row['material_id']: (row['qty'] or Decimal('0'), row['value'] or Decimal('0'))
+            for row in batches.values('material_id').annotate(
+                qty=Sum('current_quantity'),
+                value=Sum(F('current_quantity') * F('cost_per_unit')),
+            )
+        }
+
+    @classmethod
+    def refresh_material(cls, material_id):
+        """Recompute one material from its batches (one aggregate query)"""
+        from api.models import Material
+
+        qty, value = cls._usable_totals([material_id]).get(material_id, (Decimal('0'), Decimal('0')))
+        Material.objects.filter(pk=material_id).update(usable_stock=qty, stock_value=value)
+        transaction.on_commit(cls.invalidate)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every material from its batches with one grouped query
+        and one bulk_update. Use after bulk imports or to correct drift.
+        """
+        from api.models import Material
+
+        totals = cls._usable_totals()
+        materials = list(Material.objects.only('id', 'usable_stock', 'stock_value'))
+        for material in materials:
+            material.usable_stock, material.stock_value = totals.get(
+                material.id, (Decimal('0'), Decimal('0'))
+            )
+        Material.objects.bulk_update(materials, ['usable_stock', 'stock_value'], batch_size=500)
+        cls.invalidate()
+        return len(materials)
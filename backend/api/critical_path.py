@@ -0,0 +1,185 @@
+"""
+Critical Path Engine
+Earliest/latest start, slack and parallel waves of an order's step graph.
+
+A routing is a DAG: every step waits for its depends_on_step and for any
+extra_dependencies. One topological pass (Kahn) gives earliest starts and
+each step's wave - its depth in the graph, so steps of the same wave have
+no path between them and can run side by side. A reverse pass gives
+latest finishes against the order's makespan, slack, and the remaining
+path length ("tail") from each step to the end of its order. Both passes
+are linear in steps + edges.
+
+Durations are remaining work: completed steps count as zero, open steps
+use estimated_duration_minutes (or the scheduler default). Graphs for
+any number of orders load in two queries.
+"""
+
+from api.finite_scheduler import DEFAULT_DURATION_MINUTES
+from api.models import ProductionStep
+
+SLACK_EPSILON = 1e-9
+
+
+def predecessor_links(step_ids=None, open_only=False):
+    """{step_id: [extra predecessor ids]} from the extra_dependencies table"""
+    through = ProductionStep.extra_dependencies.through
+    rows = through.objects.all()
+    if step_ids is not None:
+        rows = rows.filter(from_productionstep_id__in=step_ids)
+    if open_only:
+        rows = rows.exclude(from_productionstep__status='completed')
+    links = {}
+    for step_id, predecessor_id in rows.values_list('from_productionstep_id', 'to_productionstep_id'):
+        links.setdefault(step_id, []).append(predecessor_id)
+    return links
+
+
+class CriticalPath:
+    """
+    nodes: [(id, duration_hours, [predecessor ids])]; predecessors outside
+    the node set are ignored. Edges of a dependency cycle are dropped and
+    `has_cycle` is set, so a bad routing still gets a plan.
+    """
+
+    def __init__(self, nodes):
+        self.ids = [node[0] for node in nodes]
+        index = {step_id: i for i, step_id in enumerate(self.ids)}
+        n = len(self.ids)
+        self.duration = [float(node[1]) for node in nodes]
+        self.predecessors = [
+            sorted({index[p] for p in node[2] if p in index and index[p] != i})
+            for i, node in enumerate(nodes)
+        ]
+        self.successors = [[] for _ in range(n)]
+        for i, preds in enumerate(self.predecessors):
+            for p in preds:
+                self.successors[p].append(i)
+        self.has_cycle = False
+        self._compute()
+
+    def _topological_order(self):
+        n = len(self.ids)
+        missing = [len(preds) for preds in self.predecessors]
+        order = [i for i in range(n) if missing[i] == 0]
+        head = 0
+        while head < len(order):
+            i = order[head]
+            head += 1
+            for s in self.successors[i]:
+                missing[s] -= 1
+                if missing[s] == 0:
+                    order.append(s)
+        if len(order) < n:
+            # Drop the edges into what is left and append it in input order
+            self.has_cycle = True
+            seen = set(order)
+            rest = [i for i in range(n) if i not in seen]
+            for i in rest:
+                self.predecessors[i] = [p for p in self.predecessors[i] if p in seen]
+                seen.add(i)
+            self.successors = [[] for _ in range(n)]
+            for i, preds in enumerate(self.predecessors):
+                for p in preds:
+                    self.successors[p].append(i)
+            order.extend(rest)
+        return order
+
+    def _compute(self):
+        n = len(self.ids)
+        order = self._topological_order()
+        duration = self.duration
+
+        es = [0.0] * n
+        wave = [0] * n
+        for i in order:
+            for p in self.predecessors[i]:
+                finish = es[p] + duration[p]
+                if finish > es[i]:
+                    es[i] = finish
+                if wave[p] + 1 > wave[i]:
+                    wave[i] = wave[p] + 1
+        ef = [es[i] + duration[i] for i in range(n)]
+        self.makespan = max(ef) if n else 0.0
+
+        lf = [self.makespan] * n
+        tail = [0.0] * n
+        for i in reversed(order):
+            longest = 0.0
+            for s in self.successors[i]:
+                start = lf[s] - duration[s]
+                if start < lf[i]:
+                    lf[i] = start
+                if tail[s] > longest:
+                    longest = tail[s]
+            tail[i] = duration[i] + longest
+
+        self.order = order
+        self.earliest_start = es
+        self.earliest_finish = ef
+        self.latest_finish = lf
+        self.latest_start = [lf[i] - duration[i] for i in range(n)]
+        self.slack = [self.latest_start[i] - es[i] for i in range(n)]
+        self.wave = wave
+        self.tail = tail
+
+    def is_critical(self, i):
+        return self.slack[i] <= SLACK_EPSILON
+
+    def critical_path(self):
+        """Ids along one zero-slack chain from a source to the latest-finishing step"""
+        n = len(self.ids)
+        if not n:
+            return []
+        current = next(
+            (i for i in self.order if not self.predecessors[i] and self.is_critical(i) and self.tail[i] >= self.makespan - SLACK_EPSILON),
+            None,
+        )
+        path = []
+        while current is not None:
+            path.append(self.ids[current])
+            finish = self.earliest_finish[current]
+            current = next(
+                (s for s in self.successors[current]
+                 if self.is_critical(s) and abs(self.earliest_start[s] - finish) <= SLACK_EPSILON),
+                None,
+            )
+        return path
+
+    def waves(self):
+        """[[index, ...], ...] grouped by depth in the graph"""
+        grouped = {}
+        for i in self.order:
+            grouped.setdefault(self.wave[i], []).append(i)
+        return [grouped[level] for level in sorted(grouped)]
+
+    @classmethod
+    def for_orders(cls, order_ids):
+        """{order_id: (CriticalPath, {step_id: row})} in two queries"""
+        rows = list(
+            ProductionStep.objects.filter(order_id__in=order_ids).order_by('created_at', 'id').values(
+                'id', 'order_id', 'step', 'status', 'machine_id', 'depends_on_step_id',
+                'estimated_duration_minutes',
+            )
+        )
+        links = predecessor_links([row['id'] for row in rows])
+        per_order = {}
+        for row in rows:
+            per_order.setdefault(row['order_id'], []).append(row)
+
+        graphs = {}
+        for order_id, order_rows in per_order.items():
+            nodes = []
+            for row in order_rows:
+                predecessors = list(links.get(row['id'], ()))
+                if row['depends_on_step_id']:
+                    predecessors.append(row['depends_on_step_id'])
+                nodes.append((row['id'], cls.remaining_hours(row), predecessors))
+            graphs[order_id] = (cls(nodes), {row['id']: row for row in order_rows})
+        return graphs
+
+    @staticmethod
+    def remaining_hours(row):
+        if row['status'] == 'completed':
+            return 0.0
+        return (row['estimated_duration_minutes'] or DEFAULT_DURATION_MINUTES) / 60.0
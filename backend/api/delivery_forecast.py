@@ -0,0 +1,280 @@
+"""
+Monte Carlo Delivery Forecast
+P50/P80/P95 completion dates for a new order against the current queue.
+
+Duration history: for every completed step with a planned estimate, the
+ratio actual / estimated minutes is taken (actual_duration_minutes, else
+completed_at - started_at) and a log-normal is fitted per (step type,
+machine). Keys with too few samples fall back to the step type pooled
+over machines, then to a default spread. The fit is one query and cached
+per process.
+
+Backlog: every open step on a machine is estimate x ratio, a log-normal,
+and a machine's backlog is their sum. The sum is moment-matched to one
+log-normal per machine (Fenton-Wilkinson: same mean and variance), which
+is built once per plan state - two queries - and cached like the
+capable-to-promise state, dropped by the same signals and plan writes.
+
+Simulation: each machine's backlog is drawn from its log-normal; the new
+order's steps then run in sequence, each on whichever machine of the
+required type finishes it first in that sample. Everything is NumPy
+arrays of shape (samples, machines), so a quote costs the same whatever
+the size of the plan. Working hours are turned into dates with the
+working-time calendar.
+"""
+
+import threading
+import time
+from datetime import timedelta
+from time import perf_counter
+
+import numpy as np
+from django.utils import timezone
+
+from api.finite_scheduler import OPEN_STATUSES, DEFAULT_DURATION_MINUTES
+from api.models import MachineSettings, ProductionStep
+from api.work_calendar import add_working_hours
+
+DEFAULT_SAMPLES = 2000
+PERCENTILES = (50, 80, 95)
+
+# Step -> machine type for steps of a new order (others run without a machine queue)
+STEP_MACHINE_TYPE = {
+    'printing': 'printer',
+    'cutting': 'cutter',
+    'die_cutting': 'cutter',
+    'lamination': 'laminator',
+    'gluing': 'folder',
+}
+
+
+class DurationModel:
+    """Log-normal actual/estimate ratio per (step, machine)"""
+
+    MAX_AGE_SECONDS = 600
+    HISTORY_DAYS = 365
+    HISTORY_LIMIT = 20000
+    MIN_SAMPLES = 5
+    DEFAULT_SIGMA = 0.25
+    RATIO_BOUNDS = (0.1, 10.0)
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, rows):
+        """rows: [(step, machine_id, actual_minutes, estimated_minutes)]"""
+        self.built_at = time.monotonic()
+        samples = {}
+        for step, machine_id, actual, estimated in rows:
+            if not actual or not estimated or actual <= 0 or estimated <= 0:
+                continue
+            ratio = min(max(actual / estimated, self.RATIO_BOUNDS[0]), self.RATIO_BOUNDS[1])
+            log_ratio = float(np.log(ratio))
+            samples.setdefault((step, machine_id), []).append(log_ratio)
+            samples.setdefault((step, None), []).append(log_ratio)
+            samples.setdefault((None, None), []).append(log_ratio)
+
+        self.params = {}
+        for key, values in samples.items():
+            if len(values) >= self.MIN_SAMPLES:
+                values = np.array(values)
+                self.params[key] = (float(values.mean()), max(float(values.std(ddof=1)), 0.02), len(values))
+
+    @classmethod
+    def get(cls):
+        instance = cls._instance
+        if instance is not None and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS:
+            return instance
+        with cls._lock:
+            instance = cls._instance
+            if instance is None or time.monotonic() - instance.built_at > cls.MAX_AGE_SECONDS:
+                instance = cls._instance = cls.build()
+            return instance
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        cls._instance = None
+
+    @classmethod
+    def build(cls):
+        since = timezone.now() - timedelta(days=cls.HISTORY_DAYS)
+        rows = []
+        for step, machine_id, actual, estimated, started, completed in ProductionStep.objects.filter(
+            status='completed', completed_at__gte=since, estimated_duration_minutes__gt=0,
+        ).order_by('-completed_at').values_list(
+            'step', 'machine_id', 'actual_duration_minutes', 'estimated_duration_minutes',
+            'started_at', 'completed_at',
+        )[:cls.HISTORY_LIMIT]:
+            if not actual and started and completed:
+                actual = (completed - started).total_seconds() / 60
+            rows.append((step, machine_id, actual, estimated))
+        return cls(rows)
+
+    def lookup(self, step, machine_id):
+        """(mu, sigma) of log(actual / estimate)"""
+        for key in ((step, machine_id), (step, None), (None, None)):
+            params = self.params.get(key)
+            if params:
+                return params[0], params[1]
+        return 0.0, self.DEFAULT_SIGMA
+
+    def sample(self, rng, samples, keys, base_hours):
+        """(samples, len(keys)) matrix of sampled hours for steps with base estimates"""
+        if not keys:
+            return np.zeros((samples, 0))
+        mu, sigma = (np.array(column) for column in zip(*(self.lookup(*key) for key in keys)))
+        z = rng.standard_normal((samples, len(keys)))
+        return np.exp(mu + sigma * z) * np.asarray(base_hours, dtype=float)
+
+
+class BacklogDistribution:
+    """Log-normal backlog hours per active machine, moment-matched from its open steps"""
+
+    MAX_AGE_SECONDS = 60
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, machines, mean, variance, model):
+        """machines: {machine_type: [machine_id]}; mean, variance: hours per machine column"""
+        self.built_at = time.monotonic()
+        self.machines = machines
+        self.machine_ids = [machine_id for ids in machines.values() for machine_id in ids]
+        self.column = {machine_id: i for i, machine_id in enumerate(self.machine_ids)}
+        self.model = model
+        self.mean = np.asarray(mean, dtype=float)
+        busy = self.mean > 0
+        sigma2 = np.zeros(len(self.mean))
+        sigma2[busy] = np.log1p(np.asarray(variance, dtype=float)[busy] / self.mean[busy] ** 2)
+        self.sigma = np.sqrt(sigma2)
+        self.mu = np.full(len(self.mean), -np.inf)
+        self.mu[busy] = np.log(self.mean[busy]) - sigma2[busy] / 2
+
+    @classmethod
+    def get(cls, model=None):
+        """Cached distribution for the given duration model (default: the cached one)"""
+        model = model or DurationModel.get()
+        instance = cls._instance
+        if cls._usable(instance, model):
+            return instance
+        with cls._lock:
+            instance = cls._instance
+            if not cls._usable(instance, model):
+                instance = cls._instance = cls.build(model=model)
+            return instance
+
+    @classmethod
+    def _usable(cls, instance, model):
+        return (
+            instance is not None
+            and instance.model is model
+            and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS
+        )
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        """Signal-compatible: drop the cached distribution"""
+        cls._instance = None
+
+    @classmethod
+    def build(cls, now=None, model=None):
+        """Two queries: active machines, open steps on them"""
+        now = now or timezone.now()
+        model = model or DurationModel.get()
+        machines = {}
+        for machine_id, machine_type in MachineSettings.objects.filter(is_active=True).values_list(
+            'id', 'machine_type'
+        ):
+            machines.setdefault(machine_type, []).append(machine_id)
+        column = {machine_id: i for i, machine_id in enumerate(m for ids in machines.values() for m in ids)}
+
+        params, mu, sigma, base, owner = {}, [], [], [], []
+        for machine_id, step, status, estimated, estimated_end in ProductionStep.objects.filter(
+            machine_id__in=list(column), status__in=OPEN_STATUSES,
+        ).values_list('machine_id', 'step', 'status', 'estimated_duration_minutes', 'estimated_end'):
+            hours = (estimated or DEFAULT_DURATION_MINUTES) / 60.0
+            if status == 'in_progress' and estimated_end:
+                hours = max((estimated_end - now).total_seconds() / 3600.0, 0.0)
+            key = (step, machine_id)
+            if key not in params:
+                params[key] = model.lookup(step, machine_id)
+            mu.append(params[key][0])
+            sigma.append(params[key][1])
+            base.append(hours)
+            owner.append(column[machine_id])
+
+        mean = variance = np.zeros(len(column))
+        if owner:
+            mu, sigma2, base = np.array(mu), np.array(sigma) ** 2, np.array(base)
+            # Mean and variance of base x LogNormal(mu, sigma), summed per machine
+            step_mean = base * np.exp(mu + sigma2 / 2)
+            step_variance = step_mean ** 2 * np.expm1(sigma2)
+            mean = np.bincount(owner, weights=step_mean, minlength=len(column))
+            variance = np.bincount(owner, weights=step_variance, minlength=len(column))
+        return cls(machines, mean, variance, model)
+
+    def sample(self, rng, samples):
+        """(samples, machines) matrix of sampled backlog hours"""
+        z = rng.standard_normal((samples, len(self.mean)))
+        return np.exp(self.mu + self.sigma * z)
+
+
+class DeliveryForecast:
+    """Sample completion of a new order behind the current queue"""
+
+    def __init__(self, now=None, samples=DEFAULT_SAMPLES, seed=None, model=None, backlog=None):
+        self.now = now or timezone.now()
+        self.samples = samples
+        self.rng = np.random.default_rng(seed)
+        self.model = model or DurationModel.get()
+        self.backlog = backlog
+
+    def predict(self, steps):
+        """
+        steps: [(step_name, estimated_hours)] for the new order, in routing order.
+
+        Returns {'p50', 'p80', 'p95': datetime, 'working_hours': {...},
+                 'samples': int, 'elapsed_ms': float}
+        """
+        started = perf_counter()
+        distribution = self.backlog or BacklogDistribution.get(self.model)
+        machines, column = distribution.machines, distribution.column
+        backlog = distribution.sample(self.rng, self.samples)
+
+        finish = np.zeros(self.samples)
+        for step_name, hours in steps:
+            candidates = machines.get(STEP_MACHINE_TYPE.get(step_name), [])
+            if not candidates:
+                duration = self.model.sample(self.rng, self.samples, [(step_name, None)], [hours])[:, 0]
+                finish = finish + duration
+                continue
+            cols = [column[m] for m in candidates]
+            durations = self.model.sample(self.rng, self.samples, [(step_name, m) for m in candidates], [hours] * len(cols))
+            ends = np.maximum(backlog[:, cols], finish[:, None]) + durations
+            choice = np.argmin(ends, axis=1)
+            rows = np.arange(self.samples)
+            finish = ends[rows, choice]
+            # The chosen machine is busy until this step is done
+            backlog[rows, np.asarray(cols)[choice]] = finish
+
+        hours_at = np.percentile(finish, PERCENTILES) if self.samples else np.zeros(len(PERCENTILES))
+        result = {
+            f'p{pct}': add_working_hours(self.now, float(value))
+            for pct, value in zip(PERCENTILES, hours_at)
+        }
+        result['working_hours'] = {f'p{pct}': round(float(value), 2) for pct, value in zip(PERCENTILES, hours_at)}
+        result['samples'] = self.samples
+        result['elapsed_ms'] = round((perf_counter() - started) * 1000, 2)
+        return result
+
+    @staticmethod
+    def steps_for_quote(cost_data, quantity, has_lacquer=False):
+        """Routing of a quoted order with hours from the engineering calculation"""
+        machine_hours = cost_data.get('machine_hours', {})
+        steps = [('printing', float(machine_hours.get('printing') or 0) or 1.0)]
+        if has_lacquer:
+            steps.append(('lamination', max(quantity / 3000.0, 0.5)))
+        steps.append(('cutting', float(machine_hours.get('cutting') or 0) or 0.5))
+        steps.append(('gluing', max(quantity / 3000.0, 0.5)))
+        steps.append(('packaging', 0.5))
+        return steps
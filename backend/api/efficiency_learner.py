@@ -0,0 +1,215 @@
+"""
+Efficiency Learner
+Keeps EmployeeEfficiency.units_per_hour in line with the time logs.
+
+Each completed step gives one observed rate: order quantity over the net
+productive hours logged on it - START/RESUME to PAUSE/FINISH intervals,
+summed over every worker who logged time on the step. Each of those
+workers gets the step's rate as a sample for its production stage.
+
+Samples far from the worker's current rate (more than OUTLIER_FACTOR
+either way), or from the median of the run's samples when there is no
+rate yet, are dropped. The rest are folded in, oldest first, with an
+exponentially weighted moving average (weight ALPHA on each new
+sample). The result is written as the worker's rate for the stage
+effective today: today's row is updated in place, otherwise a new row
+carries the previous row's labour cost forward, so the history of
+rates is kept.
+
+Runs are incremental. Rows record the newest FINISH log they have seen
+(learned_through), and the next run reads only steps finished after
+the newest of those. Loading is one query over the logs of those steps;
+writing is a bulk_update and a bulk_create.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from statistics import median
+
+from django.db.models import Max
+from django.utils import timezone
+
+from api.finite_scheduler import STEP_TO_STAGE
+from api.models import EmployeeEfficiency, WorkerTimeLog
+
+ALPHA = 0.2
+OUTLIER_FACTOR = 3.0
+MIN_NET_MINUTES = 1
+MAX_NET_HOURS = 24 * 7
+OPENING_ACTIONS = ('start', 'resume')
+CLOSING_ACTIONS = ('pause', 'finish')
+
+
+def net_hours(events):
+    """Productive hours in time-ordered (action, timestamp) events of one worker"""
+    total = timedelta(0)
+    opened = None
+    for action, timestamp in events:
+        if action in OPENING_ACTIONS:
+            if opened is None:
+                opened = timestamp
+        elif action in CLOSING_ACTIONS and opened is not None:
+            total += timestamp - opened
+            opened = None
+    return total.total_seconds() / 3600.0
+
+
+class EfficiencyLearner:
+    def __init__(self, today=None):
+        self.today = today or timezone.localdate()
+        self.since = None
+        self.samples = []
+        self.rejected = 0
+        self.watermark = None
+        self.rates = {}
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def load(self, since=None):
+        """
+        Samples from steps finished after `since` (default: the newest
+        learned_through), oldest first: [(finished_at, worker_id, stage, rate)]
+        """
+        if since is None:
+            since = EmployeeEfficiency.objects.aggregate(latest=Max('learned_through'))['latest']
+        self.since = since
+
+        finished = WorkerTimeLog.objects.filter(
+            action='finish', is_deleted=False,
+            production_step__status='completed', production_step__step__in=list(STEP_TO_STAGE),
+        )
+        if since is not None:
+            finished = finished.filter(timestamp__gt=since)
+
+        steps = {}
+        for step_id, worker_id, action, timestamp, step, quantity in WorkerTimeLog.objects.filter(
+            is_deleted=False, production_step_id__in=finished.values('production_step_id'),
+        ).order_by('production_step_id', 'worker_id', 'timestamp').values_list(
+            'production_step_id', 'worker_id', 'action', 'timestamp',
+            'production_step__step', 'production_step__order__quantity',
+        ):
+            record = steps.setdefault(step_id, {'stage': STEP_TO_STAGE[step], 'quantity': quantity, 'workers': {}, 'finished': None})
+            record['workers'].setdefault(worker_id, []).append((action, timestamp))
+            if action == 'finish' and (record['finished'] is None or timestamp > record['finished']):
+                record['finished'] = timestamp
+
+        self.samples = []
+        for record in steps.values():
+            if record['finished'] is None:
+                continue
+            if self.watermark is None or record['finished'] > self.watermark:
+                self.watermark = record['finished']
+            hours = {worker_id: net_hours(events) for worker_id, events in record['workers'].items()}
+            total = sum(hours.values())
+            if not record['quantity'] or total * 60 < MIN_NET_MINUTES or total > MAX_NET_HOURS:
+                self.rejected += 1
+                continue
+            rate = float(record['quantity']) / total
+            for worker_id, worked in hours.items():
+                if worked > 0:
+                    self.samples.append((record['finished'], worker_id, record['stage'], rate))
+        self.samples.sort(key=lambda sample: sample[0])
+        return self
+
+    def _current_rows(self):
+        """Latest EmployeeEfficiency row per (worker, stage) among the sampled ones"""
+        keys = {(worker_id, stage) for _, worker_id, stage, _ in self.samples}
+        rows = {}
+        for row in EmployeeEfficiency.objects.filter(
+            employee_id__in={worker_id for worker_id, _ in keys},
+            production_stage__in={stage for _, stage in keys},
+        ).order_by('-effective_from', '-id'):
+            rows.setdefault((row.employee_id, row.production_stage), row)
+        return rows
+
+    # ------------------------------------------------------------------
+    # Learning
+    # ------------------------------------------------------------------
+
+    def learn(self, current=None):
+        """
+        current: {(worker_id, stage): rate} before this run.
+        Returns {(worker_id, stage): (rate, accepted samples)}.
+        """
+        current = current or {}
+        grouped = {}
+        for _, worker_id, stage, rate in self.samples:
+            grouped.setdefault((worker_id, stage), []).append(rate)
+
+        learned = {}
+        for key, rates in grouped.items():
+            rate = current.get(key)
+            reference = rate or median(rates)
+            accepted = 0
+            for sample in rates:
+                if not reference / OUTLIER_FACTOR <= sample <= reference * OUTLIER_FACTOR:
+                    self.rejected += 1
+                    continue
+                rate = sample if rate is None else (1 - ALPHA) * rate + ALPHA * sample
+                accepted += 1
+            if accepted:
+                learned[key] = (rate, accepted)
+        return learned
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+
+    def write(self, learned, rows):
+        updated, created = [], []
+        for (worker_id, stage), (rate, accepted) in learned.items():
+            units_per_hour = Decimal(str(round(rate, 2)))
+            previous = rows.get((worker_id, stage))
+            if previous is not None and previous.effective_from == self.today:
+                previous.units_per_hour = units_per_hour
+                previous.sample_count += accepted
+                previous.learned_through = self.watermark
+                updated.append(previous)
+                continue
+            created.append(EmployeeEfficiency(
+                employee_id=worker_id,
+                production_stage=stage,
+                units_per_hour=units_per_hour,
+                error_rate_percent=previous.error_rate_percent if previous else 0,
+                hourly_labor_cost=previous.hourly_labor_cost if previous else 0,
+                effective_from=self.today,
+                notes="Ish vaqti yozuvlaridan o'rganilgan",
+                sample_count=(previous.sample_count if previous else 0) + accepted,
+                learned_through=self.watermark,
+            ))
+        if updated:
+            EmployeeEfficiency.objects.bulk_update(
+                updated, ['units_per_hour', 'sample_count', 'learned_through'], batch_size=500
+            )
+        if created:
+            EmployeeEfficiency.objects.bulk_create(created, batch_size=500)
+        return len(updated), len(created)
+
+    @classmethod
+    def run(cls, since=None, today=None, commit=True):
+        learner = cls(today=today).load(since)
+        rows = learner._current_rows() if learner.samples else {}
+        current = {key: float(row.units_per_hour) for key, row in rows.items() if row.units_per_hour > 0}
+        learned = learner.learn(current)
+
+        updated = created = 0
+        if commit and learned:
+            updated, created = learner.write(learned, rows)
+        return {
+            'since': learner.since,
+            'learned_through': learner.watermark,
+            'samples': len(learner.samples),
+            'rejected': learner.rejected,
+            'rates': {
+                f'{worker_id}:{stage}': {
+                    'before': round(current[(worker_id, stage)], 2) if (worker_id, stage) in current else None,
+                    'after': round(rate, 2),
+                    'samples': accepted,
+                }
+                for (worker_id, stage), (rate, accepted) in learned.items()
+            },
+            'updated': updated,
+            'created': created,
+        }
@@ -0,0 +1,743 @@
+"""
+Finite-Capacity List Scheduler
+Plans every open production step across all machines in one pass.
+
+The shop state (open steps, machines, downtimes, routing and efficiency
+rates, finished predecessors) is loaded with a fixed handful of queries
+into a ShopSnapshot. A priority list-scheduling pass then places each
+ready step on its machine at the earliest time allowed by its
+predecessors, the machine's other jobs and any downtime. Only steps whose
+times, duration or position moved are written back, with one executemany
+UPDATE (bulk_update's CASE/WHEN per batch cost far more than the
+planning itself). Steps may wait for several
+predecessors (non-linear routings); ties in dispatch go to the step with
+the longest remaining path through its order.
+"""
+
+import bisect
+import heapq
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from api.models import (
+    ProductionStep, MachineSettings, MachineDowntime,
+    EmployeeEfficiency, ProductTemplateRouting
+)
+
+OPEN_STATUSES = ('pending', 'in_progress')
+DEFAULT_DURATION_MINUTES = 60
+DOWNTIME_WITHOUT_END = timedelta(hours=2)
+
+# ProductionStep.step -> EmployeeEfficiency.production_stage
+STEP_TO_STAGE = {
+    'cutting': 'cutting',
+    'printing': 'printing',
+    'gluing': 'gluing',
+    'drying': 'drying',
+    'packaging': 'packaging',
+}
+
+ORDER_PRIORITY_RANK = {'urgent': 0, 'high': 1, 'normal': 2}
+
+
+def update_rows(model, fields, rows):
+    """
+    Set `fields` on many rows with one executemany UPDATE.
+    rows: [(value per field, ..., pk)]. Like bulk_update, sends no signals.
+    """
+    if not rows:
+        return 0
+    meta = model._meta
+    quote = connection.ops.quote_name
+    columns = [meta.get_field(name) for name in fields]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in columns),
+        quote(meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(columns, row)] + [row[-1]]
+        for row in rows
+    ]
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+    return len(rows)
+
+
+class PlannedStep:
+    """In-memory view of one open ProductionStep"""
+
+    __slots__ = (
+        'id', 'order_id', 'step', 'status', 'machine_id', 'depends_on_id',
+        'predecessors', 'priority', 'order_priority', 'deadline', 'quantity',
+        'started_at', 'duration', 'tail', 'queue_position', 'start', 'end', 'stored',
+    )
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.order_id = row['order_id']
+        self.step = row['step']
+        self.status = row['status']
+        self.machine_id = row['machine_id']
+        self.depends_on_id = row['depends_on_step_id']
+        self.predecessors = (self.depends_on_id,) if self.depends_on_id else ()
+        self.priority = row['priority']
+        self.order_priority = ORDER_PRIORITY_RANK.get(row['order__priority'], 2)
+        self.deadline = row['order__deadline']
+        self.quantity = row['order__quantity'] or 0
+        self.started_at = row['started_at']
+        self.queue_position = row['queue_position']
+        self.duration = timedelta(minutes=DEFAULT_DURATION_MINUTES)
+        self.tail = 0.0
+        self.start = None
+        self.end = None
+        # Plan as stored, in FiniteCapacityScheduler.UPDATE_FIELDS order
+        self.stored = (
+            row.get('estimated_start'), row.get('estimated_end'), row.get('estimated_duration_minutes'),
+            row.get('setup_minutes'), row['queue_position'],
+        )
+
+    def sort_key(self, far_future):
+        """Dispatch priority: step priority, deadline, order priority, then longest remaining path"""
+        return (self.priority, self.deadline or far_future, self.order_priority, -self.tail, self.id)
+
+
+class ShopSnapshot:
+    """
+    Everything the scheduler needs, loaded in a fixed number of queries:
+    steps, machines, downtimes, routing, efficiency, finished predecessors.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.steps = {}
+        self.machines = {}
+        self.downtimes = {}
+        self.predecessor_done = {}
+
+    @classmethod
+    def load(cls, now=None):
+        snapshot = cls(now)
+        snapshot._load_steps()
+        snapshot._load_dependencies()
+        snapshot._load_machines()
+        snapshot._load_downtimes()
+        snapshot._load_finished_predecessors()
+        snapshot._estimate_durations()
+        snapshot._compute_tails()
+        return snapshot
+
+    def _load_steps(self):
+        rows = ProductionStep.objects.filter(status__in=OPEN_STATUSES).values(
+            'id', 'order_id', 'step', 'status', 'machine_id', 'depends_on_step_id',
+            'priority', 'queue_position', 'started_at', 'assigned_to_id',
+            'estimated_start', 'estimated_end', 'estimated_duration_minutes', 'setup_minutes',
+            'order__priority', 'order__deadline', 'order__quantity',
+            'order__product_template_id',
+        )
+        self._assignments = {}
+        self._templates = {}
+        for row in rows:
+            step = PlannedStep(row)
+            self.steps[step.id] = step
+            self._assignments[step.id] = row['assigned_to_id']
+            self._templates[step.id] = row['order__product_template_id']
+
+    def _load_dependencies(self):
+        """Extra predecessors of non-linear routings (see critical_path.py)"""
+        from api.critical_path import predecessor_links
+        for step_id, extra in predecessor_links(open_only=True).items():
+            step = self.steps.get(step_id)
+            if step:
+                step.predecessors = tuple(dict.fromkeys(step.predecessors + tuple(extra)))
+
+    def _load_machines(self):
+        # End of the latest planned maintenance window that has already passed
+        last_planned_service = Max(
+            'downtimes__ended_at', filter=Q(downtimes__is_planned=True, downtimes__ended_at__lte=self.now)
+        )
+        self.machines = {
+            row['id']: row
+            for row in MachineSettings.objects.annotate(last_planned_service=last_planned_service).values(
+                'id', 'machine_type', 'is_active', 'setup_time_minutes',
+                'maintenance_interval_hours', 'current_operating_hours',
+                'last_maintenance_date', 'last_planned_service',
+            )
+        }
+
+    def _load_downtimes(self):
+        # Future planned maintenance is placed again by this replan
+        self.downtimes = self.downtime_windows(list(self.machines), self.now, replanned=True)
+
+    @staticmethod
+    def downtime_windows(machine_ids, now, replanned=False, since=None):
+        """
+        {machine_id: sorted [(start, end)]} of downtimes ending after `since`
+        (default: now), open-ended ones capped from now. replanned: leave out
+        planned maintenance that has not started.
+        """
+        since = now if since is None else since
+        rows = MachineDowntime.objects.filter(
+            machine_id__in=machine_ids
+        ).exclude(ended_at__lt=since)
+        if replanned:
+            rows = rows.exclude(is_planned=True, started_at__gt=now)
+        rows = rows.values(
+            'machine_id', 'started_at', 'ended_at', 'estimated_duration_hours', 'is_active'
+        )
+        windows = {}
+        for row in rows:
+            start = row['started_at']
+            end = row['ended_at']
+            if end is None:
+                if not row['is_active']:
+                    continue
+                if row['estimated_duration_hours']:
+                    end = start + timedelta(hours=float(row['estimated_duration_hours']))
+                else:
+                    end = now + DOWNTIME_WITHOUT_END
+            if end > since:
+                windows.setdefault(row['machine_id'], []).append((start, end))
+        for machine_windows in windows.values():
+            machine_windows.sort()
+        return windows
+
+    def _load_finished_predecessors(self):
+        """Completion time of predecessors that are no longer open"""
+        outside = {
+            predecessor for step in self.steps.values()
+            for predecessor in step.predecessors if predecessor not in self.steps
+        }
+        if not outside:
+            return
+        for row in ProductionStep.objects.filter(id__in=outside).values('id', 'completed_at', 'estimated_end'):
+            self.predecessor_done[row['id']] = row['completed_at'] or row['estimated_end']
+
+    def _estimate_durations(self):
+        """
+        Same rules as ProductionStep.calculate_estimated_time and the routing
+        fallback in ProductionScheduler.calculate_step_times, without per-step queries.
+        """
+        employees = {emp for emp in self._assignments.values() if emp}
+        rates = {}
+        if employees:
+            for row in EmployeeEfficiency.objects.filter(employee_id__in=employees).order_by(
+                '-effective_from'
+            ).values('employee_id', 'production_stage', 'units_per_hour'):
+                rates.setdefault((row['employee_id'], row['production_stage']), row['units_per_hour'])
+
+        templates = {tpl for tpl in self._templates.values() if tpl}
+        routing = {}
+        if templates:
+            for row in ProductTemplateRouting.objects.filter(template_id__in=templates).order_by(
+                'sequence'
+            ).values('template_id', 'step_name', 'estimated_time_per_unit', 'setup_time_minutes'):
+                routing.setdefault((row['template_id'], row['step_name']), row)
+
+        for step in self.steps.values():
+            minutes = None
+            employee = self._assignments.get(step.id)
+            stage = STEP_TO_STAGE.get(step.step)
+            if employee and stage:
+                units_per_hour = rates.get((employee, stage))
+                if units_per_hour:
+                    minutes = float(step.quantity) / float(units_per_hour) * 60
+                    machine = self.machines.get(step.machine_id)
+                    if machine:
+                        minutes += machine['setup_time_minutes']
+            if not minutes:
+                route = routing.get((self._templates.get(step.id), step.step))
+                if route:
+                    minutes = float(route['estimated_time_per_unit']) * step.quantity + route['setup_time_minutes']
+            step.duration = timedelta(minutes=minutes or DEFAULT_DURATION_MINUTES)
+
+    def _compute_tails(self):
+        """Remaining path length of each step to the end of its order, in hours"""
+        from api.critical_path import CriticalPath
+        graph = CriticalPath([
+            (step.id, step.duration.total_seconds() / 3600, step.predecessors)
+            for step in self.steps.values()
+        ])
+        for step_id, tail in zip(graph.ids, graph.tail):
+            self.steps[step_id].tail = tail
+
+
+class ListScheduler:
+    """
+    Priority list scheduling on finite machine capacity.
+
+    A step becomes ready when all its predecessors are placed. Ready steps are
+    dispatched in sort_key order; each takes the earliest slot on its
+    machine that is free of downtime and already placed steps, no earlier
+    than now and its predecessor's end. With backfill, a gap left before
+    a machine's later jobs is reused; without it, steps only append after
+    the machine's last job. Steps without a machine are treated as
+    unconstrained capacity. In-progress steps keep their machine slot first.
+    """
+
+    def __init__(self, snapshot, backfill=True, maintenance=True):
+        self.snapshot = snapshot
+        self.backfill = backfill
+        self.maintenance = maintenance
+        self.maintenance_windows = []
+
+    @staticmethod
+    def fit_after_downtime(start, duration, windows):
+        """Earliest start >= start such that [start, start+duration) avoids every window"""
+        for window_start, window_end in windows:
+            if window_end <= start:
+                continue
+            if window_start >= start + duration:
+                break
+            start = window_end
+        return start
+
+    def run(self):
+        snapshot = self.snapshot
+        now = snapshot.now
+        steps = snapshot.steps
+        far_future = now + timedelta(days=3650)
+
+        successors = {}
+        waiting = {}
+        heap = []
+        for step in steps.values():
+            inside = [p for p in step.predecessors if p in steps]
+            for predecessor in inside:
+                successors.setdefault(predecessor, []).append(step.id)
+            if inside:
+                waiting[step.id] = len(inside)
+            else:
+                heapq.heappush(heap, (step.status != 'in_progress', step.sort_key(far_future), step.id))
+
+        from api.machine_availability import AvailabilityIndex
+        availability = AvailabilityIndex.from_snapshot(snapshot)
+        planner = None
+        if self.maintenance:
+            from api.maintenance_planner import MaintenancePlanner
+            planner = MaintenancePlanner(snapshot, availability)
+        machine_free = {}
+        placed = 0
+        while placed < len(steps):
+            if not heap:
+                # Dependency cycle: release the remaining steps in priority order
+                for step_id in list(waiting):
+                    heapq.heappush(heap, (True, steps[step_id].sort_key(far_future), step_id))
+                waiting.clear()
+
+            _, _, step_id = heapq.heappop(heap)
+            step = steps[step_id]
+            if step.start is not None:
+                continue
+            waiting.pop(step_id, None)
+
+            earliest = now
+            for predecessor in step.predecessors:
+                if predecessor in steps:
+                    done = steps[predecessor].end
+                else:
+                    done = snapshot.predecessor_done.get(predecessor)
+                if done and done > earliest:
+                    earliest = done
+
+            if step.status == 'in_progress' and step.started_at:
+                start = step.started_at
+                end = max(now, start + step.duration)
+            else:
+                start = earliest
+                if step.machine_id:
+                    if not self.backfill:
+                        start = max(start, machine_free.get(step.machine_id, now))
+                    start = availability.earliest_slot(step.machine_id, start, step.duration)
+                    if planner is not None and planner.before_step(step.machine_id, start, step.duration):
+                        start = availability.earliest_slot(step.machine_id, earliest, step.duration)
+                        planner.after_step(step.machine_id, start, step.duration)
+                end = start + step.duration
+
+            step.start, step.end = start, end
+            if step.machine_id:
+                availability.book(step.machine_id, start, end)
+                machine_free[step.machine_id] = max(machine_free.get(step.machine_id, now), end)
+            placed += 1
+
+            for successor_id in successors.get(step_id, ()):
+                if successor_id in waiting:
+                    waiting[successor_id] -= 1
+                    if waiting[successor_id] <= 0:
+                        waiting.pop(successor_id)
+                        heapq.heappush(heap, (True, steps[successor_id].sort_key(far_future), successor_id))
+
+        if planner is not None:
+            self.maintenance_windows = planner.windows
+        self._assign_queue_positions()
+        return steps
+
+    def _assign_queue_positions(self):
+        per_machine = {}
+        for step in self.snapshot.steps.values():
+            if step.machine_id:
+                per_machine.setdefault(step.machine_id, []).append(step)
+        for queue in per_machine.values():
+            queue.sort(key=lambda s: (s.start, s.id))
+            for position, step in enumerate(queue, start=1):
+                step.queue_position = position
+
+
+class FiniteCapacityScheduler:
+    """Load -> plan in memory -> one bulk_update"""
+
+    UPDATE_FIELDS = ['estimated_start', 'estimated_end', 'estimated_duration_minutes', 'setup_minutes', 'queue_position']
+
+    @staticmethod
+    def write_plan(planned_steps):
+        """Write the steps whose plan changed; returns how many were written"""
+        rows = []
+        for step in planned_steps:
+            values = (
+                step.start, step.end, int(round(step.duration.total_seconds() / 60)),
+                None,  # plain estimate: one full setup
+                step.queue_position,
+            )
+            if values != step.stored:
+                rows.append(values + (step.id,))
+        written = update_rows(ProductionStep, FiniteCapacityScheduler.UPDATE_FIELDS, rows)
+        from api.capacity_timeline import CapacityTimeline
+        CapacityTimeline.invalidate()
+        from api.capable_to_promise import PromiseState
+        PromiseState.invalidate()
+        from api.delivery_forecast import BacklogDistribution
+        BacklogDistribution.invalidate()
+        return written
+
+    @staticmethod
+    def replan(now=None, commit=True):
+        """
+        Replan every open step.
+
+        Returns: {
+            'scheduled': int,
+            'late_steps': int (estimated_end after order deadline),
+            'makespan_end': datetime or None,
+            'maintenance': [MaintenanceWindow] planned into this replan,
+            'plan': {step_id: PlannedStep}
+        }
+        """
+        snapshot = ShopSnapshot.load(now)
+        scheduler = ListScheduler(snapshot)
+        steps = scheduler.run()
+        if commit:
+            from api.maintenance_planner import MaintenancePlanner
+            MaintenancePlanner.write(scheduler.maintenance_windows, snapshot.now)
+            if steps:
+                FiniteCapacityScheduler.write_plan(steps.values())
+
+        ends = [step.end for step in steps.values()]
+        return {
+            'scheduled': len(steps),
+            'late_steps': sum(1 for s in steps.values() if s.deadline and s.end > s.deadline),
+            'makespan_end': max(ends) if ends else None,
+            'maintenance': scheduler.maintenance_windows,
+            'plan': steps,
+        }
+
+
+class IncrementalRescheduler:
+    """
+    Propagates a change at a few steps to their successors only.
+
+    The graph is implicit in the stored plan: a step's predecessors are its
+    depends_on_step, its extra_dependencies (non-linear routings) and the
+    open step just before it in its machine queue.
+    Affected steps are visited in order of their previous estimated_start
+    (a topological order for a feasible plan); a step whose recomputed
+    times equal the stored ones stops the propagation along that branch.
+    Rows are fetched on demand, so the work is O(affected steps). Callers
+    that move many steps at once (queue resequencing) call around() first:
+    the queues, downtimes and links of the machines the propagation reaches
+    are then read a batch at a time - a handful of queries per wave of
+    newly reached machines - and nothing outside them is loaded.
+    """
+
+    FIELDS = (
+        'id', 'status', 'machine_id', 'depends_on_step_id', 'queue_position',
+        'estimated_start', 'estimated_end', 'estimated_duration_minutes',
+        'started_at', 'completed_at',
+    )
+    MAX_STEPS = 10000
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.rows = {}
+        self.changed = {}
+        self._downtimes = {}
+        self._extra = {}
+        self._batched = False
+        self._linked = set()
+        self._dependents = {}
+        self._queues = {}
+
+    # -- batch loading -------------------------------------------------------
+
+    def around(self, step_ids):
+        """Batch mode, starting with the machines and links of step_ids"""
+        self._batched = True
+        self._expand([
+            self._remember(row)
+            for row in ProductionStep.objects.filter(id__in=list(step_ids)).values(*self.FIELDS)
+        ])
+        return self
+
+    def _expand(self, rows):
+        """
+        Load the open queue and downtimes of every machine of `rows` not seen
+        yet, then the successors, extra links and predecessors of those queues
+        (and of machineless rows): a few queries per level of machineless
+        steps, whatever the number of rows.
+        """
+        machines = {row['machine_id'] for row in rows if row['machine_id'] and row['machine_id'] not in self._queues}
+        linking = {row['id'] for row in rows if not row['machine_id']}
+        if machines:
+            queues = {machine_id: [] for machine_id in machines}
+            for row in ProductionStep.objects.filter(
+                machine_id__in=list(machines), status__in=OPEN_STATUSES
+            ).values(*self.FIELDS):
+                row = self._remember(row)
+                linking.add(row['id'])
+                if row['queue_position'] is not None:
+                    queues[row['machine_id']].append(row)
+            for machine_id, queue in queues.items():
+                queue.sort(key=lambda r: (r['queue_position'], r['id']))
+                self._queues[machine_id] = (queue, [r['queue_position'] for r in queue])
+            windows = ShopSnapshot.downtime_windows(list(machines), self.now)
+            for machine_id in machines:
+                self._downtimes[machine_id] = windows.get(machine_id, [])
+
+        # Machineless successors have no queue to arrive with: link them here
+        # too, a level at a time, rather than one wave each
+        linking -= self._linked
+        while linking:
+            self._link(linking)
+            linking = {
+                successor['id'] for step_id in linking for successor in self._dependents[step_id]
+                if not successor['machine_id']
+            } | {
+                other for step_id in linking for other in self._extra[step_id][1]
+                if other in self.rows and not self.rows[other]['machine_id']
+            }
+            linking -= self._linked
+
+    def _link(self, linking):
+        """Successors, extra links and missing predecessors of `linking`: three queries"""
+        self._linked |= linking
+        for step_id in linking:
+            self._dependents[step_id] = []
+            self._extra[step_id] = ([], [])
+        for row in ProductionStep.objects.filter(
+            depends_on_step_id__in=list(linking), status__in=OPEN_STATUSES
+        ).values(*self.FIELDS):
+            row = self._remember(row)
+            self._dependents[row['depends_on_step_id']].append(row)
+        through = ProductionStep.extra_dependencies.through
+        for from_id, to_id in through.objects.filter(
+            Q(from_productionstep_id__in=list(linking)) | Q(to_productionstep_id__in=list(linking))
+        ).values_list('from_productionstep_id', 'to_productionstep_id'):
+            if from_id in linking:
+                self._extra[from_id][0].append(to_id)
+            if to_id in linking:
+                self._extra[to_id][1].append(from_id)
+
+        missing = {
+            other for step_id in linking
+            for other in (self.rows[step_id]['depends_on_step_id'], *self._extra[step_id][0], *self._extra[step_id][1])
+            if other and other not in self.rows
+        }
+        if missing:
+            for row in ProductionStep.objects.filter(id__in=list(missing)).values(*self.FIELDS):
+                self._remember(row)
+
+    def dependents(self, step_ids):
+        """Open steps waiting on any of step_ids (depends_on_step or extra dependencies)"""
+        found = {}
+        for step_id in step_ids:
+            row = self._row(step_id)
+            if row is None:
+                continue
+            for successor in self._link_successors(row):
+                found[successor['id']] = successor
+        return list(found.values())
+
+    # -- on-demand loading -------------------------------------------------
+
+    def _remember(self, row):
+        if row is None:
+            return None
+        return self.rows.setdefault(row['id'], row)
+
+    def _row(self, step_id):
+        if step_id not in self.rows and not self._batched:
+            self._remember(ProductionStep.objects.filter(id=step_id).values(*self.FIELDS).first())
+        return self.rows.get(step_id)
+
+    def _rows(self, step_ids):
+        missing = [step_id for step_id in step_ids if step_id not in self.rows]
+        if missing and not self._batched:
+            for row in ProductionStep.objects.filter(id__in=missing).values(*self.FIELDS):
+                self._remember(row)
+        return [self.rows[step_id] for step_id in step_ids if step_id in self.rows]
+
+    def _extra_links(self, step_id):
+        """(extra predecessor ids, extra successor ids) of a step: one query for both"""
+        if self._batched:
+            return self._extra.get(step_id, ((), ()))
+        if step_id not in self._extra:
+            predecessors, successors = [], []
+            through = ProductionStep.extra_dependencies.through
+            for from_id, to_id in through.objects.filter(
+                Q(from_productionstep_id=step_id) | Q(to_productionstep_id=step_id)
+            ).values_list('from_productionstep_id', 'to_productionstep_id'):
+                if from_id == step_id:
+                    predecessors.append(to_id)
+                else:
+                    successors.append(from_id)
+            self._extra[step_id] = (predecessors, successors)
+        return self._extra[step_id]
+
+    def _machine_neighbour(self, row, after):
+        if not row['machine_id'] or row['queue_position'] is None:
+            return None
+        if self._batched:
+            queue, positions = self._queues.get(row['machine_id'], ((), ()))
+            if after:
+                i = bisect.bisect_right(positions, row['queue_position'])
+                return queue[i] if i < len(queue) else None
+            i = bisect.bisect_left(positions, row['queue_position']) - 1
+            return queue[i] if i >= 0 else None
+        qs = ProductionStep.objects.filter(
+            machine_id=row['machine_id'], status__in=OPEN_STATUSES
+        ).exclude(id=row['id'])
+        if after:
+            qs = qs.filter(queue_position__gt=row['queue_position']).order_by('queue_position', 'id')
+        else:
+            qs = qs.filter(queue_position__lt=row['queue_position']).order_by('-queue_position', '-id')
+        return self._remember(qs.values(*self.FIELDS).first())
+
+    def _link_successors(self, row):
+        if self._batched:
+            successors = list(self._dependents.get(row['id'], ()))
+        else:
+            successors = [
+                self._remember(r) for r in
+                ProductionStep.objects.filter(
+                    depends_on_step_id=row['id'], status__in=OPEN_STATUSES
+                ).values(*self.FIELDS)
+            ]
+        successors += [
+            successor for successor in self._rows(self._extra_links(row['id'])[1])
+            if successor['status'] in OPEN_STATUSES
+        ]
+        return successors
+
+    def _successors(self, row):
+        successors = self._link_successors(row)
+        machine_next = self._machine_neighbour(row, after=True)
+        if machine_next:
+            successors.append(machine_next)
+        return successors
+
+    def _machine_downtimes(self, machine_id):
+        if machine_id not in self._downtimes and not self._batched:
+            windows = ShopSnapshot.downtime_windows([machine_id], self.now)
+            self._downtimes[machine_id] = windows.get(machine_id, [])
+        return self._downtimes.get(machine_id, [])
+
+    # -- recomputation -------------------------------------------------------
+
+    @staticmethod
+    def _end_of(row):
+        if row is None:
+            return None
+        if row['status'] == 'completed':
+            return row['completed_at'] or row['estimated_end']
+        return row['estimated_end']
+
+    def _compute(self, row):
+        duration = timedelta(minutes=row['estimated_duration_minutes'] or DEFAULT_DURATION_MINUTES)
+        if row['status'] == 'completed':
+            return row['estimated_start'], row['completed_at'] or row['estimated_end']
+        if row['status'] == 'in_progress' and row['started_at']:
+            return row['started_at'], max(self.now, row['started_at'] + duration)
+
+        start = self.now
+        for predecessor in (
+            self._row(row['depends_on_step_id']) if row['depends_on_step_id'] else None,
+            *self._rows(self._extra_links(row['id'])[0]),
+            self._machine_neighbour(row, after=False),
+        ):
+            end = self._end_of(predecessor)
+            if end and end > start:
+                start = end
+        if row['machine_id']:
+            start = ListScheduler.fit_after_downtime(start, duration, self._machine_downtimes(row['machine_id']))
+        return start, start + duration
+
+    def reschedule(self, step_ids, commit=True):
+        """
+        Recompute the given steps and everything downstream that moves.
+        Returns the list of step ids whose estimated times changed.
+        """
+        far_future = self.now + timedelta(days=3650)
+        heap = []
+        for step_id in step_ids:
+            row = self._row(step_id)
+            if row:
+                heapq.heappush(heap, (row['estimated_start'] or self.now, row['id']))
+
+        visits = 0
+        while heap and visits < self.MAX_STEPS:
+            _, step_id = heapq.heappop(heap)
+            row = self.rows[step_id]
+            visits += 1
+            if self._batched and step_id not in self._linked:
+                # Everything waiting in the heap is loaded in the same batch
+                self._expand([row] + [self.rows[other] for _, other in heap])
+
+            start, end = self._compute(row)
+            if start == row['estimated_start'] and end == row['estimated_end']:
+                continue  # unchanged: nothing downstream moves because of this step
+
+            row['estimated_start'], row['estimated_end'] = start, end
+            if row['status'] != 'completed':
+                self.changed[step_id] = row
+            for successor in self._successors(row):
+                heapq.heappush(heap, (successor['estimated_start'] or far_future, successor['id']))
+
+        if commit and self.changed:
+            update_rows(ProductionStep, ['estimated_start', 'estimated_end'], [
+                (row['estimated_start'], row['estimated_end'], row['id']) for row in self.changed.values()
+            ])
+            from api.capacity_timeline import CapacityTimeline
+            CapacityTimeline.invalidate()
+            from api.capable_to_promise import PromiseState
+            PromiseState.invalidate()
+            from api.delivery_forecast import BacklogDistribution
+            BacklogDistribution.invalidate()
+        return list(self.changed)
+
+    @classmethod
+    def on_step_changed(cls, step_id):
+        """Call after a step's status/duration/machine changes"""
+        return cls().reschedule([step_id])
+
+    @classmethod
+    def on_machine_changed(cls, machine_id, since=None):
+        """Call after a downtime is added or resolved: reseed the machine's first affected step"""
+        since = since or timezone.now()
+        first = ProductionStep.objects.filter(
+            machine_id=machine_id, status__in=OPEN_STATUSES, estimated_end__gt=since
+        ).order_by('queue_position', 'estimated_start').values_list('id', flat=True).first()
+        if first is None:
+            return []
+        return cls().reschedule([first])
@@ -0,0 +1,273 @@
+"""
+Machine Availability Index
+Busy time per machine (booked steps and downtimes) as sorted intervals.
+
+Each machine keeps its busy time as merged, non-overlapping intervals
+(epoch seconds) in a treap ordered by time. Every node carries its
+subtree's first start, last end and largest gap between neighbouring
+intervals, so "earliest slot of length D at or after T", "latest slot
+before a moment", a booking and a release are each a split, a descent
+and a merge: O(log n) expected, whatever the number of bookings.
+
+Nodes are never changed once built - split and merge copy the path they
+touch - so a copy of a machine shares everything with the original and
+costs nothing, which capable-to-promise uses for its tentative routes.
+The index is built on demand for one planning run - from a
+ShopSnapshot's downtimes, or from the database for a handful of
+machines - and updated as steps are placed, which lets the scheduler
+backfill gaps instead of only appending after a machine's last job.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from api.finite_scheduler import OPEN_STATUSES, ShopSnapshot
+from api.models import ProductionStep
+
+_NO_GAP = float('-inf')
+
+
+def _seconds(moment):
+    return moment.timestamp()
+
+
+def _moment(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+class _Node:
+    """One busy interval and the aggregates of the subtree under it"""
+
+    __slots__ = ('start', 'end', 'priority', 'left', 'right', 'size', 'first_start', 'last_end', 'gap')
+
+    def __init__(self, start, end, priority, left=None, right=None):
+        self.start = start
+        self.end = end
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1
+        self.first_start = start
+        self.last_end = end
+        self.gap = _NO_GAP
+        if left is not None:
+            self.size += left.size
+            self.first_start = left.first_start
+            self.gap = max(left.gap, start - left.last_end)
+        if right is not None:
+            self.size += right.size
+            self.last_end = right.last_end
+            self.gap = max(self.gap, right.gap, right.first_start - end)
+
+
+def _with(node, left, right):
+    return _Node(node.start, node.end, node.priority, left, right)
+
+
+def _split(node, goes_left):
+    """(intervals for which goes_left holds, the rest); goes_left must be monotone in time"""
+    if node is None:
+        return None, None
+    if goes_left(node):
+        left, right = _split(node.right, goes_left)
+        return _with(node, node.left, left), right
+    left, right = _split(node.left, goes_left)
+    return left, _with(node, right, node.right)
+
+
+def _merge(left, right):
+    """Join two treaps, every interval of `left` before every interval of `right`"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return _with(left, left.left, _merge(left.right, right))
+    return _with(right, _merge(left, right.left), right.right)
+
+
+def _first_gap_end(node, seconds):
+    """End of the interval before the first gap at least `seconds` long, or None"""
+    while node is not None and node.gap >= seconds:
+        left, right = node.left, node.right
+        if left is not None and left.gap >= seconds:
+            node = left
+        elif left is not None and node.start - left.last_end >= seconds:
+            return left.last_end
+        elif right is not None and right.first_start - node.end >= seconds:
+            return node.end
+        else:
+            node = right
+    return None
+
+
+def _last_gap_start(node, seconds):
+    """Start of the interval after the last gap at least `seconds` long, or None"""
+    while node is not None and node.gap >= seconds:
+        left, right = node.left, node.right
+        if right is not None and right.gap >= seconds:
+            node = right
+        elif right is not None and right.first_start - node.end >= seconds:
+            return right.first_start
+        elif left is not None and node.start - left.last_end >= seconds:
+            return node.start
+        else:
+            node = left
+    return None
+
+
+class MachineAvailability:
+    """Merged busy intervals of one machine in a gap-augmented treap"""
+
+    __slots__ = ('_root',)
+
+    def __init__(self, intervals=()):
+        self._root = None
+        for start, end in sorted(intervals):
+            self.book(start, end)
+
+    def __len__(self):
+        return self._root.size if self._root is not None else 0
+
+    def intervals(self):
+        result, stack, node = [], [], self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append((_moment(node.start), _moment(node.end)))
+            node = node.right
+        return result
+
+    def copy(self):
+        """Independent availability sharing the current intervals: O(1)"""
+        duplicate = MachineAvailability()
+        duplicate._root = self._root
+        return duplicate
+
+    def last_end(self):
+        """End of the last busy interval, or None"""
+        return _moment(self._root.last_end) if self._root is not None else None
+
+    # -- updates -------------------------------------------------------------
+
+    def book(self, start, end):
+        """Mark [start, end) busy, merging with overlapping or touching intervals"""
+        s, e = _seconds(start), _seconds(end)
+        if e <= s:
+            return
+        before, rest = _split(self._root, lambda node: node.end < s)
+        touched, after = _split(rest, lambda node: node.start <= e)
+        if touched is not None:
+            s = min(s, touched.first_start)
+            e = max(e, touched.last_end)
+        self._root = _merge(_merge(before, _Node(s, e, random.random())), after)
+
+    def release(self, start, end):
+        """Free [start, end); only release what was booked, downtime under it is freed too"""
+        s, e = _seconds(start), _seconds(end)
+        if e <= s:
+            return
+        before, rest = _split(self._root, lambda node: node.end <= s)
+        touched, after = _split(rest, lambda node: node.start < e)
+        if touched is None:
+            return
+        if touched.first_start < s:
+            before = _merge(before, _Node(touched.first_start, s, random.random()))
+        if touched.last_end > e:
+            after = _merge(_Node(e, touched.last_end, random.random()), after)
+        self._root = _merge(before, after)
+
+    # -- queries -------------------------------------------------------------
+
+    def _first_ending_after(self, seconds):
+        """The earliest interval ending after `seconds`, or None"""
+        node, found = self._root, None
+        while node is not None:
+            if node.end > seconds:
+                found, node = node, node.left
+            else:
+                node = node.right
+        return found
+
+    def is_free(self, start, end):
+        following = self._first_ending_after(_seconds(start))
+        return following is None or following.start >= _seconds(end)
+
+    def earliest_slot(self, after, duration):
+        """Earliest start >= after such that [start, start + duration) is free"""
+        t = _seconds(after)
+        d = duration.total_seconds()
+        following = self._first_ending_after(t)
+        if following is None or following.start - t >= d:
+            return after
+        _, rest = _split(self._root, lambda node: node.end <= t)
+        gap_end = _first_gap_end(rest, d)
+        return _moment(gap_end if gap_end is not None else rest.last_end)
+
+    def latest_slot(self, after, before, duration):
+        """Latest start in [after, before - duration] such that the slot is free, or None"""
+        lo, hi = _seconds(after), _seconds(before)
+        d = duration.total_seconds()
+        _, rest = _split(self._root, lambda node: node.end <= lo)
+        between, _ = _split(rest, lambda node: node.start < hi)
+        if between is None:
+            return _moment(hi - d) if hi - lo >= d else None
+        if hi - between.last_end >= d:
+            return _moment(hi - d)
+        gap_start = _last_gap_start(between, d)
+        if gap_start is not None:
+            return _moment(gap_start - d)
+        if min(between.first_start, hi) - lo >= d:
+            return _moment(min(between.first_start, hi) - d)
+        return None
+
+    def free_at(self, after):
+        """First moment >= after that is not inside a busy interval"""
+        return self.earliest_slot(after, timedelta(0))
+
+
+class AvailabilityIndex:
+    """MachineAvailability per machine for one planning run"""
+
+    def __init__(self, busy=None):
+        """busy: {machine_id: [(start, end)]}"""
+        self.machines = {
+            machine_id: MachineAvailability(intervals)
+            for machine_id, intervals in (busy or {}).items()
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Downtimes only: the scheduler books steps as it places them"""
+        return cls(snapshot.downtimes)
+
+    @classmethod
+    def load(cls, machine_ids, now=None, exclude_step_ids=()):
+        """Downtimes and booked open steps of the given machines: two queries"""
+        now = now or timezone.now()
+        busy = {machine_id: list(windows) for machine_id, windows in ShopSnapshot.downtime_windows(machine_ids, now).items()}
+        for machine_id, start, end in ProductionStep.objects.filter(
+            machine_id__in=machine_ids, status__in=OPEN_STATUSES,
+            estimated_start__isnull=False, estimated_end__gt=now,
+        ).exclude(id__in=list(exclude_step_ids)).values_list('machine_id', 'estimated_start', 'estimated_end'):
+            busy.setdefault(machine_id, []).append((start, end))
+        return cls(busy)
+
+    def machine(self, machine_id):
+        availability = self.machines.get(machine_id)
+        if availability is None:
+            availability = self.machines[machine_id] = MachineAvailability()
+        return availability
+
+    def earliest_slot(self, machine_id, after, duration):
+        return self.machine(machine_id).earliest_slot(after, duration)
+
+    def book(self, machine_id, start, end):
+        self.machine(machine_id).book(start, end)
+
+    def release(self, machine_id, start, end):
+        self.machine(machine_id).release(start, end)
@@ -0,0 +1,144 @@
+"""
+Maintenance Planner
+Planned maintenance windows placed inside each replan.
+
+A machine is due for service every maintenance_interval_hours of running
+time; current_operating_hours is what it has run since the last service.
+While the scheduler places steps, the planner adds each machine step's
+hours to the machine's projection. When the next step would carry the
+machine past its interval, a MAINTENANCE_HOURS window is booked in the
+availability index before that step. The window goes in the least
+disruptive slot: the latest free gap on the machine between now and
+the step, so no placed work moves and as little service life as
+possible is given away. If there is no such gap the window takes the
+step's slot and the step follows it. The projection then restarts from
+the hours of already placed work that now runs after the window.
+
+Planned windows are never resolved by hand, so a window that has passed
+counts as the service it stood for. The projection of that machine
+starts from zero, and on commit its operating hours are reset with
+last_maintenance_date set to the window's end.
+
+All state comes with the ShopSnapshot; the planner adds no queries to a
+replan and a constant amount of work per machine step. On commit the
+windows are stored as planned MachineDowntime rows, replacing those of
+the previous replan.
+"""
+
+from datetime import timedelta
+
+from django.db.models import F, Max, Q
+
+from api.models import MachineDowntime, MachineSettings
+
+MAINTENANCE_HOURS = 4
+PLANNED_DESCRIPTION = "Rejalashtirilgan profilaktika (xizmat oralig'i)"
+
+
+class MaintenanceWindow:
+    __slots__ = ('machine_id', 'start', 'end', 'due_hours')
+
+    def __init__(self, machine_id, start, end, due_hours):
+        self.machine_id = machine_id
+        self.start = start
+        self.end = end
+        self.due_hours = due_hours
+
+    def as_dict(self):
+        return {
+            'machine_id': str(self.machine_id),
+            'start': self.start,
+            'end': self.end,
+            'operating_hours_at_start': round(self.due_hours, 2),
+        }
+
+
+class MaintenancePlanner:
+    def __init__(self, snapshot, availability, window_hours=MAINTENANCE_HOURS):
+        self.now = snapshot.now
+        self.availability = availability
+        self.window = timedelta(hours=window_hours)
+        self.interval = {}
+        self.hours = {}
+        self.counted = {}  # machine_id -> [(start, hours)] of steps counted since the last window
+        for machine_id, machine in snapshot.machines.items():
+            interval = machine.get('maintenance_interval_hours') or 0
+            if machine['is_active'] and interval > 0:
+                self.interval[machine_id] = float(interval)
+                self.hours[machine_id] = float(machine.get('current_operating_hours') or 0)
+                self.counted[machine_id] = []
+                serviced = machine.get('last_planned_service')
+                last = machine.get('last_maintenance_date')
+                if serviced and (last is None or serviced > last):
+                    self.hours[machine_id] = 0.0
+        self.windows = []
+
+    def before_step(self, machine_id, start, duration):
+        """
+        Called with the slot a step is about to take. Books a window if the
+        step would overrun the service interval; returns True if it did (the
+        step must then look for its slot again).
+        """
+        interval = self.interval.get(machine_id)
+        if interval is None:
+            return False
+        hours = self.hours[machine_id]
+        step_hours = duration.total_seconds() / 3600.0
+        if hours + step_hours <= interval:
+            self.hours[machine_id] = hours + step_hours
+            self.counted[machine_id].append((start, step_hours))
+            return False
+
+        availability = self.availability.machine(machine_id)
+        window_start = availability.latest_slot(self.now, start, self.window)
+        if window_start is None:
+            window_start = availability.earliest_slot(start, self.window)
+        window_end = window_start + self.window
+        availability.book(window_start, window_end)
+        # Counted work placed after the window runs on the serviced machine
+        later = [(s, h) for s, h in self.counted[machine_id] if s >= window_end]
+        self.windows.append(MaintenanceWindow(
+            machine_id, window_start, window_end, hours - sum(h for _, h in later)
+        ))
+        self.counted[machine_id] = later
+        self.hours[machine_id] = sum(h for _, h in later)
+        return True
+
+    def after_step(self, machine_id, start, duration):
+        """Hours of a step placed right after a window count towards the next one"""
+        if machine_id in self.hours:
+            step_hours = duration.total_seconds() / 3600.0
+            self.hours[machine_id] += step_hours
+            self.counted[machine_id].append((start, step_hours))
+
+    @staticmethod
+    def confirm_elapsed(now):
+        """Planned windows that have passed restart their machine's service interval"""
+        elapsed = MachineDowntime.objects.filter(is_planned=True, ended_at__lte=now).filter(
+            Q(machine__last_maintenance_date__isnull=True) | Q(ended_at__gt=F('machine__last_maintenance_date'))
+        ).values('machine_id').annotate(serviced=Max('ended_at'))
+        for row in elapsed:
+            MachineSettings.objects.filter(pk=row['machine_id']).update(
+                current_operating_hours=0, last_maintenance_date=row['serviced']
+            )
+        return len(elapsed)
+
+    @staticmethod
+    def write(windows, now):
+        """Confirm the windows that have passed and replace the future ones with these"""
+        MaintenancePlanner.confirm_elapsed(now)
+        MachineDowntime.objects.filter(is_planned=True, started_at__gt=now).delete()
+        MachineDowntime.objects.bulk_create([
+            MachineDowntime(
+                machine_id=window.machine_id,
+                reason='maintenance',
+                description=PLANNED_DESCRIPTION,
+                started_at=window.start,
+                ended_at=window.end,
+                estimated_duration_hours=round((window.end - window.start).total_seconds() / 3600, 2),
+                is_active=False,
+                is_planned=True,
+            )
+            for window in windows
+        ], batch_size=500)
+        return len(windows)
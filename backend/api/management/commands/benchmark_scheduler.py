@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api import scheduler_benchmark
+from api.scheduler_benchmark import SchedulerBenchmark
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the scheduling paths on synthetic shops of 1k/10k/50k open steps and compare '
+        'latency, query counts and plan quality with the stored baseline. Runs in a throwaway '
+        'test database, like manage.py test.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(scheduler_benchmark.SIZES),
+                            help='Open steps per synthetic shop')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=str(scheduler_benchmark.BASELINE_PATH))
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store these results as the new baseline instead of comparing')
+        parser.add_argument('--latency-tolerance', type=float, default=scheduler_benchmark.LATENCY_TOLERANCE)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            reports = {}
+            for size in options['sizes']:
+                reports[size] = SchedulerBenchmark(size, seed=options['seed']).run()
+                self._print(size, reports[size])
+                self._reset()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['save_baseline']:
+            scheduler_benchmark.save_baseline(reports, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}."))
+            return
+
+        baseline = scheduler_benchmark.load_baseline(options['baseline'])
+        regressions = []
+        for size, report in reports.items():
+            if str(size) not in baseline:
+                self.stdout.write(self.style.WARNING(f'{size} steps: no baseline to compare with.'))
+                continue
+            for case, metric, before, after in scheduler_benchmark.compare(
+                report, baseline[str(size)], latency_tolerance=options['latency_tolerance']
+            ):
+                regressions.append(f'{size} steps, {case} {metric}: {before} -> {after}')
+        if regressions:
+            raise CommandError('Scheduler regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def _print(self, size, report):
+        self.stdout.write(
+            f"{size} steps: {report['steps']} steps, {report['orders']} orders, "
+            f"{report['machines']} machines (built in {report['build_ms']} ms)"
+        )
+        for case, figures in report['cases'].items():
+            self.stdout.write(
+                f"  {case:<28} {figures['ms_per_call']:>10} ms/call {figures['queries_per_call']:>8} queries/call"
+            )
+        quality = report['quality']
+        self.stdout.write(
+            f"  quality: {quality['late_orders']}/{quality['orders']} orders late, "
+            f"weighted tardiness {quality['weighted_tardiness_hours']} h, makespan {quality['makespan_hours']} h"
+        )
+
+    @staticmethod
+    def _reset():
+        """Empty the test database between sizes"""
+        from django.core.management import call_command
+        call_command('flush', interactive=False, verbosity=0)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from api.efficiency_learner import EfficiencyLearner
+
+class Command(BaseCommand):
+    help = 'Update employee efficiency rates from the time logs of steps finished since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Compute the rates without saving them')
+
+    def handle(self, *args, **options):
+        report = EfficiencyLearner.run(commit=not options['dry_run'])
+
+        for key, rate in report['rates'].items():
+            self.stdout.write(f"{key}: {rate['before']} -> {rate['after']} units/hour ({rate['samples']} samples)")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['samples']} samples, {report['rejected']} rejected; "
+            f"{report['updated']} rates updated, {report['created']} created."
+        ))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from api import step_durations
+
+class Command(BaseCommand):
+    help = 'Store working and paused minutes on completed production steps that have none yet'
+
+    def handle(self, *args, **options):
+        written = step_durations.materialize()
+        self.stdout.write(self.style.SUCCESS(f'{written} production step durations written.'))
@@ -7,6 +7,7 @@ from decimal import Decimal
 from typing import Dict, Tuple
 from django.db.models import Q
 from api.models import MaterialNormative, ProductTemplate
+from api.money import Quantity
 
 
 class MaterialConsumptionCalculator:
@@ -36,16 +37,14 @@ class MaterialConsumptionCalculator:
         Returns:
             Tuple of (total_m2, breakdown_dict)
         """
-        # Convert cm² to m²
-        area_per_unit_cm2 = Decimal(str(width_cm)) * Decimal(str(height_cm))
-        area_per_unit_m2 = area_per_unit_cm2 / Decimal('10000')
+        # Convert cm² to m² (fixed-point, micro-m² resolution)
+        area_per_unit_m2 = (Quantity.of(width_cm) * Quantity.of(height_cm)).divide(10000)
         
         # Calculate base consumption
-        base_consumption_m2 = area_per_unit_m2 * Decimal(str(quantity))
+        base_consumption_m2 = area_per_unit_m2 * int(quantity)
         
         # Add waste
-        waste_multiplier = Decimal('1') + (Decimal(str(waste_percent)) / Decimal('100'))
-        total_consumption_m2 = base_consumption_m2 * waste_multiplier
+        total_consumption_m2 = base_consumption_m2.with_waste(waste_percent)
         
         breakdown = {
             'width_cm': float(width_cm),
@@ -58,7 +57,7 @@ class MaterialConsumptionCalculator:
             'total_consumption_m2': float(total_consumption_m2),
         }
         
-        return total_consumption_m2, breakdown
+        return total_consumption_m2.to_decimal(), breakdown
     
     @staticmethod
     def calculate_ink_consumption(
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:59
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def populate_cost_index(apps, schema_editor):
+    Material = apps.get_model('api', 'Material')
+    MaterialBatch = apps.get_model('api', 'MaterialBatch')
+
+    totals = {
+        row['material_id']: (row['qty'] or 0, row['value'] or 0)
+        for row in MaterialBatch.objects.filter(is_active=True, current_quantity__gt=0)
+        .values('material_id')
+        .annotate(qty=Sum('current_quantity'), value=Sum(F('current_quantity') * F('cost_per_unit')))
+    }
+    materials = list(Material.objects.filter(id__in=totals.keys()))
+    for material in materials:
+        material.usable_stock, material.stock_value = totals[material.id]
+    Material.objects.bulk_update(materials, ['usable_stock', 'stock_value'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_order_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='stock_value',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, help_text='Faol partiyalar qiymati (miqdor x tannarx)', max_digits=24),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='usable_stock',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Faol partiyalardagi ishlatiladigan miqdor', max_digits=20),
+        ),
+        migrations.RunPython(populate_cost_index, migrations.RunPython.noop),
+    ]
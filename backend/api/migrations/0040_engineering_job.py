@@ -0,0 +1,31 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_material_cost_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EngineeringJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_hash', models.CharField(help_text='Fingerprint of the inputs used', max_length=64)),
+                ('layout_description', models.CharField(blank=True, max_length=255, null=True)),
+                ('waste_percent_used', models.FloatField(default=0)),
+                ('paper_sheets', models.IntegerField(default=0)),
+                ('material_usage', models.JSONField(default=dict)),
+                ('knife_length_m', models.FloatField(default=0)),
+                ('printing_hours', models.FloatField(default=0)),
+                ('cutting_hours', models.FloatField(default=0)),
+                ('cost_data', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='engineering_job', to='api.order')),
+            ],
+        ),
+    ]
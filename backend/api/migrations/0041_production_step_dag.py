@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_engineering_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionstep',
+            name='extra_dependencies',
+            field=models.ManyToManyField(blank=True, help_text="Qo'shimcha oldingi bosqichlar (parallel marshrut uchun)", related_name='extra_dependent_steps', to='api.productionstep'),
+        ),
+        migrations.AddField(
+            model_name='producttemplaterouting',
+            name='depends_on_sequences',
+            field=models.JSONField(blank=True, help_text="Oldingi bosqichlar tartib raqamlari; bo'sh bo'lsa oldingi bosqich, [] bo'lsa boshidan", null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_production_step_dag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employeeefficiency',
+            name='learned_through',
+            field=models.DateTimeField(blank=True, help_text='Hisobga olingan oxirgi FINISH yozuvi vaqti', null=True),
+        ),
+        migrations.AddField(
+            model_name='employeeefficiency',
+            name='sample_count',
+            field=models.IntegerField(default=0, help_text="Ish vaqti yozuvlaridan o'rganilgan namunalar soni"),
+        ),
+    ]
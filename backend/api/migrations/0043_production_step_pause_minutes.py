@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_employee_efficiency_learning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionstep',
+            name='pause_breakdown',
+            field=models.JSONField(blank=True, help_text="Pauza sabablari bo'yicha daqiqalar", null=True),
+        ),
+        migrations.AddField(
+            model_name='productionstep',
+            name='paused_minutes',
+            field=models.IntegerField(blank=True, help_text="Pauzalarda o'tgan vaqt (daqiqa)", null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_production_step_pause_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='machinedowntime',
+            name='is_planned',
+            field=models.BooleanField(default=False, help_text="Rejalashtiruvchi qo'ygan profilaktika oynasi (har replan qayta joylanadi)"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_machine_downtime_is_planned'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionstep',
+            name='setup_minutes',
+            field=models.IntegerField(blank=True, help_text="Taxminiy davomiylikdagi sozlash vaqti (daqiqa); bo'sh bo'lsa - to'liq sozlash", null=True),
+        ),
+    ]
@@ -137,6 +137,18 @@ class PricingSettings(models.Model):
             obj.save()
         return obj
 
+    @classmethod
+    def load_readonly(cls):
+        """Like load(), but never writes: defaults are applied in memory only"""
+        obj = cls.objects.filter(pk=1).first() or cls(pk=1)
+        if not obj.pricing_profiles:
+            obj.pricing_profiles = {
+                "VIP": 15,
+                "Standard": 20,
+                "Wholesale": 10
+            }
+        return obj
+
     def __str__(self):
         return "Global Pricing Settings"
 
@@ -255,10 +267,43 @@ class Material(models.Model):
     thickness_mm = models.FloatField(default=0, help_text="Material qalinligi (mm)")
     weight_gsm = models.IntegerField(default=0, help_text="Og'irligi (g/m2)")
     
+    # Cost index (maintained by MaterialCostIndex from batch deltas)
+    usable_stock = models.DecimalField(
+        max_digits=20,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        help_text="Faol partiyalardagi ishlatiladigan miqdor"
+    )
+    stock_value = models.DecimalField(
+        max_digits=24,
+        decimal_places=4,
+        default=0,
+        editable=False,
+        help_text="Faol partiyalar qiymati (miqdor x tannarx)"
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        # usable_stock / stock_value are maintained with F() deltas by the cost
+        # index; a full save must not write back a stale in-memory copy
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('usable_stock', 'stock_value')
+            ]
+        super().save(*args, **kwargs)
+    
+    @property
+    def weighted_avg_cost(self):
+        """Weighted-average cost per unit over usable batches"""
+        if self.usable_stock and self.usable_stock > 0:
+            return self.stock_value / self.usable_stock
+        return None
 
 class MaterialBatch(models.Model):
     QUALITY_STATUS_CHOICES = (
@@ -310,6 +355,23 @@ class MaterialBatch(models.Model):
     class Meta:
         ordering = ['received_date'] # For FIFO
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this batch contributed to the cost index when loaded,
+        # so a later save can be applied as a delta
+        if {'material_id', 'current_quantity', 'cost_per_unit', 'is_active'} <= set(field_names):
+            instance._cost_index_state = instance.cost_index_contribution()
+        return instance
+    
+    def cost_index_contribution(self):
+        """(material_id, usable quantity, stock value) this batch adds to the cost index"""
+        from decimal import Decimal
+        quantity = Decimal(str(self.current_quantity or 0))
+        if not self.is_active or quantity <= 0:
+            return (self.material_id, Decimal('0'), Decimal('0'))
+        return (self.material_id, quantity, quantity * Decimal(str(self.cost_per_unit or 0)))
+    
     def block(self, user, reason):
         """Block this batch from use"""
         self.quality_status = 'blocked'
@@ -571,6 +633,37 @@ class OrderGeometry(models.Model):
     def __str__(self):
         return f"Geometry for Order {self.order.order_number}"
 
+class EngineeringJob(models.Model):
+    """
+    Computed engineering data for an order: layout, sheets, material usage,
+    knife length and machine time. Computed once and reused by approval,
+    reservation and the first-step FIFO deduction; recomputed only when
+    input_hash (order specs + waste settings) no longer matches.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='engineering_job')
+    input_hash = models.CharField(max_length=64, help_text="Fingerprint of the inputs used")
+    
+    # Layout
+    layout_description = models.CharField(max_length=255, blank=True, null=True)
+    waste_percent_used = models.FloatField(default=0)
+    paper_sheets = models.IntegerField(default=0)
+    
+    # Material usage (kg) as returned by CalculationService.calculate_material_usage
+    material_usage = models.JSONField(default=dict)
+    
+    # Die & machine time
+    knife_length_m = models.FloatField(default=0)
+    printing_hours = models.FloatField(default=0)
+    cutting_hours = models.FloatField(default=0)
+    
+    # Full CalculationService.calculate_cost result
+    cost_data = models.JSONField(default=dict)
+    
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Engineering job for Order {self.order.order_number}"
+
 class ProductionStep(models.Model):
     STEP_CHOICES = (
         ('queue', 'Navbatda'),
@@ -618,6 +711,13 @@ class ProductionStep(models.Model):
         related_name='dependent_steps',
         help_text="Ushbu bosqich qaysi bosqichga bog'liq"
     )
+    extra_dependencies = models.ManyToManyField(
+        'self',
+        symmetrical=False,
+        blank=True,
+        related_name='extra_dependent_steps',
+        help_text="Qo'shimcha oldingi bosqichlar (parallel marshrut uchun)"
+    )
     estimated_start = models.DateTimeField(
         null=True,
         blank=True,
@@ -633,11 +733,26 @@ class ProductionStep(models.Model):
         blank=True,
         help_text="Taxminiy davomiylik (daqiqa)"
     )
+    setup_minutes = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Taxminiy davomiylikdagi sozlash vaqti (daqiqa); bo'sh bo'lsa - to'liq sozlash"
+    )
     actual_duration_minutes = models.IntegerField(
         null=True,
         blank=True,
         help_text="Haqiqiy davomiylik (daqiqa)"
     )
+    paused_minutes = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Pauzalarda o'tgan vaqt (daqiqa)"
+    )
+    pause_breakdown = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Pauza sabablari bo'yicha daqiqalar"
+    )
     priority = models.IntegerField(
         default=5,
         help_text="Ustuvorlik darajasi (1=baland, 10=past)"
@@ -655,9 +770,9 @@ class ProductionStep(models.Model):
     @property
     def is_ready_to_start(self):
         """Check if this step's dependencies are complete"""
-        if not self.depends_on_step:
-            return True
-        return self.depends_on_step.status == 'completed'
+        if self.depends_on_step and self.depends_on_step.status != 'completed':
+            return False
+        return not self.extra_dependencies.exclude(status='completed').exists()
     
     @property
     def duration_minutes(self):
@@ -766,6 +881,14 @@ class EmployeeEfficiency(models.Model):
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Learned from time logs (see api/efficiency_learner.py)
+    sample_count = models.IntegerField(default=0, help_text="Ish vaqti yozuvlaridan o'rganilgan namunalar soni")
+    learned_through = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Hisobga olingan oxirgi FINISH yozuvi vaqti"
+    )
+    
     class Meta:
         ordering = ['-effective_from']
         verbose_name = "Employee Efficiency"
@@ -897,32 +1020,22 @@ class Calendar(models.Model):
     
     @classmethod
     def get_working_days_count(cls, start_date, end_date):
-        """Calculate number of working days between two dates"""
-        return cls.objects.filter(
-            date__gte=start_date,
-            date__lte=end_date,
-            is_working_day=True
-        ).count()
+        """
+        Number of working days between two dates (inclusive). Days without a
+        Calendar row count as working Monday-Friday. Served from the cached
+        working-day bitmap.
+        """
+        from api.work_calendar import working_days_count
+        return working_days_count(start_date, end_date)
     
     @classmethod
     def add_working_days(cls, start_date, days_to_add):
-        """Add working days to a date"""
-        from datetime import timedelta
-        current_date = start_date
-        days_added = 0
-        
-        while days_added < days_to_add:
-            current_date += timedelta(days=1)
-            # Check if working day
-            calendar_day = cls.objects.filter(date=current_date).first()
-            if calendar_day and calendar_day.is_working_day:
-                days_added += 1
-            elif not calendar_day:
-                # If not in calendar, assume working day (except weekends)
-                if current_date.weekday() < 5:  # Monday-Friday
-                    days_added += 1
-        
-        return current_date
+        """
+        Add working days to a date. Days without a Calendar row count as
+        working Monday-Friday. Served from the cached working-day bitmap.
+        """
+        from api.work_calendar import add_working_days
+        return add_working_days(start_date, days_to_add)
 
 
 class Shift(models.Model):
@@ -1308,6 +1421,10 @@ class MachineDowntime(models.Model):
     resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='resolved_downtimes')
     
     is_active = models.BooleanField(default=True, help_text="True if downtime is ongoing")
+    is_planned = models.BooleanField(
+        default=False,
+        help_text="Rejalashtiruvchi qo'ygan profilaktika oynasi (har replan qayta joylanadi)"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -1332,11 +1449,15 @@ class MachineDowntime(models.Model):
     
     
     def resolve(self, user):
-        """Mark downtime as resolved"""
+        """Mark downtime as resolved; finished maintenance restarts the service interval"""
         self.is_active = False
         self.ended_at = timezone.now()
         self.resolved_by = user
         self.save()
+        if self.reason == 'maintenance':
+            MachineSettings.objects.filter(pk=self.machine_id).update(
+                current_operating_hours=0, last_maintenance_date=self.ended_at
+            )
 
 
 # ========================================
@@ -1491,6 +1612,12 @@ class ProductTemplateRouting(BaseModel):
         help_text="Sozlash vaqti (daqiqa)"
     )
     
+    depends_on_sequences = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Oldingi bosqichlar tartib raqamlari; bo'sh bo'lsa oldingi bosqich, [] bo'lsa boshidan"
+    )
+    
     # QC checkpoint
     qc_checkpoint = models.BooleanField(
         default=False,
@@ -0,0 +1,197 @@
+"""
+Fixed-point Money and Quantity
+Exact integer arithmetic for the pricing, consumption and posting paths.
+
+Money is stored in tiyin (1/100 so'm) and Quantity in micro-units
+(1/1,000,000 of the base unit, i.e. milligrams for kg, mm² for m²).
+Values are converted from Decimal/float once on the way in and back to
+Decimal only at the model boundary, so the hot loops never touch Decimal.
+Rounding is always half away from zero, matching ROUND_HALF_UP.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def _div_round(numerator, denominator):
+    """Integer division rounded half away from zero (denominator > 0)"""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def _to_scaled(value, scale):
+    """Convert int/Decimal/float/str to an integer count of 1/scale units"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        return int(value) * scale
+    if isinstance(value, int):
+        return value * scale
+    if isinstance(value, float):
+        # repr() is the shortest round-tripping form, so 0.1 stays 0.1
+        value = Decimal(repr(value))
+    elif not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+class Quantity:
+    """Material quantity in micro-units (kg -> mg, m² -> mm²)"""
+
+    __slots__ = ('units',)
+    SCALE = 1_000_000
+
+    def __init__(self, units=0):
+        self.units = units
+
+    @classmethod
+    def of(cls, value):
+        """From int/Decimal/float/str in base units"""
+        return cls(_to_scaled(value, cls.SCALE))
+
+    @classmethod
+    def ratio(cls, numerator, denominator):
+        """numerator / denominator base units, from integers"""
+        return cls(_div_round(numerator * cls.SCALE, denominator))
+
+    def to_decimal(self):
+        return Decimal(self.units).scaleb(-6)
+
+    def __float__(self):
+        return self.units / self.SCALE
+
+    def __add__(self, other):
+        return Quantity(self.units + other.units)
+
+    def __sub__(self, other):
+        return Quantity(self.units - other.units)
+
+    def __neg__(self):
+        return Quantity(-self.units)
+
+    def __mul__(self, other):
+        if isinstance(other, int):
+            return Quantity(self.units * other)
+        if isinstance(other, Quantity):
+            return Quantity(_div_round(self.units * other.units, self.SCALE))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def divide(self, divisor):
+        """Divide by an integer, rounded to the nearest micro-unit"""
+        return Quantity(_div_round(self.units, divisor))
+
+    def percent(self, percent):
+        """percent% of this quantity (percent may be int/Decimal/float)"""
+        return Quantity(_div_round(self.units * _to_scaled(percent, 10_000), 1_000_000))
+
+    def with_waste(self, percent):
+        """This quantity plus percent% waste"""
+        return self + self.percent(percent)
+
+    def __bool__(self):
+        return self.units != 0
+
+    def __eq__(self, other):
+        return isinstance(other, Quantity) and self.units == other.units
+
+    def __lt__(self, other):
+        return self.units < other.units
+
+    def __le__(self, other):
+        return self.units <= other.units
+
+    def __gt__(self, other):
+        return self.units > other.units
+
+    def __ge__(self, other):
+        return self.units >= other.units
+
+    def __hash__(self):
+        return hash(('Quantity', self.units))
+
+    def __repr__(self):
+        return f"Quantity({self.to_decimal()})"
+
+
+class Money:
+    """Amount in tiyin (1/100 so'm)"""
+
+    __slots__ = ('tiyin',)
+    SCALE = 100
+
+    def __init__(self, tiyin=0):
+        self.tiyin = tiyin
+
+    @classmethod
+    def of(cls, value):
+        """From int/Decimal/float/str in so'm"""
+        return cls(_to_scaled(value, cls.SCALE))
+
+    @classmethod
+    def sum(cls, amounts):
+        return cls(sum(amount.tiyin for amount in amounts))
+
+    def to_decimal(self):
+        return Decimal(self.tiyin).scaleb(-2)
+
+    def __float__(self):
+        return self.tiyin / self.SCALE
+
+    def __add__(self, other):
+        return Money(self.tiyin + other.tiyin)
+
+    def __sub__(self, other):
+        return Money(self.tiyin - other.tiyin)
+
+    def __neg__(self):
+        return Money(-self.tiyin)
+
+    def __mul__(self, other):
+        """Money * int, or unit price * Quantity"""
+        if isinstance(other, int):
+            return Money(self.tiyin * other)
+        if isinstance(other, Quantity):
+            return Money(_div_round(self.tiyin * other.units, Quantity.SCALE))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def divide(self, divisor):
+        """Divide by an integer (e.g. per-unit price), rounded to the tiyin"""
+        return Money(_div_round(self.tiyin, divisor))
+
+    def percent(self, percent):
+        """percent% of this amount (percent may be int/Decimal/float)"""
+        return Money(_div_round(self.tiyin * _to_scaled(percent, 10_000), 1_000_000))
+
+    def round_to(self, som):
+        """Round to a multiple of `som` so'm, e.g. round_to(100) == round(x, -2)"""
+        step = som * self.SCALE
+        return Money(_div_round(self.tiyin, step) * step)
+
+    def __bool__(self):
+        return self.tiyin != 0
+
+    def __eq__(self, other):
+        return isinstance(other, Money) and self.tiyin == other.tiyin
+
+    def __lt__(self, other):
+        return self.tiyin < other.tiyin
+
+    def __le__(self, other):
+        return self.tiyin <= other.tiyin
+
+    def __gt__(self, other):
+        return self.tiyin > other.tiyin
+
+    def __ge__(self, other):
+        return self.tiyin >= other.tiyin
+
+    def __hash__(self):
+        return hash(('Money', self.tiyin))
+
+    def __repr__(self):
+        return f"Money({self.to_decimal()})"
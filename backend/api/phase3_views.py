@@ -9,6 +9,8 @@ from rest_framework import status, permissions
 from .models import Order, PriceVersion, PricingSettings
 from .pricing_logic import PriceLockService, ScenarioPricingService, CapacityAwareCalculator
 from .serializers import OrderSerializer
+from .tracing import StageStats, trace_request, wants_trace
+from .shop_simulator import ShopModel, run_scenarios, MAX_SCENARIOS
 import json
 
 
@@ -123,6 +125,117 @@ class ScenarioListView(APIView):
         return Response({'scenarios': scenarios})
 
 
+class ScenarioQuoteView(APIView):
+    """
+    Price an order spec under every scenario in one request.
+    Read-only: nothing is written to the database.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        try:
+            with trace_request(request, 'scenario_quote') as trace:
+                result = ScenarioPricingService.price_all_scenarios(request.data)
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if trace is not None and wants_trace(request):
+            result['trace'] = trace.as_dict()
+        return Response(result)
+
+
+class QuoteTimingStatsView(APIView):
+    """
+    Rolling p50/p95/p99 stage timings of the quote pipeline (admin only).
+    DELETE clears the windows.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def _is_admin(self, request):
+        return request.user.is_superuser or getattr(request.user, 'role', None) == 'admin'
+    
+    def get(self, request):
+        if not self._is_admin(request):
+            return Response({'error': 'Admin only'}, status=status.HTTP_403_FORBIDDEN)
+        return Response({
+            'window': StageStats.WINDOW,
+            'stages': StageStats.snapshot()
+        })
+    
+    def delete(self, request):
+        if not self._is_admin(request):
+            return Response({'error': 'Admin only'}, status=status.HTTP_403_FORBIDDEN)
+        StageStats.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ShopSimulationView(APIView):
+    """
+    What-if capacity simulation (admin only).
+    
+    POST /api/production/simulate/
+    {
+        "horizon_days": 90,
+        "arrivals": "synthetic" | "history",
+        "seed": 0,
+        "scenarios": [
+            {"name": "baseline"},
+            {"name": "second shift", "shifts": [
+                {"start": "08:00", "end": "17:00", "capacity_multiplier": 1},
+                {"start": "17:00", "end": "02:00", "capacity_multiplier": 0.8}
+            ]},
+            {"name": "extra die-cutter", "extra_machines": {"cutter": 1}},
+            {"name": "+30% orders", "arrival_rate_multiplier": 1.3}
+        ]
+    }
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        if not (request.user.is_superuser or getattr(request.user, 'role', None) == 'admin'):
+            return Response({'error': 'Admin only'}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            horizon_days = min(max(int(request.data.get('horizon_days', 90)), 1), 366)
+            seed = int(request.data.get('seed', 0))
+            scenarios = [self._parse_scenario(s) for s in request.data.get('scenarios') or [{}]]
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
+            return Response({'error': f'Invalid scenario: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(scenarios) > MAX_SCENARIOS:
+            return Response({'error': f'At most {MAX_SCENARIOS} scenarios'}, status=status.HTTP_400_BAD_REQUEST)
+        arrivals = 'history' if request.data.get('arrivals') == 'history' else 'synthetic'
+        
+        model = ShopModel.load(horizon_days=horizon_days, arrivals=arrivals)
+        results = run_scenarios(model, scenarios, seed=seed)
+        return Response({
+            'horizon_days': horizon_days,
+            'arrivals': arrivals,
+            'orders_per_day': round(model.arrival_rate, 2),
+            'scenarios': results,
+        })
+    
+    @staticmethod
+    def _parse_scenario(data):
+        from datetime import datetime
+        
+        scenario = {
+            'name': str(data.get('name') or 'baseline'),
+            'extra_machines': {str(k): int(v) for k, v in (data.get('extra_machines') or {}).items()},
+            'arrival_rate_multiplier': float(data.get('arrival_rate_multiplier', 1.0)),
+        }
+        if data.get('orders_per_day') is not None:
+            scenario['orders_per_day'] = float(data['orders_per_day'])
+        if data.get('shifts') is not None:
+            scenario['shifts'] = [
+                (
+                    datetime.strptime(shift['start'], '%H:%M').time(),
+                    datetime.strptime(shift['end'], '%H:%M').time(),
+                    float(shift.get('capacity_multiplier', 1)),
+                )
+                for shift in data['shifts']
+            ]
+        return scenario
+
+
 class CapacityStatusView(APIView):
     """Get current production capacity status"""
     permission_classes = [permissions.IsAuthenticated]
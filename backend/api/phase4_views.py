@@ -12,6 +12,7 @@ from .production_optimizer import (
     BottleneckDetector, ParallelFlowManager, 
     MachineDowntimeTracker, SmartAssignmentEngine
 )
+from .finite_scheduler import IncrementalRescheduler
 
 
 class BottleneckAnalysisView(APIView):
@@ -41,9 +42,9 @@ class ParallelFlowAnalysisView(APIView):
         
         parallel_plan = ParallelFlowManager.suggest_parallel_steps(order)
         
-        # Calculate time savings
-        total_sequential_time = sum(wave['estimated_duration'] for wave in parallel_plan['waves'])
-        total_parallel_time = sum(wave['estimated_duration'] for wave in parallel_plan['waves'] if not wave['can_run_parallel'])
+        # Calculate time savings: all remaining steps back to back vs. the critical path
+        total_sequential_time = parallel_plan['sequential_hours']
+        total_parallel_time = parallel_plan['makespan_hours']
         time_saved = total_sequential_time - total_parallel_time
         
         return Response({
@@ -121,6 +122,7 @@ class MachineDowntimeViewSet(viewsets.ModelViewSet):
             reported_by=request.user,
             is_active=True
         )
+        IncrementalRescheduler.on_machine_changed(machine.id, since=downtime.started_at)
         
         return Response({
             'id': downtime.id,
@@ -139,6 +141,7 @@ class MachineDowntimeViewSet(viewsets.ModelViewSet):
         
         if action == 'resolve':
             downtime.resolve(request.user)
+            IncrementalRescheduler.on_machine_changed(downtime.machine_id, since=downtime.started_at)
             return Response({
                 'status': 'resolved',
                 'duration_hours': downtime.duration_hours,
@@ -233,6 +236,17 @@ class SmartAssignmentView(APIView):
             }, status=status.HTTP_404_NOT_FOUND)
 
 
+class BatchAssignmentView(APIView):
+    """Assign every unassigned ready step in one min-cost matching"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('1', 'true', 'yes')
+        report = SmartAssignmentEngine.assign_ready_steps(commit=not dry_run)
+        report['dry_run'] = dry_run
+        return Response(report)
+
+
 class WorkloadRebalanceView(APIView):
     """Analyze and suggest workload rebalancing"""
     permission_classes = [permissions.IsAuthenticated]
@@ -244,5 +258,6 @@ class WorkloadRebalanceView(APIView):
             'timestamp': timezone.now().isoformat(),
             'workload_summary': rebalance_data['workload_map'],
             'rebalance_suggestions': rebalance_data['rebalance_suggestions'],
+            'imbalance': rebalance_data.get('imbalance', {}),
             'requires_action': len(rebalance_data['rebalance_suggestions']) > 0
         })
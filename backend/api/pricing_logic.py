@@ -6,6 +6,8 @@ Handles price locking, versioning, and manual overrides with audit trail.
 from django.utils import timezone
 from django.db import transaction
 from .models import Order, PriceVersion, PricingSettings, SettingsLog
+from .money import Money, Quantity
+from .tracing import stage
 import json
 
 
@@ -240,33 +242,123 @@ class ScenarioPricingService:
     Scenarios: Standard, Express, Night, etc.
     """
     
+    DEFAULT_SCENARIOS = {
+        'Standard': 1.0,
+        'Express': 1.5,
+        'Night': 1.3,
+        'Economy': 0.9
+    }
+    
+    @staticmethod
+    def get_scenario_table(settings=None):
+        """Configured {scenario: multiplier}, or the defaults. Never writes."""
+        settings = settings or PricingSettings.load_readonly()
+        return settings.scenario_pricing or ScenarioPricingService.DEFAULT_SCENARIOS
+    
     @staticmethod
-    def get_scenario_multiplier(scenario_name='Standard'):
+    def get_scenario_multiplier(scenario_name='Standard', settings=None):
         """Get price multiplier for a scenario"""
-        settings = PricingSettings.load()
+        return ScenarioPricingService.get_scenario_table(settings).get(scenario_name, 1.0)
+    
+    @staticmethod
+    def calculate_with_scenario(base_price, scenario='Standard', settings=None):
+        """Apply scenario multiplier to base price"""
+        multiplier = ScenarioPricingService.get_scenario_multiplier(scenario, settings)
+        return float(Money.of(base_price) * Quantity.of(multiplier))
+    
+    @staticmethod
+    def estimate_production_days(quantity, has_lacquer=False, scenario='Standard'):
+        """Working days for a quote: base day + 1 per 1000 items, adjusted by scenario"""
+        production_days = max(1, quantity // 1000)
+        if has_lacquer:
+            production_days += 1  # Extra day for lacquering
         
-        if not settings.scenario_pricing:
-            # Default scenarios if not configured
-            settings.scenario_pricing = {
-                'Standard': 1.0,
-                'Express': 1.5,
-                'Night': 1.3,
-                'Economy': 0.9
-            }
-            settings.save()
+        if scenario == 'Express':
+            production_days = max(1, production_days - 1)
+        elif scenario == 'VIP':
+            production_days = max(1, production_days - 2)
+        elif scenario == 'Economy':
+            production_days += 2
         
-        return settings.scenario_pricing.get(scenario_name, 1.0)
+        return 1 + production_days
     
     @staticmethod
-    def calculate_with_scenario(base_price, scenario='Standard'):
-        """Apply scenario multiplier to base price"""
-        multiplier = ScenarioPricingService.get_scenario_multiplier(scenario)
-        return base_price * multiplier
+    def scenario_day_shift(quantity, has_lacquer=False, scenario='Standard'):
+        """Days a scenario adds to (or takes off) the Standard estimate for the same job"""
+        return (
+            ScenarioPricingService.estimate_production_days(quantity, has_lacquer, scenario)
+            - ScenarioPricingService.estimate_production_days(quantity, has_lacquer, 'Standard')
+        )
+    
+    @staticmethod
+    def promised_deadline(promise, shift_days=0):
+        """
+        Quote date from a CapableToPromise result: the P90 completion date
+        moved by shift_days (scenario and load allowance), but never before
+        the date the routing can finish at the earliest.
+        """
+        from datetime import timedelta
+        p90 = timezone.localtime(promise['confidence_band']['p90']).date()
+        earliest = timezone.localtime(promise['earliest_completion']).date()
+        return max(p90 + timedelta(days=shift_days), earliest)
+    
+    @staticmethod
+    def price_all_scenarios(data, current_load=None):
+        """
+        Quote every configured scenario in one pass.
+        
+        Settings are read once (without writing), material usage and base
+        cost are computed once, and each scenario only applies its
+        multiplier and delivery estimate.
+        
+        Returns: {
+            'materials': dict,
+            'cost': dict (base calculate_cost result),
+            'scenarios': {name: {'multiplier', 'final_price', 'price_per_unit',
+                                 'estimated_days', 'estimated_deadline', 'description'}}
+        }
+        """
+        from datetime import timedelta
+        from .services import CalculationService
+        
+        with stage('settings'):
+            settings = PricingSettings.load_readonly()
+        usage = CalculationService.calculate_material_usage(data, settings)
+        cost_data = CalculationService.calculate_cost(data, usage, settings=settings)
+        
+        quantity = int(data.get('quantity', 0) or 0)
+        has_lacquer = bool(data.get('lacquer_type')) and data.get('lacquer_type') != 'none'
+        if current_load is None:
+            with stage('capacity'):
+                current_load = Order.objects.filter(status__in=['in_production', 'approved']).count()
+        extra_days = 1 if current_load > 15 else 0
+        today = timezone.now().date()
+        
+        base_price = Money.of(cost_data.get('total_price', 0))
+        scenarios = {}
+        for name, multiplier in ScenarioPricingService.get_scenario_table(settings).items():
+            final_price = base_price * Quantity.of(multiplier)
+            days = ScenarioPricingService.estimate_production_days(quantity, has_lacquer, name) + extra_days
+            scenarios[name] = {
+                'multiplier': float(multiplier),
+                'final_price': float(final_price),
+                'price_per_unit': float(final_price.divide(quantity)) if quantity > 0 else 0,
+                'estimated_days': days,
+                'estimated_deadline': (today + timedelta(days=days)).isoformat(),
+                'description': ScenarioPricingService._get_scenario_description(name),
+            }
+        
+        return {
+            'materials': usage,
+            'cost': cost_data,
+            'current_load': current_load,
+            'scenarios': scenarios,
+        }
     
     @staticmethod
     def get_available_scenarios():
         """Get list of available pricing scenarios"""
-        settings = PricingSettings.load()
+        settings = PricingSettings.load_readonly()
         
         if not settings.scenario_pricing:
             return {
@@ -340,15 +432,8 @@ class CapacityAwareCalculator:
         # Complexity factor
         complexity_days = CapacityAwareCalculator._calculate_complexity_days(order)
         
-        # Queue factor
-        queue_days = CapacityAwareCalculator._calculate_queue_delay()
-        
         # Total workdays needed
-        if scenario == 'Express':
-            # Express bypasses queue
-            total_workdays = base_days + complexity_days
-        else:
-            total_workdays = base_days + complexity_days + queue_days
+        total_workdays = base_days + complexity_days
         
         # Convert to calendar date
         from api.calendar_utils import calculate_deadline
@@ -358,7 +443,20 @@ class CapacityAwareCalculator:
             include_shifts=True
         )
         
-        return deadline
+        if scenario == 'Express':
+            # Express bypasses queue
+            return deadline
+        
+        # Queue factor: the routing placed on the current machine plan (P90),
+        # moved by the scenario's days against Standard
+        from .capable_to_promise import CapableToPromise
+        from .delivery_forecast import DeliveryForecast
+        has_lacquer = bool(order.lacquer_type) and order.lacquer_type != 'none'
+        promise = CapableToPromise().promise(
+            DeliveryForecast.steps_for_quote({}, order.quantity or 0, has_lacquer)
+        )
+        shift_days = base_days - ScenarioPricingService.estimate_delivery_days('Standard')
+        return max(deadline, ScenarioPricingService.promised_deadline(promise, shift_days))
     
     @staticmethod
     def _calculate_complexity_days(order):
@@ -407,29 +505,40 @@ class CapacityAwareCalculator:
         return 0
     
     @staticmethod
-    def get_capacity_status():
-        """Get current production capacity status"""
-        from .models import Order as OrderModel, Shift
+    def get_capacity_status(days=7):
+        """
+        Get current production capacity status from the capacity timeline:
+        machine-hours available over the next `days` days against the
+        scheduled step estimates plus open steps that are not planned yet.
+        """
+        from datetime import timedelta
+        from .models import Order as OrderModel
+        from .capacity_timeline import CapacityTimeline
         
         active_orders = OrderModel.objects.filter(
             status__in=['approved', 'in_production']
         ).count()
         
-        # Get total shift capacity
-        active_shifts = Shift.objects.filter(is_active=True)
-        total_capacity_hours = sum(
-            shift.duration_hours * float(shift.capacity_multiplier)
-            for shift in active_shifts
-        )
+        today = timezone.localdate()
+        last_day = today + timedelta(days=days - 1)
+        timeline = CapacityTimeline.get(covering=(today, last_day))
+        totals = timeline.totals(today, last_day)
         
-        # Estimate capacity usage
-        # Assume average order takes 4 hours
-        estimated_hours_needed = active_orders * 4
-        capacity_percentage = (estimated_hours_needed / (total_capacity_hours * 5)) * 100 if total_capacity_hours > 0 else 0
+        available = totals['available_hours']
+        if not timeline.machines:
+            # No machines configured: measure against calendar hours alone
+            available = timeline.shop_hours(today, last_day)
+        demand = totals['scheduled_hours'] + timeline.unscheduled_hours()
+        capacity_percentage = (demand / available) * 100 if available > 0 else 0
         
         return {
             'active_orders': active_orders,
-            'capacity_percentage': min(capacity_percentage, 100),
+            'capacity_percentage': round(min(capacity_percentage, 100), 1),
             'status': 'high' if capacity_percentage > 80 else 'medium' if capacity_percentage > 50 else 'low',
-            'estimated_queue_days': CapacityAwareCalculator._calculate_queue_delay()
+            'estimated_queue_days': CapacityAwareCalculator._calculate_queue_delay(),
+            'available_hours': round(available, 2),
+            'scheduled_hours': totals['scheduled_hours'],
+            'unscheduled_hours': round(timeline.unscheduled_hours(), 2),
+            'free_hours': totals['free_hours'],
+            'machines': timeline.machine_summary(today, last_day),
         }
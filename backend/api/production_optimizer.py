@@ -110,40 +110,80 @@ class LayoutOptimizer:
 class BottleneckDetector:
     @staticmethod
     def detect_bottlenecks():
-        # Mock implementation to satisfy import and basic logic
-        # In real app, this would query ProductionSteps and analyze delays
-        return []
+        """Step types and machines scored from rolling queue/utilization statistics"""
+        from .bottleneck_monitor import BottleneckMonitor
+        return BottleneckMonitor.get().detect()
 
 class ParallelFlowManager:
     @staticmethod
     def suggest_parallel_steps(order):
-        # Mock implementation returning a simple sequential plan
+        """
+        Critical-path plan of the order's step graph: waves of steps that
+        can run side by side, earliest/latest starts and slack in hours.
+        """
+        from .critical_path import CriticalPath
+
+        graph, rows = CriticalPath.for_orders([order.id]).get(order.id, (CriticalPath([]), {}))
+        labels = dict(ProductionStep.STEP_CHOICES)
+
+        waves = []
+        for number, members in enumerate(graph.waves(), start=1):
+            waves.append({
+                'wave': number,
+                'steps': [labels.get(rows[graph.ids[i]]['step'], rows[graph.ids[i]]['step']) for i in members],
+                'step_ids': [str(graph.ids[i]) for i in members],
+                'estimated_duration': round(max(graph.duration[i] for i in members), 2),
+                'sequential_duration': round(sum(graph.duration[i] for i in members), 2),
+                'can_run_parallel': len(members) > 1,
+            })
+
+        steps = []
+        for i, step_id in enumerate(graph.ids):
+            steps.append({
+                'id': str(step_id),
+                'step': rows[step_id]['step'],
+                'status': rows[step_id]['status'],
+                'wave': graph.wave[i] + 1,
+                'duration_hours': round(graph.duration[i], 2),
+                'earliest_start': round(graph.earliest_start[i], 2),
+                'earliest_finish': round(graph.earliest_finish[i], 2),
+                'latest_start': round(graph.latest_start[i], 2),
+                'latest_finish': round(graph.latest_finish[i], 2),
+                'slack_hours': round(graph.slack[i], 2),
+                'is_critical': graph.is_critical(i),
+            })
+
         return {
-            'waves': [{
-                'steps': ['Pre-press', 'Print', 'Cut'], 
-                'estimated_duration': 5.0, 
-                'can_run_parallel': False
-            }]
+            'waves': waves,
+            'steps': steps,
+            'critical_path': [str(step_id) for step_id in graph.critical_path()],
+            'makespan_hours': round(graph.makespan, 2),
+            'sequential_hours': round(sum(graph.duration), 2),
+            'has_cycle': graph.has_cycle,
         }
 
 class SmartAssignmentEngine:
     @staticmethod
     def assign_optimal_worker(step):
-        # Simple Logic: Assign to first available user with matching role or 'operator'
-        # This requires database access, if it fails we return None
-        try:
-            # Try to find a user with role related to step if possible, or just any 'employee'
-            worker = User.objects.filter(role__in=['operator', 'employee']).first()
-            return worker
-        except:
+        """Cheapest worker for the step by rate, current load and shift hours left"""
+        from .worker_assignment import WorkerAssignmentSolver
+        solver = WorkerAssignmentSolver(step_ids=[step.id]).load()
+        assignments = solver.solve()
+        if not assignments:
             return None
+        return User.objects.filter(id=assignments[0][1]).first()
+
+    @staticmethod
+    def assign_ready_steps(commit=True):
+        """Batch min-cost assignment of every unassigned ready step"""
+        from .worker_assignment import WorkerAssignmentSolver
+        return WorkerAssignmentSolver.run(commit=commit)
 
     @staticmethod
     def rebalance_workload():
-        return {
-            'workload_map': {},
-            'rebalance_suggestions': []
-        }
+        """Projected queue hours per worker/machine and the moves that flatten them"""
+        from .workload_rebalancer import WorkloadRebalancer
+        return WorkloadRebalancer().load().run()
 
 class MachineDowntimeTracker:
     pass # Empty placeholder
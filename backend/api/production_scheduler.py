@@ -84,14 +84,16 @@ class ProductionScheduler:
                 # Dependency not yet scheduled, use current time
                 estimated_start = now
         else:
-            # Check machine availability
-            if production_step.machine:
-                machine_available_from = ProductionScheduler.get_machine_available_time(
-                    production_step.machine
-                )
-                estimated_start = max(now, machine_available_from)
-            else:
-                estimated_start = now
+            estimated_start = now
+        
+        # Earliest machine slot long enough for the step, gaps included
+        if production_step.machine:
+            estimated_start = ProductionScheduler.get_machine_available_time(
+                production_step.machine,
+                duration_minutes=duration_minutes,
+                after=max(now, estimated_start),
+                exclude_step_id=production_step.id
+            )
         
         # Calculate end time
         estimated_end = estimated_start + timedelta(minutes=duration_minutes)
@@ -100,8 +102,9 @@ class ProductionScheduler:
         production_step.estimated_start = estimated_start
         production_step.estimated_end = estimated_end
         production_step.estimated_duration_minutes = int(duration_minutes)
+        production_step.setup_minutes = None
         production_step.save(update_fields=[
-            'estimated_start', 'estimated_end', 'estimated_duration_minutes'
+            'estimated_start', 'estimated_end', 'estimated_duration_minutes', 'setup_minutes'
         ])
         
         return {
@@ -111,37 +114,24 @@ class ProductionScheduler:
         }
     
     @staticmethod
-    def get_machine_available_time(machine: MachineSettings) -> datetime:
+    def get_machine_available_time(
+        machine: MachineSettings,
+        duration_minutes: Optional[float] = None,
+        after: Optional[datetime] = None,
+        exclude_step_id=None
+    ) -> datetime:
         """
-        Get the earliest time a machine will be available.
-        Looks at all pending and in-progress steps assigned to the machine.
+        Get the earliest time a machine is free for a job of the given length.
+        Gaps between booked pending/in-progress steps and downtimes are reused;
+        without a duration this is the end of the busy stretch covering `after`.
         """
-        # Get last estimated end time for this machine
-        last_step = ProductionStep.objects.filter(
-            machine=machine,
-            status__in=['pending', 'in_progress'],
-            estimated_end__isnull=False
-        ).order_by('-estimated_end').first()
-        
-        if last_step:
-            return last_step.estimated_end
-        
-        # Check if machine is currently in downtime
-        from api.models import MachineDowntime
-        active_downtime = MachineDowntime.objects.filter(
-            machine=machine,
-            is_active=True
-        ).first()
-        
-        if active_downtime:
-            # Estimate downtime will end in 2 hours if no end time
-            if active_downtime.ended_at:
-                return active_downtime.ended_at
-            else:
-                return timezone.now() + timedelta(hours=2)
-        
-        # Machine is available now
-        return timezone.now()
+        from api.machine_availability import AvailabilityIndex
+        after = after or timezone.now()
+        index = AvailabilityIndex.load(
+            [machine.id], now=after,
+            exclude_step_ids=[exclude_step_id] if exclude_step_id else ()
+        )
+        return index.earliest_slot(machine.id, after, timedelta(minutes=duration_minutes or 0))
     
     @staticmethod
     def get_machine_queue(
@@ -155,33 +145,61 @@ class ProductionScheduler:
             List of production steps with order info, sorted by queue position/priority
         """
         queryset = ProductionStep.objects.filter(machine=machine)
-        
         if not include_completed:
             queryset = queryset.exclude(status='completed')
         
-        queryset = queryset.select_related(
-            'order', 'order__client', 'assigned_to'
-        ).order_by('queue_position', 'priority', 'estimated_start')
-        
-        queue = []
-        for step in queryset:
-            queue.append({
-                'id': str(step.id),
-                'order_number': step.order.order_number,
-                'client_name': step.order.client.full_name,
-                'step': step.get_step_display(),
-                'status': step.get_status_display(),
-                'priority': step.priority,
-                'queue_position': step.queue_position,
-                'assigned_to': step.assigned_to.username if step.assigned_to else None,
-                'estimated_start': step.estimated_start,
-                'estimated_end': step.estimated_end,
-                'estimated_duration_minutes': step.estimated_duration_minutes,
-                'is_ready': step.is_ready_to_start,
-                'depends_on': str(step.depends_on_step.id) if step.depends_on_step else None
-            })
-        
-        return queue
+        rows = list(ProductionScheduler._queue_rows(queryset))
+        waiting = ProductionScheduler._waiting_on_extra_dependencies([row['id'] for row in rows])
+        return [ProductionScheduler._queue_entry(row, waiting) for row in rows]
+    
+    # Columns for queue entries; dependency status comes from the same join
+    QUEUE_FIELDS = (
+        'id', 'machine_id', 'step', 'status', 'priority', 'queue_position',
+        'estimated_start', 'estimated_end', 'estimated_duration_minutes',
+        'depends_on_step_id', 'depends_on_step__status',
+        'order__order_number', 'order__client__full_name', 'assigned_to__username',
+    )
+    STEP_LABELS = dict(ProductionStep.STEP_CHOICES)
+    STATUS_LABELS = dict(ProductionStep.STATUS_CHOICES)
+    
+    @staticmethod
+    def _queue_rows(queryset):
+        return queryset.order_by(
+            'machine_id', 'queue_position', 'priority', 'estimated_start'
+        ).values(*ProductionScheduler.QUEUE_FIELDS)
+    
+    @staticmethod
+    def _waiting_on_extra_dependencies(step_ids):
+        """Ids among step_ids with an unfinished extra predecessor (one query)"""
+        if not step_ids:
+            return set()
+        through = ProductionStep.extra_dependencies.through
+        return set(
+            through.objects.filter(from_productionstep_id__in=step_ids).exclude(
+                to_productionstep__status='completed'
+            ).values_list('from_productionstep_id', flat=True)
+        )
+    
+    @staticmethod
+    def _queue_entry(row, waiting=()) -> Dict:
+        return {
+            'id': str(row['id']),
+            'order_number': row['order__order_number'],
+            'client_name': row['order__client__full_name'],
+            'step': ProductionScheduler.STEP_LABELS.get(row['step'], row['step']),
+            'status': ProductionScheduler.STATUS_LABELS.get(row['status'], row['status']),
+            'priority': row['priority'],
+            'queue_position': row['queue_position'],
+            'assigned_to': row['assigned_to__username'],
+            'estimated_start': row['estimated_start'],
+            'estimated_end': row['estimated_end'],
+            'estimated_duration_minutes': row['estimated_duration_minutes'],
+            'is_ready': (
+                (row['depends_on_step_id'] is None or row['depends_on_step__status'] == 'completed')
+                and row['id'] not in waiting
+            ),
+            'depends_on': str(row['depends_on_step_id']) if row['depends_on_step_id'] else None
+        }
     
     @staticmethod
     def assign_to_machine(
@@ -213,85 +231,60 @@ class ProductionScheduler:
     @staticmethod
     def optimize_machine_queue(machine: MachineSettings) -> List[ProductionStep]:
         """
-        Optimize the queue for a machine based on:
-        1. Dependencies (can't start if dependency not done)
-        2. Priority
-        3. Deadline urgency
+        Optimize the queue for a machine: group compatible jobs to cut
+        changeovers without making any job later than the priority/deadline
+        order would (see api/setup_sequencer.py).
         
         Returns:
             List of reordered production steps
         """
-        steps = ProductionStep.objects.filter(
-            machine=machine,
-            status='pending'
-        ).select_related('order', 'depends_on_step').order_by('priority', 'order__deadline')
-        
-        # Separate into ready and blocked steps
-        ready_steps = []
-        blocked_steps = []
-        
-        for step in steps:
-            if step.is_ready_to_start:
-                ready_steps.append(step)
-            else:
-                blocked_steps.append(step)
-        
-        # Sort ready steps by priority then deadline
-        ready_steps.sort(key=lambda s: (
-            s.priority,
-            s.order.deadline if s.order.deadline else timezone.now() + timedelta(days=365)
-        ))
-        
-        # Reassign queue positions
-        position = 1
-        reordered = []
-        
-        for step in ready_steps:
-            step.queue_position = position
-            step.save(update_fields=['queue_position'])
-            position += 1
-            reordered.append(step)
+        from api.setup_sequencer import SetupSequencer
+        SetupSequencer(machine).optimize()
         
-        # Blocked steps go after ready ones
-        for step in blocked_steps:
-            step.queue_position = position
-            step.save(update_fields=['queue_position'])
-            position += 1
-            reordered.append(step)
-        
-        # Recalculate times for all steps
-        for step in reordered:
-            ProductionScheduler.calculate_step_times(step, force_recalculate=True)
-        
-        return reordered
+        return list(
+            ProductionStep.objects.filter(machine=machine, status='pending')
+            .select_related('order')
+            .order_by('queue_position')
+        )
     
     @staticmethod
     def get_all_machine_queues() -> Dict:
         """
         Get queues for all active machines.
+        Three queries in total: active machines, every open step on them
+        (with dependency status joined in), and unfinished extra dependencies;
+        rows are grouped and counted in one pass.
         
         Returns:
             Dictionary mapping machine_id to queue list
         """
-        machines = MachineSettings.objects.filter(is_active=True)
-        
         queues = {}
-        for machine in machines:
-            queues[str(machine.id)] = {
-                'machine_name': machine.machine_name,
-                'machine_type': machine.machine_type,
-                'queue': ProductionScheduler.get_machine_queue(machine),
-                'total_pending': ProductionStep.objects.filter(
-                    machine=machine,
-                    status='pending'
-                ).count(),
-                'total_in_progress': ProductionStep.objects.filter(
-                    machine=machine,
-                    status='in_progress'
-                ).count()
+        for machine_id, name, machine_type in MachineSettings.objects.filter(is_active=True).values_list(
+            'id', 'machine_name', 'machine_type'
+        ):
+            queues[machine_id] = {
+                'machine_name': name,
+                'machine_type': machine_type,
+                'queue': [],
+                'total_pending': 0,
+                'total_in_progress': 0
             }
+        if not queues:
+            return {}
         
-        return queues
+        rows = list(ProductionScheduler._queue_rows(
+            ProductionStep.objects.filter(machine_id__in=list(queues)).exclude(status='completed')
+        ))
+        waiting = ProductionScheduler._waiting_on_extra_dependencies([row['id'] for row in rows])
+        for row in rows:
+            board = queues[row['machine_id']]
+            board['queue'].append(ProductionScheduler._queue_entry(row, waiting))
+            if row['status'] == 'pending':
+                board['total_pending'] += 1
+            elif row['status'] == 'in_progress':
+                board['total_in_progress'] += 1
+        
+        return {str(machine_id): board for machine_id, board in queues.items()}
     
     @staticmethod
     def schedule_order_production(order: Order) -> List[ProductionStep]:
@@ -0,0 +1,507 @@
+"""
+Scheduler Benchmark
+Latency, query counts and plan quality of the scheduling paths on a
+deterministic synthetic shop.
+
+SyntheticShop builds a shop of a given number of open steps from a seed:
+machines of every routed type (one cell of MACHINE_MIX per
+STEPS_PER_CELL steps, so the load per machine is the same at every
+size), a few product templates with their routings, two shifts, the
+calendar with holidays, downtime windows, orders with a priority and
+deadline mix whose steps follow their template's routing, and a fixed
+crew of rated workers. Rows go in with bulk inserts; the same seed and
+size always give the same shop relative to `now`.
+
+SchedulerBenchmark then times each scheduling path on it and counts its
+queries with a connection.execute_wrapper (a query log would stop at
+9000 entries):
+
+- replan: FiniteCapacityScheduler.replan over every open step; its plan
+  gives the quality figures (weighted tardiness, late orders, makespan)
+- calculate_step_times / optimize_machine_queue: the per-step and
+  per-machine paths, on a sample of steps and machines
+- promise / realistic_deadline: deadline estimation for new quotes
+  (CapableToPromise, CapacityAwareCalculator)
+- forecast_backlog / delivery_forecast: the per-machine backlog
+  distribution, then Monte Carlo completion dates for new quotes
+- tardiness_optimizer: a time-limited dry run of the local search
+- critical_path: the step graphs of every open order
+- shop_simulation: SIMULATION_DAYS of the shop in the discrete-event model
+- worker_assignment: one matching of ASSIGNMENT_STEPS ready steps
+
+Per-call paths run on SAMPLE_CALLS calls, so they report per-call figures
+that can be compared across sizes. `compare()` checks a report against a
+stored baseline (scheduler_baseline.json next to this module): query
+counts, latency and plan quality may each move only within their
+tolerance. Latency depends on the machine, so the baseline should be
+saved where it is compared. Run it with `manage.py benchmark_scheduler`.
+"""
+
+import json
+import random
+from datetime import time as dt_time, timedelta
+from pathlib import Path
+from time import perf_counter
+
+from django.db import connection
+from django.utils import timezone
+
+from api.finite_scheduler import FiniteCapacityScheduler
+from api.models import (
+    Client, EmployeeEfficiency, MachineDowntime, MachineSettings, Order, ProductionStep,
+    ProductTemplate, ProductTemplateRouting, Shift, User
+)
+
+SIZES = (1000, 10000, 50000)
+BASELINE_PATH = Path(__file__).with_name('scheduler_baseline.json')
+
+# Machines of each type per cell, and open steps per cell
+MACHINE_MIX = (('printer', 3), ('cutter', 2), ('laminator', 1), ('folder', 2))
+STEPS_PER_CELL = 1000
+
+# (name, category, [(step, machine type, minutes per unit, setup minutes)])
+TEMPLATES = (
+    ("Dori qutisi", 'medicine_box_1layer', (
+        ('printing', 'printer', 0.02, 30),
+        ('cutting', 'cutter', 0.01, 15),
+        ('gluing', 'folder', 0.02, 10),
+        ('packaging', None, 0.005, 0),
+    )),
+    ("Pizza qutisi", 'pizza_box', (
+        ('printing', 'printer', 0.015, 30),
+        ('lamination', 'laminator', 0.01, 20),
+        ('die_cutting', 'cutter', 0.015, 25),
+        ('gluing', 'folder', 0.015, 10),
+        ('packaging', None, 0.005, 0),
+    )),
+    ("Sovg'a sumkasi", 'gift_bag', (
+        ('printing', 'printer', 0.025, 30),
+        ('lamination', 'laminator', 0.015, 20),
+        ('cutting', 'cutter', 0.01, 15),
+        ('packaging', None, 0.01, 0),
+    )),
+)
+
+PRIORITY_MIX = (('urgent', 0.05), ('high', 0.15), ('normal', 0.80))
+PAPER_TYPES = ('Karton', 'Melovanniy', 'Ofset')
+PRINT_COLORS = ('1+0', '4+0', '4+4')
+QUANTITY_RANGE = (500, 5000)
+DEADLINE_DAYS = (1, 5)
+IN_PROGRESS_SHARE = 0.03
+DOWNTIMES_PER_MACHINE = 2
+DOWNTIME_HORIZON_DAYS = 14
+
+SAMPLE_CALLS = 20
+SAMPLE_MACHINES = 5
+
+# (User.role, rated stages, workers) - the same crew at every size
+WORKERS = (
+    ('printer', ('printing',), 10),
+    ('cutter', ('cutting',), 10),
+    ('finishing', ('finishing', 'gluing', 'packaging'), 10),
+)
+UNITS_PER_HOUR_RANGE = (400, 1500)
+ASSIGNMENT_STEPS = 300
+SIMULATION_DAYS = 30
+TARDINESS_TIME_LIMIT_MS = 200
+
+# Weight of an order's tardiness per ORDER_PRIORITY_RANK (urgent, high, normal)
+TARDINESS_WEIGHT = (4.0, 2.0, 1.0)
+
+# Allowed growth over the baseline before a figure counts as a regression.
+# Query counts get a little room because time-budgeted searches (setup
+# sequencing) may stop at a different sequence and propagate differently.
+LATENCY_TOLERANCE = 0.5
+QUERY_TOLERANCE = 0.1
+QUALITY_TOLERANCE = 0.05
+
+
+class SyntheticShop:
+    """Deterministic shop with `steps` open production steps"""
+
+    def __init__(self, steps, seed=0, now=None):
+        self.size = steps
+        self.seed = seed
+        self.now = now or timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.random = random.Random(seed)
+        self.machines = {}     # machine_type -> [machine_id]
+        self.templates = []    # [(template_id, routing)]
+        self.client = None
+        self.orders = 0
+        self.steps = 0
+
+    def build(self):
+        from api.calendar_utils import add_uzbekistan_holidays, populate_calendar_year
+        for year in range(self.now.year, self.now.year + 2):
+            populate_calendar_year(year)
+            add_uzbekistan_holidays(year)
+        Shift.objects.bulk_create([
+            Shift(name="Benchmark kunduzgi", start_time=dt_time(8, 0), end_time=dt_time(17, 0)),
+            Shift(name="Benchmark kechki", start_time=dt_time(17, 0), end_time=dt_time(23, 0)),
+        ])
+        self._build_machines()
+        self._build_templates()
+        self.client = Client.objects.create(full_name="Benchmark Client")
+        self._build_orders()
+        self._build_workers()
+        return self
+
+    def _build_machines(self):
+        rng = self.random
+        cells = max(1, self.size // STEPS_PER_CELL)
+        machines = MachineSettings.objects.bulk_create([
+            MachineSettings(
+                machine_name=f"BENCH-{machine_type}-{cell}-{i}",
+                machine_type=machine_type,
+                hourly_rate=100000,
+                current_operating_hours=rng.randint(0, 180),
+            )
+            for cell in range(cells)
+            for machine_type, count in MACHINE_MIX
+            for i in range(count)
+        ])
+        for machine in machines:
+            self.machines.setdefault(machine.machine_type, []).append(machine.id)
+
+        downtimes = []
+        horizon = DOWNTIME_HORIZON_DAYS * 24
+        for machine in machines:
+            for _ in range(DOWNTIMES_PER_MACHINE):
+                start = self.now + timedelta(hours=rng.randint(0, horizon))
+                hours = rng.randint(1, 6)
+                downtimes.append(MachineDowntime(
+                    machine=machine,
+                    reason=rng.choice(('repair', 'cleaning', 'calibration')),
+                    started_at=start,
+                    ended_at=start + timedelta(hours=hours),
+                    estimated_duration_hours=hours,
+                    is_active=False,
+                ))
+        MachineDowntime.objects.bulk_create(downtimes, batch_size=500)
+
+    def _build_templates(self):
+        for name, category, routing in TEMPLATES:
+            template = ProductTemplate.objects.create(name=f"Benchmark {name}", category=category)
+            ProductTemplateRouting.objects.bulk_create([
+                ProductTemplateRouting(
+                    template=template,
+                    sequence=sequence,
+                    step_name=step,
+                    required_machine_type=machine_type,
+                    estimated_time_per_unit=per_unit,
+                    setup_time_minutes=setup,
+                )
+                for sequence, (step, machine_type, per_unit, setup) in enumerate(routing, start=1)
+            ])
+            self.templates.append((template.id, routing))
+
+    def make_orders(self, count, prefix='BENCH'):
+        """Unsaved orders and the routing each one follows"""
+        rng = self.random
+        priorities = [priority for priority, _ in PRIORITY_MIX]
+        weights = [weight for _, weight in PRIORITY_MIX]
+        orders = []
+        for _ in range(count):
+            template_id, routing = rng.choice(self.templates)
+            orders.append((Order(
+                client=self.client,
+                order_number=f"{prefix}-{self.orders:06d}",
+                status='in_production',
+                priority=rng.choices(priorities, weights)[0],
+                quantity=rng.randint(*QUANTITY_RANGE),
+                deadline=self.now + timedelta(hours=rng.randint(DEADLINE_DAYS[0] * 24, DEADLINE_DAYS[1] * 24)),
+                paper_type=rng.choice(PAPER_TYPES),
+                paper_density=rng.choice((250, 300, 350)),
+                print_colors=rng.choice(PRINT_COLORS),
+                product_template_id=template_id,
+            ), routing))
+            self.orders += 1
+        return orders
+
+    def _build_orders(self):
+        rng = self.random
+        orders = []
+        remaining = self.size
+        while remaining > 0:
+            order, routing = self.make_orders(1)[0]
+            orders.append((order, routing[:remaining]))
+            remaining -= len(routing)
+        Order.objects.bulk_create([order for order, _ in orders], batch_size=500)
+
+        # One layer per routing position, so each step's predecessor already has its id
+        previous = {}
+        depth = max(len(routing) for _, routing in orders)
+        for position in range(depth):
+            layer = []
+            for order, routing in orders:
+                if position >= len(routing):
+                    continue
+                step, machine_type, _, _ = routing[position]
+                in_progress = position == 0 and rng.random() < IN_PROGRESS_SHARE
+                layer.append(ProductionStep(
+                    order=order,
+                    step=step,
+                    status='in_progress' if in_progress else 'pending',
+                    started_at=self.now - timedelta(minutes=30) if in_progress else None,
+                    machine_id=rng.choice(self.machines[machine_type]) if machine_type else None,
+                    depends_on_step=previous.get(order.id),
+                    priority=2 if order.priority == 'urgent' else 5,
+                ))
+            ProductionStep.objects.bulk_create(layer, batch_size=500)
+            for step in layer:
+                previous[step.order_id] = step
+            self.steps += len(layer)
+
+
+    def _build_workers(self):
+        rng = self.random
+        workers = User.objects.bulk_create([
+            User(username=f"bench-{role}-{i}", password='!', role=role)
+            for role, _, count in WORKERS
+            for i in range(count)
+        ])
+        stages = {role: role_stages for role, role_stages, _ in WORKERS}
+        EmployeeEfficiency.objects.bulk_create([
+            EmployeeEfficiency(
+                employee=worker,
+                production_stage=stage,
+                units_per_hour=rng.randint(*UNITS_PER_HOUR_RANGE),
+                hourly_labor_cost=30000,
+                effective_from=self.now.date(),
+            )
+            for worker in workers
+            for stage in stages[worker.role]
+        ], batch_size=500)
+
+
+class QueryCounter:
+    """connection.execute_wrapper that only counts"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class SchedulerBenchmark:
+    """Time every scheduling path on one synthetic shop"""
+
+    def __init__(self, steps, seed=0, now=None, sample_calls=SAMPLE_CALLS):
+        self.shop = SyntheticShop(steps, seed=seed, now=now)
+        self.sample_calls = sample_calls
+        self.cases = {}
+        self.quality = {}
+
+    def measure(self, name, calls, fn):
+        """Run fn() counting its queries; per-call figures divide by `calls`"""
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = perf_counter()
+            result = fn()
+            elapsed = (perf_counter() - started) * 1000
+        calls = max(calls, 1)
+        self.cases[name] = {
+            'calls': calls,
+            'ms_per_call': round(elapsed / calls, 2),
+            'queries_per_call': round(counter.count / calls, 2),
+        }
+        return result
+
+    # ------------------------------------------------------------------
+    # Cases
+    # ------------------------------------------------------------------
+
+    def _replan(self):
+        shop = self.shop
+        result = self.measure('replan', 1, lambda: FiniteCapacityScheduler.replan(now=shop.now))
+        self.quality = self.plan_quality(result['plan'].values(), shop.now)
+        self.quality['maintenance_windows'] = len(result['maintenance'])
+
+    def _calculate_step_times(self):
+        from api.production_scheduler import ProductionScheduler
+        steps = list(
+            ProductionStep.objects.filter(status='pending', machine__isnull=False)
+            .select_related('order', 'order__product_template', 'machine', 'depends_on_step', 'assigned_to')
+            .order_by('id')[:self.sample_calls]
+        )
+        self.measure('calculate_step_times', len(steps), lambda: [
+            ProductionScheduler.calculate_step_times(step, force_recalculate=True) for step in steps
+        ])
+
+    def _optimize_machine_queue(self):
+        from api.production_scheduler import ProductionScheduler
+        machines = list(MachineSettings.objects.filter(machine_type='printer').order_by('machine_name')[:SAMPLE_MACHINES])
+        self.measure('optimize_machine_queue', len(machines), lambda: [
+            ProductionScheduler.optimize_machine_queue(machine) for machine in machines
+        ])
+
+    def _deadline_estimation(self):
+        from api.capable_to_promise import CapableToPromise, PromiseState
+        from api.delivery_forecast import BacklogDistribution, DeliveryForecast, DurationModel
+        from api.pricing_logic import CapacityAwareCalculator
+
+        rng = random.Random(self.shop.seed)
+        quotes = [
+            DeliveryForecast.steps_for_quote({}, rng.randint(*QUANTITY_RANGE), rng.random() < 0.5)
+            for _ in range(self.sample_calls)
+        ]
+        PromiseState.invalidate()
+        self.measure('promise_state', 1, PromiseState.get)
+        self.measure('promise', len(quotes), lambda: [CapableToPromise().promise(steps) for steps in quotes])
+
+        orders = list(Order.objects.order_by('order_number')[:self.sample_calls])
+        self.measure('realistic_deadline', len(orders), lambda: [
+            CapacityAwareCalculator.calculate_realistic_deadline(order) for order in orders
+        ])
+
+        model = DurationModel.get()
+        BacklogDistribution.invalidate()
+        self.measure('forecast_backlog', 1, lambda: BacklogDistribution.get(model))
+        self.measure('delivery_forecast', len(quotes), lambda: [
+            DeliveryForecast(now=self.shop.now, seed=self.shop.seed).predict(steps) for steps in quotes
+        ])
+
+    def _tardiness_optimizer(self):
+        from api.tardiness_optimizer import TardinessOptimizer
+        self.measure('tardiness_optimizer', 1, lambda: TardinessOptimizer.run(
+            now=self.shop.now, time_limit_ms=TARDINESS_TIME_LIMIT_MS, commit=False, seed=self.shop.seed,
+        ))
+
+    def _critical_path(self):
+        from api.critical_path import CriticalPath
+        order_ids = list(ProductionStep.objects.values_list('order_id', flat=True).distinct())
+        self.measure('critical_path', 1, lambda: CriticalPath.for_orders(order_ids))
+
+    def _shop_simulation(self):
+        from api.shop_simulator import ShopModel, ShopSimulation
+        self.measure('shop_simulation', 1, lambda: ShopSimulation(
+            ShopModel.load(horizon_days=SIMULATION_DAYS, now=self.shop.now), seed=self.shop.seed,
+        ).run())
+
+    def _worker_assignment(self):
+        from api.worker_assignment import STEP_WORKFORCE, WorkerAssignmentSolver
+        step_ids = list(ProductionStep.objects.filter(
+            status='pending', depends_on_step__isnull=True, step__in=list(STEP_WORKFORCE),
+        ).order_by('id').values_list('id', flat=True)[:ASSIGNMENT_STEPS])
+        self.measure('worker_assignment', 1, lambda: WorkerAssignmentSolver.run(
+            now=self.shop.now, step_ids=step_ids, commit=False,
+        ))
+
+    def _schedule_order_production(self):
+        from api.production_scheduler import ProductionScheduler
+        orders = [order for order, _ in self.shop.make_orders(self.sample_calls, prefix='BENCH-NEW')]
+        Order.objects.bulk_create(orders)
+        orders = list(Order.objects.filter(id__in=[order.id for order in orders]).select_related('product_template'))
+        self.measure('schedule_order_production', len(orders), lambda: [
+            ProductionScheduler.schedule_order_production(order) for order in orders
+        ])
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def plan_quality(planned_steps, now):
+        """Weighted tardiness, late orders and makespan (hours) of a plan"""
+        orders = {}
+        for step in planned_steps:
+            record = orders.setdefault(step.order_id, [step.end, step.deadline, step.order_priority])
+            record[0] = max(record[0], step.end)
+        tardiness = weighted = 0.0
+        late = 0
+        for end, deadline, rank in orders.values():
+            if deadline and end > deadline:
+                hours = (end - deadline).total_seconds() / 3600
+                tardiness += hours
+                weighted += TARDINESS_WEIGHT[rank] * hours
+                late += 1
+        ends = [end for end, _, _ in orders.values()]
+        return {
+            'orders': len(orders),
+            'late_orders': late,
+            'tardiness_hours': round(tardiness, 1),
+            'weighted_tardiness_hours': round(weighted, 1),
+            'makespan_hours': round((max(ends) - now).total_seconds() / 3600, 1) if ends else 0.0,
+        }
+
+    def run(self):
+        from api.capable_to_promise import PromiseState
+        from api.capacity_timeline import CapacityTimeline
+        from api.work_calendar import WorkingTimeCalendar
+
+        started = perf_counter()
+        self.shop.build()
+        # Bulk inserts send no signals: drop what the shifts, machines and downtimes feed
+        WorkingTimeCalendar.invalidate()
+        CapacityTimeline.invalidate()
+        PromiseState.invalidate()
+        build_ms = round((perf_counter() - started) * 1000, 1)
+        orders = self.shop.orders
+
+        self._replan()
+        self._calculate_step_times()
+        self._optimize_machine_queue()
+        self._deadline_estimation()
+        self._tardiness_optimizer()
+        self._critical_path()
+        self._shop_simulation()
+        self._worker_assignment()
+        self._schedule_order_production()
+
+        shop = self.shop
+        return {
+            'steps': shop.steps,
+            'orders': orders,
+            'machines': sum(len(ids) for ids in shop.machines.values()),
+            'seed': shop.seed,
+            'build_ms': build_ms,
+            'cases': self.cases,
+            'quality': self.quality,
+        }
+
+
+def load_baseline(path=BASELINE_PATH):
+    """{str(size): report} or {} when there is no baseline yet"""
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(reports, path=BASELINE_PATH):
+    """reports: {size: report}; sizes not in `reports` keep their baseline"""
+    baseline = load_baseline(path)
+    baseline.update({str(size): report for size, report in reports.items()})
+    with open(path, 'w') as handle:
+        json.dump(baseline, handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+
+def compare(report, baseline, latency_tolerance=LATENCY_TOLERANCE, quality_tolerance=QUALITY_TOLERANCE):
+    """
+    Regressions of `report` against the baseline report of the same size:
+    [(case or 'quality', metric, baseline value, value)].
+    """
+    regressions = []
+    if not baseline:
+        return regressions
+    for name, case in report['cases'].items():
+        before = baseline.get('cases', {}).get(name)
+        if before is None:
+            continue
+        if case['queries_per_call'] > before['queries_per_call'] * (1 + QUERY_TOLERANCE):
+            regressions.append((name, 'queries_per_call', before['queries_per_call'], case['queries_per_call']))
+        if case['ms_per_call'] > before['ms_per_call'] * (1 + latency_tolerance):
+            regressions.append((name, 'ms_per_call', before['ms_per_call'], case['ms_per_call']))
+    for metric in ('weighted_tardiness_hours', 'makespan_hours', 'late_orders'):
+        before = baseline.get('quality', {}).get(metric)
+        value = report['quality'].get(metric)
+        if before is None or value is None:
+            continue
+        # A late order or an hour of slack on top of the tolerance absorbs rounding on small shops
+        if value > before * (1 + quality_tolerance) + 1:
+            regressions.append(('quality', metric, before, value))
+    return regressions
@@ -3,14 +3,25 @@ Production Scheduling API Views (PrintERP TZ Section 7)
 Phase 3 Implementation
 """
 
+
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 from api.models import ProductionStep, MachineSettings, Order
 from api.production_scheduler import ProductionScheduler
+from api.finite_scheduler import FiniteCapacityScheduler
+from api.capacity_timeline import CapacityTimeline
+from api.setup_sequencer import SetupSequencer, DEFAULT_TIME_BUDGET_MS
+from api.tardiness_optimizer import TardinessOptimizer, DEFAULT_TIME_LIMIT_MS
+
+
+def _dry_run(request):
+    """dry_run from JSON or form data: "false" and "0" are False, like BatchAssignmentView"""
+    return str(request.data.get('dry_run', False)).lower() in ('1', 'true', 'yes')
 
 
 @api_view(['GET'])
@@ -103,32 +114,50 @@ def assign_step_to_machine(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def optimize_machine_queue(request, machine_id):
+def optimize_machine_queue(request, machine_id=None):
     """
-    Optimize the production queue for a machine.
+    Resequence a machine's pending queue to minimize setup changeovers.
     
-    POST /api/scheduling/machines/{machine_id}/optimize/
+    POST /api/production/optimize/
+    {
+        "machine_id": "uuid",
+        "time_budget_ms": 200,
+        "dry_run": false
+    }
     """
+    machine_id = machine_id or request.data.get('machine_id')
     try:
         machine = MachineSettings.objects.get(id=machine_id)
-    except MachineSettings.DoesNotExist:
+    except (MachineSettings.DoesNotExist, ValueError, ValidationError):
         return Response(
             {'error': 'Machine not found'},
             status=status.HTTP_404_NOT_FOUND
         )
     
-    # Optimize queue
-    reordered_steps = ProductionScheduler.optimize_machine_queue(machine)
+    try:
+        time_budget_ms = min(max(int(request.data.get('time_budget_ms', DEFAULT_TIME_BUDGET_MS)), 10), 5000)
+    except (TypeError, ValueError):
+        return Response({'error': 'time_budget_ms must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    dry_run = _dry_run(request)
+    
+    report = SetupSequencer(machine, time_budget_ms=time_budget_ms).optimize(commit=not dry_run)
     
     # Build response
+    steps = {
+        str(step_id): step for step_id, step in
+        ProductionStep.objects.filter(machine=machine, status='pending').select_related('order').in_bulk().items()
+    }
     queue = []
-    for step in reordered_steps:
+    for position, step_id in enumerate(report.pop('order'), start=1):
+        step = steps[step_id]
         queue.append({
             'id': str(step.id),
             'order_number': step.order.order_number,
             'step': step.get_step_display(),
-            'queue_position': step.queue_position,
+            'queue_position': position,
             'priority': step.priority,
+            'paper_type': step.order.paper_type,
+            'print_colors': step.order.print_colors,
             'estimated_start': step.estimated_start,
             'estimated_end': step.estimated_end
         })
@@ -137,10 +166,98 @@ def optimize_machine_queue(request, machine_id):
         'message': f'Queue optimized for {machine.machine_name}',
         'machine_id': str(machine.id),
         'reordered_steps_count': len(queue),
+        'dry_run': dry_run,
+        **report,
         'queue': queue
     })
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def replan_production(request):
+    """
+    Replan every open production step across all machines in one pass.
+    
+    POST /api/production/replan/
+    {
+        "dry_run": false
+    }
+    """
+    dry_run = _dry_run(request)
+    result = FiniteCapacityScheduler.replan(commit=not dry_run)
+    
+    return Response({
+        'scheduled': result['scheduled'],
+        'late_steps': result['late_steps'],
+        'makespan_end': result['makespan_end'],
+        'maintenance': [window.as_dict() for window in result['maintenance']],
+        'dry_run': dry_run
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def optimize_production_schedule(request):
+    """
+    Assign and sequence every open step to minimize weighted tardiness.
+    
+    POST /api/production/optimize-schedule/
+    {
+        "time_limit_ms": 1000,
+        "dry_run": false
+    }
+    """
+    try:
+        time_limit_ms = min(max(int(request.data.get('time_limit_ms', DEFAULT_TIME_LIMIT_MS)), 50), 30000)
+    except (TypeError, ValueError):
+        return Response({'error': 'time_limit_ms must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    dry_run = _dry_run(request)
+    
+    report = TardinessOptimizer.run(time_limit_ms=time_limit_ms, commit=not dry_run)
+    report['dry_run'] = dry_run
+    return Response(report)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_capacity_timeline(request):
+    """
+    Per-day available / scheduled / free machine-hours.
+    
+    GET /api/production/capacity/timeline/?start=2026-01-05&end=2026-01-30&machine_id=<uuid>
+    (defaults: today .. today + 13 days, all machines)
+    """
+    from datetime import timedelta
+    from django.utils.dateparse import parse_date
+
+    today = timezone.localdate()
+    try:
+        start = parse_date(request.query_params.get('start', '')) or today
+        end = parse_date(request.query_params.get('end', '')) or start + timedelta(days=13)
+    except ValueError:
+        return Response({'error': 'Invalid date'}, status=status.HTTP_400_BAD_REQUEST)
+    if end < start or (end - start).days > 366:
+        return Response(
+            {'error': 'end must be on or after start and within a year'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    machine_id = request.query_params.get('machine_id')
+    timeline = CapacityTimeline.get(covering=(start, end))
+    if machine_id:
+        machine_id = next((m for m in timeline.machine_index if str(m) == machine_id), None)
+        if machine_id is None:
+            return Response({'error': 'Machine not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'start': start,
+        'end': end,
+        'totals': timeline.totals(start, end, [machine_id] if machine_id else None),
+        'machines': timeline.machine_summary(start, end),
+        'days': timeline.daily(start, end, machine_id),
+    })
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def calculate_step_times(request, step_id):
@@ -2,8 +2,11 @@ import math
 from datetime import datetime, timedelta
 from django.db import transaction
 from django.utils import timezone
-from .models import PricingSettings, Material, MaterialBatch, ProductionStep, User
+from .models import PricingSettings, MaterialBatch, ProductionStep
 from .nesting_service import NestingService
+from .cost_index import MaterialCostIndex
+from .money import Money, Quantity
+from .tracing import stage
 
 # Material calculation constants
 WASTE_PERCENT = 0.05  # 5% waste allowance for paper
@@ -16,33 +19,19 @@ DEFAULT_COLORS_COUNT = 4  # CMYK
 class CalculationService:
     @staticmethod
     def get_average_material_price(material_name, category=None):
-        """Returns average cost from active batches if available, otherwise from Material model"""
-        q = Material.objects.filter(name__icontains=material_name)
-        if category: q = q.filter(category=category)
-        material = q.first()
-        
-        if not material: return 0.0
-        
-        # Try to get active batches average cost
-        active_batches = material.batches.filter(is_active=True, current_quantity__gt=0)
-        if active_batches.exists():
-            from django.db.models import Sum, F
-            totals = active_batches.aggregate(
-                total_qty=Sum('current_quantity'),
-                total_cost=Sum(F('current_quantity') * F('cost_per_unit'))
-            )
-            if totals['total_qty'] > 0:
-                return float(totals['total_cost'] / totals['total_qty'])
-        
-        return float(material.price_per_unit or 0)
+        """Returns weighted-average cost of usable batches if available, otherwise Material.price_per_unit"""
+        # Served from the incrementally maintained cost index (no queries once loaded)
+        return float(MaterialCostIndex.get_average_price(material_name, category))
 
     @staticmethod
-    def calculate_material_usage(data):
+    def calculate_material_usage(data, settings=None):
         """
         Calculates required materials based on order specs using dynamic waste settings.
         """
         quantity = int(data.get('quantity', 0))
-        settings = PricingSettings.load()
+        if settings is None:
+            with stage('settings'):
+                settings = PricingSettings.load()
         
         paper_width = float(data.get('paper_width') or 0)
         paper_height = float(data.get('paper_height') or 0)
@@ -72,7 +61,8 @@ class CalculationService:
             if paper_width > 0 and paper_height > 0:
                 try:
                     # Phase 2: Advanced Nesting Calculation
-                    nesting_result = NestingService.calculate_best_layout(paper_width, paper_height, quantity)
+                    with stage('nesting'):
+                        nesting_result = NestingService.calculate_best_layout(paper_width, paper_height, quantity)
                     
                     if "error" not in nesting_result:
                         best = nesting_result['recommended_format']
@@ -165,27 +155,29 @@ class CalculationService:
         return material_usage
 
     @staticmethod
-    def calculate_cost(data, material_usage=None, profile=None):
+    def calculate_cost(data, material_usage=None, profile=None, settings=None):
         """
         Calculates estimated cost including machine rates, tax, and profiles.
         """
+        if settings is None:
+            with stage('settings'):
+                settings = PricingSettings.load()
         if not material_usage:
-            material_usage = CalculationService.calculate_material_usage(data)
+            material_usage = CalculationService.calculate_material_usage(data, settings)
             
         quantity = int(data.get('quantity', 0))
         if quantity == 0:
             return {"total_price": 0, "price_per_unit": 0, "breakdown": {}}
-            
-        settings = PricingSettings.load()
         
-        # 1. Material Cost
-        paper_price = CalculationService.get_average_material_price(data.get('paper_type', ''), 'qogoz') or float(settings.paper_price_per_kg)
-        ink_price = CalculationService.get_average_material_price("Bo'yoq", 'siyoh') or float(settings.ink_price_per_kg)
-        lacquer_price = CalculationService.get_average_material_price(data.get('lacquer_type', ''), 'lak') or float(settings.lacquer_price_per_kg)
+        # 1. Material Cost (fixed-point: Money in tiyin, Quantity in micro-kg)
+        with stage('material_prices'):
+            paper_price = Money.of(MaterialCostIndex.get_average_price(data.get('paper_type', ''), 'qogoz')) or Money.of(settings.paper_price_per_kg)
+            ink_price = Money.of(MaterialCostIndex.get_average_price("Bo'yoq", 'siyoh')) or Money.of(settings.ink_price_per_kg)
+            lacquer_price = Money.of(MaterialCostIndex.get_average_price(data.get('lacquer_type', ''), 'lak')) or Money.of(settings.lacquer_price_per_kg)
         
-        cost_paper = float(material_usage["paper_kg"]) * paper_price
-        cost_ink = float(material_usage["ink_kg"]) * ink_price
-        cost_lacquer = float(material_usage["lacquer_kg"]) * lacquer_price
+        cost_paper = paper_price * Quantity.of(material_usage["paper_kg"])
+        cost_ink = ink_price * Quantity.of(material_usage["ink_kg"])
+        cost_lacquer = lacquer_price * Quantity.of(material_usage["lacquer_kg"])
         
         total_material_cost = cost_paper + cost_ink + cost_lacquer
         
@@ -195,31 +187,32 @@ class CalculationService:
         from .models import MachineSettings
         
         # Printing Cost
-        printer = MachineSettings.objects.filter(machine_type='printer', is_active=True).first()
-        printer_rate = float(printer.hourly_rate) if printer else float(settings.machine_hourly_rate)
-        printer_setup = float(printer.setup_time_minutes) / 60.0 if printer else 0.5
+        with stage('machines'):
+            printer = MachineSettings.objects.filter(machine_type='printer', is_active=True).first()
+            cutter = MachineSettings.objects.filter(machine_type='cutter', is_active=True).first()
+        printer_rate = Money.of(printer.hourly_rate if printer else settings.machine_hourly_rate)
+        printer_setup_minutes = printer.setup_time_minutes if printer else 30
         
         # Estimate Printing Time: Setup + (Quantity / Speed)
         # Speed assumption: 3000 sheets/hour (Offset)
         # We use 'paper_sheets' from material_usage as the "run quantity"
-        run_sheets = material_usage.get("paper_sheets", quantity)
-        printing_hours = printer_setup + (run_sheets / 3000.0)
-        cost_printing = printing_hours * printer_rate
+        run_sheets = int(material_usage.get("paper_sheets", quantity))
+        printing_hours = Quantity.ratio(printer_setup_minutes * 3000 + run_sheets * 60, 60 * 3000)
+        cost_printing = printer_rate * printing_hours
         
         # Cutting Cost
-        cutter = MachineSettings.objects.filter(machine_type='cutter', is_active=True).first()
-        cutter_rate = float(cutter.hourly_rate) if cutter else float(settings.machine_hourly_rate)
-        cutter_setup = float(cutter.setup_time_minutes) / 60.0 if cutter else 0.5
+        cutter_rate = Money.of(cutter.hourly_rate if cutter else settings.machine_hourly_rate)
+        cutter_setup_minutes = cutter.setup_time_minutes if cutter else 30
         
         # Cutting is usually slower? or 1 sheet at a time? 
         # Die cutting: 2000/hour
-        cutting_hours = cutter_setup + (run_sheets / 2000.0)
-        cost_cutting = cutting_hours * cutter_rate
+        cutting_hours = Quantity.ratio(cutter_setup_minutes * 2000 + run_sheets * 60, 60 * 2000)
+        cost_cutting = cutter_rate * cutting_hours
         
         machine_cost = cost_printing + cost_cutting
         
         # Phase 6: Die-Cut Cost (Engineering Logic)
-        die_cut_cost = 0
+        die_cut_cost = Money()
         knife_length_meters = 0
         
         # Check if profile has a parametric template type
@@ -272,7 +265,8 @@ class CalculationService:
                      generator = ShoppingBagGenerator(l, w, h, thickness=thickness_cm)
                 
                 if generator:
-                    knife_stats = generator.calculate_knife_length()
+                    with stage('die_cost'):
+                        knife_stats = generator.calculate_knife_length()
                     total_knife_len = knife_stats['cut'] + knife_stats['crease']
                     
                     # Formula: Base Die Cost + (Length * Price/m)
@@ -281,43 +275,46 @@ class CalculationService:
                     # For Price Quote, we add full Die Cost usually?
                     # Let's assume full cost for now (User pays for the Mold)
                     
-                    die_cut_cost = float(settings.base_die_cost) + (total_knife_len * float(settings.knife_price_per_meter))
+                    die_cut_cost = Money.of(settings.base_die_cost) + Money.of(settings.knife_price_per_meter) * Quantity.of(total_knife_len)
                     knife_length_meters = total_knife_len
 
             except Exception as e:
                 print(f"Die Calc Error: {e}")
         
         # 4. Profit Margin
-        total_operational_cost = machine_cost + float(settings.setup_cost) + die_cut_cost
+        total_operational_cost = machine_cost + Money.of(settings.setup_cost) + die_cut_cost
         gross_cost = total_material_cost + total_operational_cost
         
         # 4. Profit Margin based on Profile
-        margin_percent = float(settings.profit_margin_percent)
+        margin_percent = settings.profit_margin_percent
         profile = data.get('pricing_profile')
         if profile and profile in settings.pricing_profiles:
-            margin_percent = float(settings.pricing_profiles[profile])
+            margin_percent = settings.pricing_profiles[profile]
         
-        margin = margin_percent / 100.0
-        profit = gross_cost * margin
+        profit = gross_cost.percent(margin_percent)
         
         # 5. Tax (QQS)
         total_before_tax = gross_cost + profit
-        tax_amount = total_before_tax * (float(settings.tax_percent) / 100.0)
+        tax_amount = total_before_tax.percent(settings.tax_percent)
         
         final_price = total_before_tax + tax_amount
-        price_per_unit = final_price / quantity
+        price_per_unit = final_price.divide(quantity)
         
         return {
-            "total_price": round(final_price, -2), 
-            "price_per_unit": round(price_per_unit, 2),
+            "total_price": float(final_price.round_to(100)), 
+            "price_per_unit": float(price_per_unit),
+            "machine_hours": {
+                "printing": float(printing_hours),
+                "cutting": float(cutting_hours),
+            },
             "breakdown": {
-                "material_cost": round(total_material_cost, 2),
-                "operational_cost": round(total_operational_cost, 2),
-                "machine_cost": round(machine_cost, 2),
-                "die_cut_cost": round(die_cut_cost, 2), # Phase 6
+                "material_cost": float(total_material_cost),
+                "operational_cost": float(total_operational_cost),
+                "machine_cost": float(machine_cost),
+                "die_cut_cost": float(die_cut_cost), # Phase 6
                 "knife_length_m": round(knife_length_meters, 2),
-                "profit": round(profit, 2),
-                "tax": round(tax_amount, 2)
+                "profit": float(profit),
+                "tax": float(tax_amount)
             }
         }
 
@@ -341,6 +338,124 @@ class CalculationService:
         deadline = datetime.now() + timedelta(days=days)
         return deadline.date().isoformat()
 
+class EngineeringJobService:
+    """
+    Computes an order's EngineeringJob once and serves it to approval,
+    reservation and FIFO deduction. The job is recomputed lazily, only when
+    the fingerprint of its inputs (order specs, pricing settings, current
+    material prices and machine rates) changes.
+    """
+    ORDER_INPUT_FIELDS = (
+        'quantity', 'paper_width', 'paper_height', 'paper_type', 'paper_density',
+        'print_colors', 'lacquer_type', 'ink_coverage_percent',
+    )
+    SETTINGS_INPUT_FIELDS = (
+        'waste_percentage_paper', 'setup_waste_sheets', 'waste_percentage_ink',
+        'waste_percentage_lacquer', 'paper_price_per_kg', 'ink_price_per_kg',
+        'lacquer_price_per_kg', 'machine_hourly_rate', 'setup_cost',
+        'knife_price_per_meter', 'base_die_cost', 'profit_margin_percent',
+        'tax_percent', 'pricing_profiles',
+    )
+    # Read by calculate_cost from the order data but not Order columns (yet)
+    ORDER_DATA_KEYS = ('pricing_profile', 'box_style', 'width_cm', 'height_cm', 'depth_cm')
+
+    @staticmethod
+    def _normalize(instance, field_name):
+        """Field value in a form that is identical before and after a DB round trip"""
+        from decimal import Decimal
+
+        value = instance._meta.get_field(field_name).to_python(getattr(instance, field_name))
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            # 30 vs 30.0, Decimal('9000') vs Decimal('9000.00')
+            return EngineeringJobService._number(value)
+        return value
+
+    @staticmethod
+    def _number(value):
+        from decimal import Decimal
+
+        return str(Decimal(str(value)).normalize())
+
+    @staticmethod
+    def _material_prices(order):
+        """Cost-index prices calculate_cost looks up for this order: dictionary lookups"""
+        price = MaterialCostIndex.get_average_price
+        number = EngineeringJobService._number
+        return [
+            number(price(order.paper_type, 'qogoz')),
+            number(price("Bo'yoq", 'siyoh')),
+            number(price(order.lacquer_type, 'lak')),
+        ]
+
+    @staticmethod
+    def _machine_rates():
+        """Rate and setup time of the first active printer and cutter, as calculate_cost picks them"""
+        from .models import MachineSettings
+
+        rates = {}
+        for machine_type, hourly_rate, setup_minutes in MachineSettings.objects.filter(
+            machine_type__in=('printer', 'cutter'), is_active=True
+        ).values_list('machine_type', 'hourly_rate', 'setup_time_minutes'):
+            rates.setdefault(machine_type, [EngineeringJobService._number(hourly_rate), setup_minutes])
+        return rates
+
+    @staticmethod
+    def input_hash(order, settings):
+        import hashlib
+        import json
+
+        normalize = EngineeringJobService._normalize
+        payload = {
+            'order': {f: normalize(order, f) for f in EngineeringJobService.ORDER_INPUT_FIELDS},
+            'order_data': {key: getattr(order, key, None) for key in EngineeringJobService.ORDER_DATA_KEYS},
+            'settings': {f: normalize(settings, f) for f in EngineeringJobService.SETTINGS_INPUT_FIELDS},
+            'prices': EngineeringJobService._material_prices(order),
+            'machines': EngineeringJobService._machine_rates(),
+        }
+        raw = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def get_job(order, settings=None):
+        """Return an up-to-date EngineeringJob for the order, computing it if needed"""
+        from .models import EngineeringJob
+
+        settings = settings or PricingSettings.load()
+        fingerprint = EngineeringJobService.input_hash(order, settings)
+
+        try:
+            job = order.engineering_job
+        except EngineeringJob.DoesNotExist:
+            job = EngineeringJob(order=order)
+
+        if job.pk and job.input_hash == fingerprint:
+            return job
+
+        return EngineeringJobService._compute(job, order, settings, fingerprint)
+
+    @staticmethod
+    def _compute(job, order, settings, fingerprint):
+        from django.forms.models import model_to_dict
+
+        order_data = model_to_dict(order)
+        usage = CalculationService.calculate_material_usage(order_data, settings)
+        cost_data = CalculationService.calculate_cost(order_data, usage, settings=settings)
+        machine_hours = cost_data.get('machine_hours', {})
+
+        job.input_hash = fingerprint
+        job.layout_description = usage.get('layout_description')
+        job.waste_percent_used = float(usage.get('waste_percent_used', 0) or 0)
+        job.paper_sheets = int(usage.get('paper_sheets', 0) or 0)
+        job.material_usage = usage
+        job.knife_length_m = float(cost_data.get('breakdown', {}).get('knife_length_m', 0) or 0)
+        job.printing_hours = machine_hours.get('printing', 0)
+        job.cutting_hours = machine_hours.get('cutting', 0)
+        job.cost_data = cost_data
+        job.save()
+
+        order.engineering_job = job
+        return job
+
 class ProductionAssignmentService:
     @staticmethod
     def auto_assign_production_steps(order):
@@ -380,12 +495,10 @@ class ProductionAssignmentService:
                 assignee = None
                 
                 # 1. Check Default User in Settings
+                # (otherwise left for the batch worker assignment below)
                 default_user = getattr(settings, default_field_name, None)
                 if default_user:
                     assignee = default_user
-                else:
-                    # 2. Find any active user with the role
-                    assignee = User.objects.filter(role=role_name, is_active=True).first()
                 
                 # Create Step
                 # Map 'getting_materials' to a valid choice if needed, or update Model choices.
@@ -407,8 +520,14 @@ class ProductionAssignmentService:
                     step=model_step_key,
                     status='pending',
                     assigned_to=assignee,
-                    notes=f"Auto-assigned to {assignee.username if assignee else 'None'}"
+                    notes=f"Auto-assigned to {assignee.username}" if assignee else "Auto-assigned by workload"
                 )
                 created_steps.append(step)
+            
+            # 2. Steps without a default user: min-cost matching on rates and current load
+            unassigned = [step.id for step in created_steps if step.assigned_to_id is None]
+            if unassigned:
+                from .worker_assignment import WorkerAssignmentSolver
+                WorkerAssignmentSolver.run(step_ids=unassigned)
                 
         return created_steps
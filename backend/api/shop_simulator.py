@@ -0,0 +1,338 @@
+"""
+Discrete-Event Shop Simulator
+What-if analysis for capacity changes (extra shift, extra machine, more orders).
+
+ShopModel.load() reads everything once: active machines, template routing
+(ProductTemplateRouting), Calendar days, active Shifts and an order arrival
+stream, either replayed from recent history or generated as a Poisson
+stream with the historical rate and template/quantity mix. The model is a
+plain picklable object, so each scenario runs in its own process without
+touching the database.
+
+A run is an event loop over arrivals and step completions. Every routed
+step waits FIFO for a free machine of its type and is processed in
+working time on the scenario's shift calendar (steps without a machine
+type only take time). Processing times are routing estimates with
+log-normal noise; scenarios share the seed so their differences come from
+the capacity change, not from the random draws.
+
+Reported per scenario: throughput, time-average WIP, machine utilization
+and lead-time percentiles.
+"""
+
+import heapq
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time, timedelta
+from time import perf_counter
+
+from django.utils import timezone
+
+from api.work_calendar import WorkingTimeCalendar
+
+# Used for orders without a template routing: (step, machine type, minutes per unit, setup minutes)
+DEFAULT_ROUTING = (
+    ('printing', 'printer', 0.02, 30),
+    ('cutting', 'cutter', 0.01, 15),
+    ('gluing', 'folder', 0.02, 10),
+    ('packaging', None, 0.005, 0),
+)
+DEFAULT_HORIZON_DAYS = 90
+DURATION_SIGMA = 0.2
+MAX_SCENARIOS = 8
+
+_ARRIVAL, _FINISH = 0, 1
+
+
+class ShopModel:
+    """Picklable snapshot of the shop that scenarios are applied to"""
+
+    def __init__(self, start, horizon_days, machines, routings, day_rows, shifts, arrivals, arrival_rate, mix, tz):
+        self.start = start
+        self.horizon_days = horizon_days
+        self.machines = machines          # [(name, machine_type)]
+        self.routings = routings          # {template_id: [(step, type, min/unit, setup)]}
+        self.day_rows = day_rows          # {date: (is_working, shift_count)}
+        self.shifts = shifts              # [(start_time, end_time, multiplier)]
+        self.arrivals = arrivals          # [(offset_hours, template_id, quantity)] or None
+        self.arrival_rate = arrival_rate  # orders per day for synthetic arrivals
+        self.mix = mix                    # [(template_id, quantity)] sampled for synthetic arrivals
+        self.tz = tz
+
+    @classmethod
+    def load(cls, horizon_days=DEFAULT_HORIZON_DAYS, arrivals='synthetic', history_days=90, now=None):
+        """
+        Five queries: machines, routing, calendar days, shifts, order history.
+        'history' arrivals replay the last horizon_days of orders; 'synthetic'
+        ones use the rate and mix of the last history_days.
+        """
+        from api.models import Calendar, MachineSettings, Order, ProductTemplateRouting, Shift
+
+        now = now or timezone.now()
+        tz = timezone.get_default_timezone()
+        start = timezone.make_aware(datetime.combine(timezone.localdate(now), dt_time(0, 0)), tz)
+        last_day = start.date() + timedelta(days=horizon_days * 2 + 60)
+
+        machines = list(
+            MachineSettings.objects.filter(is_active=True).order_by('machine_name').values_list(
+                'machine_name', 'machine_type'
+            )
+        )
+        routings = {}
+        for template_id, step, machine_type, per_unit, setup in ProductTemplateRouting.objects.filter(
+            is_deleted=False, is_optional=False,
+        ).order_by('template_id', 'sequence').values_list(
+            'template_id', 'step_name', 'required_machine_type', 'estimated_time_per_unit', 'setup_time_minutes'
+        ):
+            machine_type = (machine_type or '').strip().lower() or None
+            routings.setdefault(str(template_id), []).append((step, machine_type, float(per_unit), setup or 0))
+
+        day_rows = {
+            day: (is_working, shift_count)
+            for day, is_working, shift_count in Calendar.objects.filter(
+                date__gte=start.date(), date__lte=last_day
+            ).values_list('date', 'is_working_day', 'shift_count')
+        }
+        shifts = [
+            (s, e, float(m)) for s, e, m in Shift.objects.filter(is_active=True).order_by(
+                'start_time'
+            ).values_list('start_time', 'end_time', 'capacity_multiplier')
+        ]
+
+        if arrivals == 'history':
+            history_days = horizon_days  # replay the last horizon's worth of orders
+        since = now - timedelta(days=history_days)
+        history = list(
+            Order.objects.filter(created_at__gte=since).order_by('created_at').values_list(
+                'created_at', 'product_template_id', 'quantity'
+            )
+        )
+        mix = [(str(t) if t else None, q or 0) for _, t, q in history]
+        replay = None
+        if arrivals == 'history':
+            replay = [
+                ((created - since).total_seconds() / 3600.0, str(t) if t else None, q or 0)
+                for created, t, q in history
+            ]
+        rate = len(history) / float(history_days) if history_days else 0.0
+        return cls(start, horizon_days, machines, routings, day_rows, shifts, replay, rate, mix, tz)
+
+
+class ShopSimulation:
+    """One scenario run over a ShopModel"""
+
+    def __init__(self, model, scenario=None, seed=0):
+        scenario = scenario or {}
+        self.model = model
+        self.name = scenario.get('name', 'baseline')
+        self.random = random.Random(seed)
+        self.sigma = float(scenario.get('duration_sigma', DURATION_SIGMA))
+
+        machines = list(model.machines)
+        for machine_type, count in (scenario.get('extra_machines') or {}).items():
+            machines += [(f"{machine_type} +{i + 1}", machine_type) for i in range(int(count))]
+        self.machines = machines
+        self.free = {}
+        for index, (_, machine_type) in enumerate(machines):
+            self.free.setdefault(machine_type, []).append(index)
+        self.queues = {machine_type: deque() for machine_type in self.free}
+
+        shifts = scenario.get('shifts')
+        if shifts is None:
+            shifts = model.shifts
+        first_day = model.start.date()
+        last_day = first_day + timedelta(days=model.horizon_days * 2 + 60)
+        self.calendar = WorkingTimeCalendar(first_day, last_day, model.day_rows, shifts, tz=model.tz)
+
+        self.orders_per_day = float(scenario.get('orders_per_day', model.arrival_rate)) * float(
+            scenario.get('arrival_rate_multiplier', 1.0)
+        )
+        self.t0 = model.start.timestamp()
+        self.t_end = self.t0 + model.horizon_days * 86400.0
+
+    # ------------------------------------------------------------------
+    # Arrivals
+    # ------------------------------------------------------------------
+
+    def _arrivals(self):
+        model = self.model
+        if model.arrivals is not None:
+            for offset_hours, template_id, quantity in model.arrivals:
+                moment = self.t0 + offset_hours * 3600.0
+                if moment < self.t_end:
+                    yield moment, template_id, quantity
+            return
+
+        rate_per_second = self.orders_per_day / 86400.0
+        if rate_per_second <= 0:
+            return
+        mix = model.mix or [(None, 1000)]
+        moment = self.t0
+        while True:
+            moment += self.random.expovariate(rate_per_second)
+            if moment >= self.t_end:
+                return
+            template_id, quantity = self.random.choice(mix)
+            yield moment, template_id, quantity
+
+    def _route(self, template_id):
+        route = self.model.routings.get(template_id) if template_id else None
+        return route or DEFAULT_ROUTING
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+
+    def _duration(self, per_unit, setup, quantity):
+        minutes = per_unit * quantity + setup
+        return max(minutes, 1.0) * 60.0 * self.random.lognormvariate(0.0, self.sigma)
+
+    def _finish_time(self, start, effective_seconds):
+        begin = self.calendar.next_working_at(start)
+        if begin is None:
+            return None, None
+        end = self.calendar.add_seconds_at(begin, effective_seconds)
+        return begin, end
+
+    def run(self):
+        started = perf_counter()
+        events = []
+        seq = 0
+        jobs = []  # [route, quantity, arrived_at, step index, finished_at]
+        for moment, template_id, quantity in self._arrivals():
+            jobs.append([self._route(template_id), quantity, moment, 0, None])
+            events.append((moment, seq, _ARRIVAL, len(jobs) - 1, None))
+            seq += 1
+        heapq.heapify(events)
+
+        busy = [0.0] * len(self.machines)
+        wip = 0
+        wip_area = 0.0
+        last_event = self.t0
+        completed = []
+        processed_events = 0
+
+        def release(job_index, now):
+            """Send the job's current step to its machine type (or just let it take time)"""
+            nonlocal seq
+            job = jobs[job_index]
+            step, machine_type, per_unit, setup = job[0][job[3]]
+            duration = self._duration(per_unit, setup, job[1])
+            if machine_type not in self.free:
+                _, end = self._finish_time(now, duration)
+                if end is not None:
+                    heapq.heappush(events, (end, seq, _FINISH, job_index, None))
+                    seq += 1
+                return
+            if self.free[machine_type]:
+                start_on(self.free[machine_type].pop(), job_index, duration, now)
+            else:
+                self.queues[machine_type].append((job_index, duration))
+
+        def start_on(machine, job_index, duration, now):
+            nonlocal seq
+            _, end = self._finish_time(now, duration)
+            if end is None:
+                return  # beyond the calendar: the machine never frees up again
+            busy[machine] += duration
+            heapq.heappush(events, (end, seq, _FINISH, job_index, machine))
+            seq += 1
+
+        while events:
+            moment, _, kind, job_index, machine = heapq.heappop(events)
+            if moment > self.t_end:
+                break
+            processed_events += 1
+            wip_area += wip * (moment - last_event)
+            last_event = moment
+
+            job = jobs[job_index]
+            if kind == _ARRIVAL:
+                wip += 1
+                release(job_index, moment)
+                continue
+
+            if machine is not None:
+                machine_type = self.machines[machine][1]
+                queue = self.queues[machine_type]
+                if queue:
+                    next_job, duration = queue.popleft()
+                    start_on(machine, next_job, duration, moment)
+                else:
+                    self.free[machine_type].append(machine)
+
+            job[3] += 1
+            if job[3] < len(job[0]):
+                release(job_index, moment)
+            else:
+                job[4] = moment
+                wip -= 1
+                completed.append((moment - job[2]) / 86400.0)
+
+        wip_area += wip * (self.t_end - last_event)
+        return self._report(jobs, completed, busy, wip_area, processed_events, perf_counter() - started)
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _percentile(sorted_values, pct):
+        if not sorted_values:
+            return None
+        rank = max(1, -(-len(sorted_values) * pct // 100))
+        return round(sorted_values[int(rank) - 1], 2)
+
+    def _report(self, jobs, lead_times, busy, wip_area, processed_events, elapsed):
+        horizon = self.t_end - self.t0
+        start_hours, end_hours = self.calendar.cumulative_hours_at([self.t0, self.t_end])
+        available = max(float(end_hours - start_hours) * 3600.0, 1.0)
+        lead_times.sort()
+        per_type = {}
+        machines = []
+        for index, (name, machine_type) in enumerate(self.machines):
+            utilization = min(busy[index] / available, 1.0)
+            machines.append({'machine': name, 'machine_type': machine_type, 'utilization': round(utilization, 3)})
+            per_type.setdefault(machine_type, []).append(utilization)
+        weeks = horizon / (7 * 86400.0)
+        return {
+            'scenario': self.name,
+            'orders_arrived': len(jobs),
+            'orders_completed': len(lead_times),
+            'throughput_per_week': round(len(lead_times) / weeks, 2) if weeks else 0,
+            'average_wip': round(wip_area / horizon, 2) if horizon else 0,
+            'open_at_end': len(jobs) - len(lead_times),
+            'lead_time_days': {
+                'mean': round(sum(lead_times) / len(lead_times), 2) if lead_times else None,
+                'p50': self._percentile(lead_times, 50),
+                'p80': self._percentile(lead_times, 80),
+                'p95': self._percentile(lead_times, 95),
+            },
+            'utilization_by_type': {
+                machine_type: round(sum(values) / len(values), 3) for machine_type, values in per_type.items()
+            },
+            'machines': machines,
+            'events': processed_events,
+            'elapsed_ms': round(elapsed * 1000, 1),
+        }
+
+
+def _run_scenario(args):
+    model, scenario, seed = args
+    return ShopSimulation(model, scenario, seed=seed).run()
+
+
+def run_scenarios(model, scenarios, seed=0, processes=None):
+    """
+    Simulate each scenario on the same model and seed. Runs in a process pool
+    when there is more than one scenario and processes != 1.
+    """
+    scenarios = list(scenarios)[:MAX_SCENARIOS] or [{}]
+    jobs = [(model, scenario, seed) for scenario in scenarios]
+    workers = min(len(jobs), processes or os.cpu_count() or 1)
+    if workers <= 1:
+        return [_run_scenario(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_scenario, jobs))
@@ -4,8 +4,18 @@ from django.conf import settings
 from django.db.models import Sum
 import requests
 import logging
-from .models import Order, MaterialBatch, Material
+from .models import (
+    Order, MaterialBatch, Material, Calendar, Shift, MachineSettings, MachineDowntime,
+    ProductionStep, WorkerTimeLog, Reservation
+)
 from .services import ProductionAssignmentService
+from .cost_index import MaterialCostIndex
+from .work_calendar import WorkingTimeCalendar, WorkingDayIndex
+from .capacity_timeline import CapacityTimeline
+from .capable_to_promise import PromiseState
+from .delivery_forecast import BacklogDistribution
+from .bottleneck_monitor import BottleneckMonitor
+from . import step_durations
 
 logger = logging.getLogger(__name__)
 
@@ -99,12 +109,77 @@ def recalculate_material_stock(material):
 
 
 @receiver(post_save, sender=MaterialBatch)
-def update_material_stock_on_batch_save(sender, instance, **kwargs):
-    """Update Material.current_stock when a batch is saved."""
+def update_material_stock_on_batch_save(sender, instance, created, **kwargs):
+    """Update Material.current_stock and the cost index when a batch is saved."""
+    MaterialCostIndex.on_batch_saved(instance, created=created)
     recalculate_material_stock(instance.material)
 
 
 @receiver(post_delete, sender=MaterialBatch)
 def update_material_stock_on_batch_delete(sender, instance, **kwargs):
-    """Update Material.current_stock when a batch is deleted."""
+    """Update Material.current_stock and the cost index when a batch is deleted."""
+    MaterialCostIndex.on_batch_deleted(instance)
     recalculate_material_stock(instance.material)
+
+
+@receiver(post_save, sender=Material)
+def update_cost_index_on_material_save(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the cost index's name/category/price lookup in sync."""
+    MaterialCostIndex.on_material_saved(instance, created=created, update_fields=update_fields)
+
+
+@receiver(post_delete, sender=Material)
+def update_cost_index_on_material_delete(sender, instance, **kwargs):
+    MaterialCostIndex.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Calendar)
+@receiver([post_save, post_delete], sender=Shift)
+def invalidate_work_calendar(sender, **kwargs):
+    """Working hours changed; the calendar index is rebuilt on next use."""
+    WorkingTimeCalendar.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Calendar)
+def invalidate_working_days(sender, instance, **kwargs):
+    """Only the changed day's year of the working-day bitmap is rebuilt."""
+    WorkingDayIndex.invalidate(instance=instance)
+
+
+@receiver([post_save, post_delete], sender=MachineSettings)
+@receiver([post_save, post_delete], sender=MachineDowntime)
+def invalidate_capacity_timeline(sender, **kwargs):
+    """Machine capacity changed; the timeline is rebuilt on next use."""
+    CapacityTimeline.invalidate()
+    PromiseState.invalidate()
+    BacklogDistribution.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_promise_state(sender, **kwargs):
+    """Free material changed; capable-to-promise state is rebuilt on next use."""
+    PromiseState.invalidate()
+
+
+@receiver(post_save, sender=ProductionStep)
+def track_step_statistics(sender, instance, created, **kwargs):
+    """Queue/utilization counters follow every step status change."""
+    BottleneckMonitor.on_step_saved(sender, instance=instance, created=created)
+
+
+@receiver(post_delete, sender=ProductionStep)
+def untrack_deleted_step(sender, instance, **kwargs):
+    BottleneckMonitor.on_step_deleted(sender, instance=instance)
+
+
+@receiver(post_save, sender=WorkerTimeLog)
+def track_time_log_statistics(sender, instance, created, **kwargs):
+    """Pauses stop a step counting as busy time; resumes restart it."""
+    BottleneckMonitor.on_time_logged(sender, instance=instance, created=created)
+
+
+@receiver(post_save, sender=WorkerTimeLog)
+def materialize_step_duration(sender, instance, created, **kwargs):
+    """A FINISH closes the step's intervals; store its working and paused minutes."""
+    if created and instance.action == 'finish':
+        step_durations.materialize([instance.production_step_id])
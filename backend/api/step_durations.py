@@ -0,0 +1,97 @@
+"""
+Step Durations
+Net working and paused minutes of production steps from their time logs.
+
+Every log is paired with the previous log of the same worker on the
+same step by a LAG window over (production_step, worker) ordered by
+timestamp, so the database hands back intervals instead of raw events:
+the time since a START or RESUME is work, the time since a PAUSE is
+paused (counted under that pause's reason), and nothing runs after a
+FINISH. Workers sharing a step each contribute their own intervals,
+which are summed - the same hours EfficiencyLearner's net_hours counts.
+Any number of steps is one query and a single pass summing intervals -
+no per-step walk.
+
+Results are materialized on ProductionStep.actual_duration_minutes,
+paused_minutes and pause_breakdown with one bulk_update. A FINISH log
+materializes its own step (see signals.py); `materialize()` without
+step ids backfills completed steps that have no duration yet.
+"""
+
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+
+from api.models import ProductionStep, WorkerTimeLog
+
+WORKING_ACTIONS = ('start', 'resume')
+
+
+def log_intervals(step_ids=None):
+    """(step_id, action, timestamp, previous action, previous timestamp, previous pause reason) rows"""
+    window = {
+        'partition_by': [F('production_step_id'), F('worker_id')],
+        'order_by': [F('timestamp').asc(), F('created_at').asc()],
+    }
+    logs = WorkerTimeLog.objects.filter(is_deleted=False)
+    if step_ids is not None:
+        logs = logs.filter(production_step_id__in=step_ids)
+    return logs.annotate(
+        previous_action=Window(Lag('action'), **window),
+        previous_timestamp=Window(Lag('timestamp'), **window),
+        previous_reason=Window(Lag('pause_reason'), **window),
+    ).values_list(
+        'production_step_id', 'action', 'timestamp',
+        'previous_action', 'previous_timestamp', 'previous_reason',
+    )
+
+
+def step_durations(step_ids=None):
+    """
+    {step_id: {'work_seconds', 'pause_seconds', 'pause_breakdown': {reason: seconds},
+               'logs', 'first_log', 'finished_at'}}
+    """
+    durations = {}
+    for step_id, action, timestamp, previous, previous_at, reason in log_intervals(step_ids):
+        record = durations.get(step_id)
+        if record is None:
+            record = durations[step_id] = {
+                'work_seconds': 0.0, 'pause_seconds': 0.0, 'pause_breakdown': {},
+                'logs': 0, 'first_log': timestamp, 'finished_at': None,
+            }
+        record['logs'] += 1
+        record['first_log'] = min(record['first_log'], timestamp)
+        if action == 'finish' and (record['finished_at'] is None or timestamp > record['finished_at']):
+            record['finished_at'] = timestamp
+        if previous is None:
+            continue
+        seconds = (timestamp - previous_at).total_seconds()
+        if previous in WORKING_ACTIONS:
+            record['work_seconds'] += seconds
+        elif previous == 'pause':
+            record['pause_seconds'] += seconds
+            key = reason or 'other'
+            record['pause_breakdown'][key] = record['pause_breakdown'].get(key, 0.0) + seconds
+    return durations
+
+
+def materialize(step_ids=None):
+    """Write durations for the given steps, or for completed steps still missing one"""
+    if step_ids is None:
+        step_ids = ProductionStep.objects.filter(
+            status='completed', actual_duration_minutes__isnull=True, time_logs__isnull=False,
+        ).values('id').distinct()
+    steps = [
+        ProductionStep(
+            id=step_id,
+            actual_duration_minutes=round(record['work_seconds'] / 60),
+            paused_minutes=round(record['pause_seconds'] / 60),
+            pause_breakdown={
+                reason: round(seconds / 60, 1) for reason, seconds in record['pause_breakdown'].items()
+            },
+        )
+        for step_id, record in step_durations(step_ids).items()
+    ]
+    ProductionStep.objects.bulk_update(
+        steps, ['actual_duration_minutes', 'paused_minutes', 'pause_breakdown'], batch_size=500
+    )
+    return len(steps)
@@ -0,0 +1,365 @@
+"""
+Weighted-Tardiness Schedule Optimizer
+Assigns open steps to eligible machines and sequences them by local search.
+
+A candidate schedule is a dispatch rank over all open steps plus a machine
+per step. It is decoded like the list scheduler: ready steps are taken in
+rank order and started at the latest of now, the predecessors' ends and the
+machine's free time, but durations are counted in working time on the
+shift calendar and pushed past downtime. The cost is the weighted
+tardiness of each order's last step against Order.deadline, weighted by
+order priority and step priority, with makespan as a tie-breaker.
+
+The search starts from the list scheduler's dispatch order (the greedy
+baseline) and applies random moves until the time limit: pull a late
+order's steps forward, swap two steps competing for the same machine
+type, or move a step to another active machine of the same type. Moves
+that do not make the schedule worse are kept, so the best plan so far can
+be returned at any time.
+"""
+
+import heapq
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from django.utils import timezone
+
+from api.finite_scheduler import ShopSnapshot, update_rows
+from api.models import ProductionStep
+from api.work_calendar import WorkingTimeCalendar
+
+DEFAULT_TIME_LIMIT_MS = 1000
+
+# Weight per ORDER_PRIORITY_RANK (urgent, high, normal)
+ORDER_WEIGHT = (4.0, 2.0, 1.0)
+
+# Tie-breaker: one hour of makespan is worth this much weighted tardiness (hours)
+MAKESPAN_WEIGHT = 0.001
+
+
+class TardinessOptimizer:
+    def __init__(self, snapshot, calendar=None, seed=0):
+        self.snapshot = snapshot
+        self.now = snapshot.now.timestamp()
+        self.random = random.Random(seed)
+        self.calendar = calendar or WorkingTimeCalendar.get(
+            covering=(timezone.localdate(snapshot.now), timezone.localdate(snapshot.now) + timedelta(days=90))
+        )
+        self._index()
+
+    # ------------------------------------------------------------------
+    # Setup
+    # ------------------------------------------------------------------
+
+    def _index(self):
+        snapshot = self.snapshot
+        steps = list(snapshot.steps.values())
+        self.ids = [step.id for step in steps]
+        position = {step.id: i for i, step in enumerate(steps)}
+        n = len(steps)
+
+        self.duration = [step.duration.total_seconds() for step in steps]
+        self.predecessors = [[position[p] for p in step.predecessors if p in position] for step in steps]
+        self.outside_ready = []
+        for step in steps:
+            done = [
+                snapshot.predecessor_done[p].timestamp() for p in step.predecessors
+                if p not in position and snapshot.predecessor_done.get(p)
+            ]
+            self.outside_ready.append(max(done) if done else None)
+        self.successors = [[] for _ in range(n)]
+        for i, preds in enumerate(self.predecessors):
+            for p in preds:
+                self.successors[p].append(i)
+
+        self.fixed_start = [
+            step.started_at.timestamp() if step.status == 'in_progress' and step.started_at else None
+            for step in steps
+        ]
+
+        # Orders: deadline and weight, steps per order
+        self.order_of = []
+        order_index = {}
+        self.order_deadline = []
+        self.order_weight = []
+        for step in steps:
+            k = order_index.get(step.order_id)
+            if k is None:
+                k = order_index[step.order_id] = len(self.order_deadline)
+                self.order_deadline.append(step.deadline.timestamp() if step.deadline else None)
+                self.order_weight.append(0.0)
+            weight = ORDER_WEIGHT[min(step.order_priority, 2)] * (11 - min(max(step.priority, 1), 10)) / 6.0
+            self.order_weight[k] = max(self.order_weight[k], weight)
+            self.order_of.append(k)
+        self.order_steps = [[] for _ in self.order_deadline]
+        for i, k in enumerate(self.order_of):
+            self.order_steps[k].append(i)
+
+        # Eligible machines: active machines of the assigned machine's type
+        by_type = {}
+        for machine_id, machine in snapshot.machines.items():
+            if machine['is_active']:
+                by_type.setdefault(machine['machine_type'], []).append(machine_id)
+        for machines in by_type.values():
+            machines.sort(key=str)
+        self.eligible = []
+        self.machine_type = []
+        for i, step in enumerate(steps):
+            machine = snapshot.machines.get(step.machine_id)
+            if step.machine_id is None or machine is None or self.fixed_start[i] is not None:
+                options = [step.machine_id]
+            else:
+                options = by_type.get(machine['machine_type']) or [step.machine_id]
+                if step.machine_id not in options:
+                    options = [step.machine_id] + options
+            self.eligible.append(options)
+            self.machine_type.append(machine['machine_type'] if machine else None)
+
+        self.downtimes = {
+            machine_id: [(start.timestamp(), end.timestamp()) for start, end in windows]
+            for machine_id, windows in snapshot.downtimes.items()
+        }
+
+        far_future = snapshot.now + timedelta(days=3650)
+        greedy = sorted(range(n), key=lambda i: (self.fixed_start[i] is None, steps[i].sort_key(far_future)))
+        self.greedy_rank = [0] * n
+        for rank, i in enumerate(greedy):
+            self.greedy_rank[i] = rank
+        self.greedy_machine = [step.machine_id for step in steps]
+
+    # ------------------------------------------------------------------
+    # Decoding
+    # ------------------------------------------------------------------
+
+    def _place(self, start, duration, windows):
+        """Earliest working-time slot of `duration` effective seconds at or after start"""
+        calendar = self.calendar
+        for _ in range(100):
+            begin = calendar.next_working_at(start)
+            if begin is None:
+                return start, start + duration
+            end = calendar.add_seconds_at(begin, duration) if duration > 0 else begin
+            if end is None:
+                return begin, begin + duration
+            for window_start, window_end in windows:
+                if window_start < end and window_end > begin:
+                    start = window_end
+                    break
+            else:
+                return begin, end
+        return start, start + duration
+
+    def decode(self, rank, machine):
+        """List-schedule by rank; returns (starts, ends) in epoch seconds"""
+        n = len(rank)
+        starts = [0.0] * n
+        ends = [0.0] * n
+        machine_free = {}
+        missing = [len(preds) for preds in self.predecessors]
+        heap = [(rank[i], i) for i in range(n) if not missing[i]]
+        heapq.heapify(heap)
+        placed = [False] * n
+        done = 0
+        while done < n:
+            if not heap:
+                # Dependency cycle: release what is left
+                heap = [(rank[i], i) for i in range(n) if not placed[i]]
+                heapq.heapify(heap)
+            _, i = heapq.heappop(heap)
+            if placed[i]:
+                continue
+            m = machine[i]
+            if self.fixed_start[i] is not None:
+                start = self.fixed_start[i]
+                end = max(self.now, self.calendar.add_seconds_at(start, self.duration[i]) or start + self.duration[i])
+            else:
+                earliest = self.now
+                for p in self.predecessors[i]:
+                    if placed[p]:
+                        earliest = max(earliest, ends[p])
+                if self.outside_ready[i]:
+                    earliest = max(earliest, self.outside_ready[i])
+                if m is not None:
+                    earliest = max(earliest, machine_free.get(m, self.now))
+                start, end = self._place(earliest, self.duration[i], self.downtimes.get(m, ()) if m else ())
+            starts[i], ends[i] = start, end
+            placed[i] = True
+            done += 1
+            if m is not None:
+                machine_free[m] = max(machine_free.get(m, self.now), end)
+            for successor in self.successors[i]:
+                missing[successor] -= 1
+                if missing[successor] <= 0:
+                    heapq.heappush(heap, (rank[successor], successor))
+        return starts, ends
+
+    def cost(self, ends):
+        """(objective, weighted tardiness hours, late orders, makespan epoch)"""
+        tardiness = 0.0
+        late = 0
+        for k, members in enumerate(self.order_steps):
+            deadline = self.order_deadline[k]
+            if deadline is None:
+                continue
+            finish = max(ends[i] for i in members)
+            if finish > deadline:
+                tardiness += self.order_weight[k] * (finish - deadline) / 3600.0
+                late += 1
+        makespan = max(ends) if ends else self.now
+        return tardiness + MAKESPAN_WEIGHT * (makespan - self.now) / 3600.0, tardiness, late, makespan
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def _late_orders(self, ends):
+        late = []
+        for k, members in enumerate(self.order_steps):
+            deadline = self.order_deadline[k]
+            if deadline is not None and max(ends[i] for i in members) > deadline:
+                late.append(k)
+        return late
+
+    def _neighbour(self, rank, machine, ends):
+        """One random move; returns new (rank, machine) or None"""
+        n = len(rank)
+        rank = list(rank)
+        machine = list(machine)
+        move = self.random.random()
+        late = self._late_orders(ends)
+
+        if late and move < 0.45:
+            # Pull a late order's steps ahead of everything between them and the front
+            k = self.random.choice(late)
+            shift = self.random.uniform(0.2, 1.0)
+            for i in self.order_steps[k]:
+                if self.fixed_start[i] is None:
+                    rank[i] = rank[i] * (1.0 - shift) - 0.5
+            return rank, machine
+
+        if move < 0.75:
+            # Swap two steps competing for the same machine type
+            i = self.random.randrange(n)
+            if self.fixed_start[i] is not None or self.machine_type[i] is None:
+                return None
+            candidates = [
+                j for j in self.random.sample(range(n), min(n, 16))
+                if j != i and self.fixed_start[j] is None and self.machine_type[j] == self.machine_type[i]
+            ]
+            if not candidates:
+                return None
+            j = candidates[0]
+            rank[i], rank[j] = rank[j], rank[i]
+            return rank, machine
+
+        # Move a step to another eligible machine
+        flexible = [i for i in range(n) if len(self.eligible[i]) > 1]
+        if not flexible:
+            return None
+        i = self.random.choice(flexible)
+        options = [m for m in self.eligible[i] if m != machine[i]]
+        machine[i] = self.random.choice(options)
+        return rank, machine
+
+    def optimize(self, time_limit_ms=DEFAULT_TIME_LIMIT_MS, max_iterations=None, started=None):
+        """started: perf_counter() reading the limit runs from, so a caller's setup counts against it"""
+        started = perf_counter() if started is None else started
+        deadline_at = started + time_limit_ms / 1000.0
+
+        rank = [float(r) for r in self.greedy_rank]
+        machine = list(self.greedy_machine)
+        starts, ends = self.decode(rank, machine)
+        baseline = self.cost(ends)
+        current = best = (baseline, rank, machine, starts, ends)
+
+        iterations = 0
+        while perf_counter() < deadline_at and len(rank) > 1:
+            if max_iterations is not None and iterations >= max_iterations:
+                break
+            if best[0][1] == 0:
+                break  # nothing late
+            iterations += 1
+            candidate = self._neighbour(current[1], current[2], current[4])
+            if candidate is None:
+                continue
+            starts, ends = self.decode(*candidate)
+            score = self.cost(ends)
+            if score[0] <= current[0][0]:
+                current = (score, candidate[0], candidate[1], starts, ends)
+                if score[0] < best[0][0]:
+                    best = current
+
+        self.best = best
+        score, rank, machine, starts, ends = best
+        return {
+            'steps': len(rank),
+            'baseline_weighted_tardiness_hours': round(baseline[1], 2),
+            'weighted_tardiness_hours': round(score[1], 2),
+            'improvement_hours': round(baseline[1] - score[1], 2),
+            'improvement_percent': round((baseline[1] - score[1]) / baseline[1] * 100, 1) if baseline[1] > 0 else 0,
+            'late_orders_before': baseline[2],
+            'late_orders_after': score[2],
+            'makespan_end_before': self._datetime(baseline[3]),
+            'makespan_end': self._datetime(score[3]),
+            'reassigned_steps': sum(1 for a, b in zip(machine, self.greedy_machine) if a != b),
+            'iterations': iterations,
+            'elapsed_ms': round((perf_counter() - started) * 1000, 1),
+        }
+
+    def _datetime(self, seconds):
+        return datetime.fromtimestamp(seconds, tz=self.calendar.tz)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def write(self):
+        """One executemany UPDATE of machine, times and queue positions for the best plan"""
+        _, rank, machine, starts, ends = self.best
+        per_machine = {}
+        for i, m in enumerate(machine):
+            if m is not None:
+                per_machine.setdefault(m, []).append(i)
+        position = {}
+        for members in per_machine.values():
+            members.sort(key=lambda i: (starts[i], rank[i]))
+            for p, i in enumerate(members, start=1):
+                position[i] = p
+
+        written = update_rows(
+            ProductionStep,
+            ['machine', 'estimated_start', 'estimated_end', 'estimated_duration_minutes', 'setup_minutes', 'queue_position'],
+            [
+                (
+                    machine[i], self._datetime(starts[i]), self._datetime(ends[i]),
+                    int(round(self.duration[i] / 60)), None, position.get(i), step_id,
+                )
+                for i, step_id in enumerate(self.ids)
+            ],
+        )
+        from api.capacity_timeline import CapacityTimeline
+        CapacityTimeline.invalidate()
+        from api.capable_to_promise import PromiseState
+        PromiseState.invalidate()
+        from api.delivery_forecast import BacklogDistribution
+        BacklogDistribution.invalidate()
+        return written
+
+    @classmethod
+    def run(cls, now=None, time_limit_ms=DEFAULT_TIME_LIMIT_MS, commit=True, seed=0):
+        """
+        Load the shop, optimize and optionally write the plan. Loading counts
+        against time_limit_ms; the search stops early enough for it, but a
+        single decode or the write can still run past the limit. elapsed_ms
+        covers the whole call and overshoot_ms by how much it went over.
+        """
+        started = perf_counter()
+        optimizer = cls(ShopSnapshot.load(now), seed=seed)
+        report = optimizer.optimize(time_limit_ms=time_limit_ms, started=started)
+        if commit and optimizer.ids:
+            optimizer.write()
+        elapsed_ms = round((perf_counter() - started) * 1000, 1)
+        report['elapsed_ms'] = elapsed_ms
+        report['overshoot_ms'] = round(max(0.0, elapsed_ms - time_limit_ms), 1)
+        return report
@@ -308,15 +308,16 @@ class WorkerTimeLogViewSet(viewsets.ModelViewSet):
             location=request.data.get('location')
         )
         
-        # Update production step status based on action
+        # Update production step status based on action. Only these fields are
+        # saved: a FINISH log has already written the step's durations.
         if action == 'start':
             production_step.status = 'in_progress'
             production_step.started_at = timezone.now()
-            production_step.save()
+            production_step.save(update_fields=['status', 'started_at'])
         elif action == 'finish':
             production_step.status = 'completed'
             production_step.completed_at = timezone.now()
-            production_step.save()
+            production_step.save(update_fields=['status', 'completed_at'])
         
         serializer = self.get_serializer(log)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -337,11 +338,11 @@ class WorkerTimeLogViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        logs = WorkerTimeLog.objects.filter(
-            production_step_id=step_id
-        ).order_by('timestamp')
+        # Intervals come paired by a LAG window; no walk over the raw logs
+        from api.step_durations import step_durations
+        record = next(iter(step_durations([step_id]).values()), None)
         
-        if not logs.exists():
+        if record is None:
             return Response({
                 'production_step_id': step_id,
                 'total_duration_minutes': 0,
@@ -350,32 +351,15 @@ class WorkerTimeLogViewSet(viewsets.ModelViewSet):
                 'logs_count': 0
             })
         
-        # Calculate durations
-        start_time = None
-        pause_start = None
-        total_work_seconds = 0
-        total_pause_seconds = 0
-        
-        for log in logs:
-            if log.action == 'start':
-                start_time = log.timestamp
-            elif log.action == 'pause' and start_time:
-                pause_start = log.timestamp
-            elif log.action == 'resume' and pause_start:
-                pause_duration = (log.timestamp - pause_start).total_seconds()
-                total_pause_seconds += pause_duration
-                pause_start = None
-            elif log.action == 'finish' and start_time:
-                end_time = log.timestamp
-                total_duration = (end_time - start_time).total_seconds()
-                total_work_seconds = total_duration - total_pause_seconds
-        
         return Response({
             'production_step_id': step_id,
-            'total_duration_minutes': round(total_work_seconds / 60, 2),
-            'work_duration_minutes': round((total_work_seconds - total_pause_seconds) / 60, 2),
-            'pause_duration_minutes': round(total_pause_seconds / 60, 2),
-            'logs_count': logs.count(),
-            'start_time': logs.first().timestamp if logs.exists() else None,
-            'end_time': logs.last().timestamp if logs.filter(action='finish').exists() else None
+            'total_duration_minutes': round((record['work_seconds'] + record['pause_seconds']) / 60, 2),
+            'work_duration_minutes': round(record['work_seconds'] / 60, 2),
+            'pause_duration_minutes': round(record['pause_seconds'] / 60, 2),
+            'pause_breakdown_minutes': {
+                reason: round(seconds / 60, 2) for reason, seconds in record['pause_breakdown'].items()
+            },
+            'logs_count': record['logs'],
+            'start_time': record['first_log'],
+            'end_time': record['finished_at']
         })
@@ -3,7 +3,9 @@ Phase 1: Core Infrastructure Tests
 Tests for BaseModel, SystemLock, Calendar, Shift, and Reservation
 """
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from datetime import datetime, timedelta, date, time
 from django.contrib.auth import get_user_model
@@ -13,7 +15,7 @@ from api.models import (
 )
 from api.locking import entity_lock, LockError, check_lock_status
 from api.calendar_utils import (
-    populate_calendar_year, add_holiday, 
+    populate_calendar_year, add_holiday, add_uzbekistan_holidays,
     calculate_deadline, get_production_capacity
 )
 
@@ -105,6 +107,26 @@ class CalendarTestCase(TestCase):
         monday = Calendar.objects.get(date=date(2026, 1, 5))  # Monday
         self.assertTrue(monday.is_working_day)
     
+    def test_populate_and_holidays_are_bulk(self):
+        """Population is one insert, holidays one upsert; existing days are kept"""
+        Calendar.objects.create(date=date(2026, 1, 5), is_working_day=False, notes="Inventory")
+        
+        with CaptureQueriesContext(connection) as populate:
+            populate_calendar_year(2026)
+        with self.assertNumQueries(1):
+            add_uzbekistan_holidays(2026)
+        
+        # Insert batches only (SQLite caps the rows per statement)
+        self.assertLessEqual(len(populate.captured_queries), 2)
+        
+        self.assertEqual(Calendar.objects.filter(date__year=2026).count(), 365)
+        self.assertEqual(Calendar.objects.get(date=date(2026, 1, 5)).notes, "Inventory")
+        independence = Calendar.objects.get(date=date(2026, 9, 1))
+        self.assertFalse(independence.is_working_day)
+        self.assertEqual(independence.notes, "Mustaqillik kuni")
+        # The week of Tuesday 1 September has four working days
+        self.assertEqual(Calendar.get_working_days_count(date(2026, 8, 31), date(2026, 9, 6)), 4)
+    
     def test_add_holiday(self):
         """Test adding a holiday"""
         holiday_date = date(2026, 1, 1)
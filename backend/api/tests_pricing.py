@@ -0,0 +1,301 @@
+"""
+Pricing Engine Tests
+Tests for the material cost index and the quote pricing path
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from api.models import Client, EngineeringJob, MachineSettings, Material, MaterialBatch, Order, PricingSettings, User
+from api.cost_index import MaterialCostIndex
+from api.money import Money, Quantity
+from api.services import CalculationService, EngineeringJobService
+from api.pricing_logic import ScenarioPricingService
+from api.tracing import StageStats, stage, trace_request
+
+
+class MaterialCostIndexTestCase(TestCase):
+    def setUp(self):
+        MaterialCostIndex.invalidate()
+        self.paper = Material.objects.create(
+            name="Karton 300g", category="qogoz", unit="kg", price_per_unit=9000
+        )
+
+    def _create_batch(self, quantity, cost):
+        with self.captureOnCommitCallbacks(execute=True):
+            return MaterialBatch.objects.create(
+                material=self.paper,
+                batch_number=f"B-{quantity}-{cost}",
+                initial_quantity=quantity,
+                current_quantity=quantity,
+                cost_per_unit=cost,
+            )
+
+    def test_falls_back_to_material_price(self):
+        """Without usable batches the material list price is used"""
+        self.assertEqual(CalculationService.get_average_material_price("karton", "qogoz"), 9000.0)
+        self.assertEqual(CalculationService.get_average_material_price("missing", "qogoz"), 0.0)
+
+    def test_weighted_average_from_batches(self):
+        """Average is weighted by current quantity and kept on the material row"""
+        self._create_batch(100, 10000)
+        self._create_batch(300, 14000)
+
+        self.assertEqual(CalculationService.get_average_material_price("Karton", "qogoz"), 13000.0)
+
+        self.paper.refresh_from_db()
+        self.assertEqual(self.paper.usable_stock, Decimal('400'))
+        self.assertEqual(self.paper.weighted_avg_cost, Decimal('13000'))
+
+    def test_deduction_updates_index_by_delta(self):
+        """FIFO-style deductions and deactivation are applied as deltas"""
+        old = self._create_batch(100, 10000)
+        self._create_batch(100, 20000)
+        MaterialCostIndex.get_average_price("karton")  # warm the in-memory copy
+
+        batch = MaterialBatch.objects.get(pk=old.pk)
+        batch.current_quantity = Decimal('50')
+        with self.captureOnCommitCallbacks(execute=True):
+            batch.save()
+
+        with self.assertNumQueries(0):
+            price = MaterialCostIndex.get_average_price("karton", "qogoz")
+        self.assertEqual(price.quantize(Decimal('0.01')), Decimal('16666.67'))
+
+        batch.current_quantity = Decimal('0')
+        batch.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            batch.save()
+        self.assertEqual(MaterialCostIndex.get_average_price("karton"), Decimal('20000'))
+
+    def test_full_material_save_keeps_index_columns(self):
+        """Saving a stale Material instance does not overwrite index columns"""
+        stale = Material.objects.get(pk=self.paper.pk)
+        self._create_batch(10, 5000)
+        stale.current_stock = 10
+        stale.save()
+
+        self.paper.refresh_from_db()
+        self.assertEqual(self.paper.usable_stock, Decimal('10'))
+        self.assertEqual(self.paper.stock_value, Decimal('50000'))
+
+    def test_rebuild_matches_batches(self):
+        self._create_batch(40, 2500)
+        Material.objects.filter(pk=self.paper.pk).update(usable_stock=0, stock_value=0)
+
+        MaterialCostIndex.rebuild()
+
+        self.paper.refresh_from_db()
+        self.assertEqual(self.paper.usable_stock, Decimal('40'))
+        self.assertEqual(self.paper.stock_value, Decimal('100000'))
+
+
+class MoneyTestCase(SimpleTestCase):
+    def test_exact_addition(self):
+        self.assertEqual(Money.of(0.1) + Money.of(0.2), Money.of('0.3'))
+        self.assertEqual(Money.sum([Money.of('0.01')] * 100), Money.of(1))
+
+    def test_price_times_quantity_rounds_half_up(self):
+        # 12.5 so'm/kg * 0.001 kg = 0.0125 -> 0.01
+        self.assertEqual(Money.of('12.5') * Quantity.of('0.001'), Money.of('0.01'))
+        # 15 so'm/kg * 0.001 kg = 0.015 -> 0.02 (half away from zero)
+        self.assertEqual(Money.of(15) * Quantity.of('0.001'), Money.of('0.02'))
+        self.assertEqual(-Money.of(15) * Quantity.of('0.001'), Money.of('-0.02'))
+
+    def test_percent_divide_and_round_to(self):
+        amount = Money.of('1234.56')
+        self.assertEqual(amount.percent(12), Money.of('148.15'))
+        self.assertEqual(amount.divide(3), Money.of('411.52'))
+        self.assertEqual(Money.of(1250).round_to(100), Money.of(1300))
+        self.assertEqual(Money.of(1249).round_to(100), Money.of(1200))
+        self.assertEqual(Money.of('1234.56').to_decimal(), Decimal('1234.56'))
+
+    def test_quantity_waste(self):
+        area = (Quantity.of(30) * Quantity.of(40)).divide(10000)
+        self.assertEqual(area, Quantity.of('0.12'))
+        self.assertEqual((area * 1000).with_waste(5), Quantity.of(126))
+
+
+class CalculateCostTestCase(TestCase):
+    def setUp(self):
+        MaterialCostIndex.invalidate()
+
+    def test_cost_is_rounded_to_tiyin(self):
+        usage = {"paper_sheets": 1000, "paper_kg": 12.34, "ink_kg": 0.5, "lacquer_kg": 0}
+        result = CalculationService.calculate_cost({"quantity": 1000}, material_usage=usage)
+
+        self.assertEqual(set(result["breakdown"]), {
+            "material_cost", "operational_cost", "machine_cost", "die_cut_cost",
+            "knife_length_m", "profit", "tax",
+        })
+        self.assertEqual(result["total_price"] % 100, 0)
+        for key in ("material_cost", "operational_cost", "machine_cost", "profit", "tax"):
+            value = result["breakdown"][key]
+            self.assertEqual(Money.of(value).to_decimal(), Decimal(repr(value)).quantize(Decimal('0.01')))
+
+
+class ScenarioPricingTestCase(TestCase):
+    def setUp(self):
+        MaterialCostIndex.invalidate()
+        self.data = {"quantity": 2000, "paper_width": 70, "paper_height": 100, "lacquer_type": "none"}
+
+    def test_all_scenarios_in_one_pass_without_writes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            result = ScenarioPricingService.price_all_scenarios(self.data)
+
+        writes = [q['sql'] for q in ctx.captured_queries
+                  if q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertFalse(PricingSettings.objects.exists())
+
+        scenarios = result['scenarios']
+        self.assertEqual(set(scenarios), {'Standard', 'Express', 'Night', 'Economy'})
+        base = Money.of(result['cost']['total_price'])
+        self.assertEqual(Money.of(scenarios['Express']['final_price']), base * Quantity.of('1.5'))
+        self.assertEqual(scenarios['Express']['estimated_days'], 2)
+        self.assertEqual(scenarios['Economy']['estimated_days'], 5)
+
+    def test_promised_deadline_never_precedes_earliest_completion(self):
+        now = timezone.now()
+        promise = {
+            'earliest_completion': now + timedelta(days=1),
+            'confidence_band': {'p90': now + timedelta(days=3)},
+        }
+
+        self.assertEqual(
+            ScenarioPricingService.promised_deadline(promise, 2), timezone.localtime(now + timedelta(days=5)).date()
+        )
+        self.assertEqual(
+            ScenarioPricingService.promised_deadline(promise, -5), timezone.localtime(now + timedelta(days=1)).date()
+        )
+
+    def test_quote_deadline_keeps_scenario_and_load_days(self):
+        from api.capable_to_promise import PromiseState
+        PromiseState.invalidate()
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='quoter', password='x'))
+
+        def deadline(scenario):
+            response = api.post(reverse('calculate-order'), dict(self.data, quantity=5000, scenario=scenario), format='json')
+            return date.fromisoformat(response.data['estimated_deadline'])
+
+        standard = deadline('Standard')
+        self.assertEqual((deadline('Economy') - standard).days, 2)
+        self.assertLessEqual(deadline('VIP'), standard)
+
+        client = Client.objects.create(full_name="Busy Client")
+        Order.objects.bulk_create([
+            Order(client=client, order_number=f"LOAD-{i}", quantity=100, status='approved') for i in range(16)
+        ])
+        self.assertEqual((deadline('Standard') - standard).days, 1)
+
+    def test_configured_scenarios_are_used(self):
+        settings = PricingSettings.load()
+        settings.scenario_pricing = {'Standard': 1.0, 'VIP': 1.2}
+        settings.save()
+
+        result = ScenarioPricingService.price_all_scenarios(self.data, current_load=0)
+
+        self.assertEqual(set(result['scenarios']), {'Standard', 'VIP'})
+        self.assertEqual(ScenarioPricingService.get_scenario_multiplier('Night'), 1.0)
+
+
+class QuoteTracingTestCase(TestCase):
+    def setUp(self):
+        MaterialCostIndex.invalidate()
+        StageStats.reset()
+
+    def test_stage_is_noop_without_trace(self):
+        self.assertIs(stage('a'), stage('b'))
+
+    def test_trace_records_stages_and_queries(self):
+        data = {"quantity": 500, "paper_width": 30, "paper_height": 40}
+        with trace_request(name='quote') as trace:
+            self.assertIsNone(trace)
+
+        with self.settings(QUOTE_TRACING_ENABLED=True):
+            with trace_request(name='quote') as trace:
+                CalculationService.calculate_cost(data)
+
+        stages = {row['stage']: row for row in trace.as_dict()['stages']}
+        self.assertIn('nesting', stages)
+        self.assertIn('machines', stages)
+        self.assertEqual(stages['machines']['queries'], 2)
+        self.assertGreaterEqual(trace.queries, 3)
+
+        stats = StageStats.snapshot()
+        self.assertEqual(stats['quote']['count'], 1)
+        self.assertIn('quote.material_prices', stats)
+
+    def test_debug_header_returns_trace(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='quoter', password='x'))
+        url = reverse('calculate-order')
+        payload = {"quantity": 500, "paper_width": 30, "paper_height": 40}
+
+        self.assertNotIn('trace', client.post(url, payload, format='json').data)
+
+        response = client.post(url, payload, format='json', HTTP_X_QUOTE_TRACE='1')
+        stage_names = [row['stage'] for row in response.data['trace']['stages']]
+        self.assertIn('capacity', stage_names)
+
+
+class EngineeringJobTestCase(TestCase):
+    def setUp(self):
+        MaterialCostIndex.invalidate()
+        client = Client.objects.create(full_name="Job Client")
+        self.order = Order.objects.create(
+            client=client, quantity=1000, paper_width=30, paper_height=40,
+            paper_type="Karton", paper_density=300, lacquer_type="none",
+        )
+
+    def test_job_is_computed_once_and_reused(self):
+        job = EngineeringJobService.get_job(self.order)
+        self.assertGreater(job.paper_sheets, 0)
+        self.assertGreater(job.printing_hours, 0)
+        self.assertEqual(job.material_usage['paper_sheets'], job.paper_sheets)
+
+        order = Order.objects.get(pk=self.order.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            again = EngineeringJobService.get_job(order)
+        self.assertEqual(again.pk, job.pk)
+        self.assertFalse([q for q in ctx.captured_queries
+                          if q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE'))])
+
+    def test_job_recomputed_when_inputs_change(self):
+        job = EngineeringJobService.get_job(self.order)
+        sheets = job.paper_sheets
+
+        self.order.quantity = 5000
+        self.order.save()
+        job = EngineeringJobService.get_job(Order.objects.get(pk=self.order.pk))
+
+        self.assertGreater(job.paper_sheets, sheets)
+        self.assertEqual(EngineeringJob.objects.count(), 1)
+
+    def test_job_recomputed_when_material_price_changes(self):
+        paper = Material.objects.create(name="Karton", category="qogoz", unit="kg", price_per_unit=9000)
+        cost = EngineeringJobService.get_job(self.order).cost_data['breakdown']['material_cost']
+
+        paper.price_per_unit = 12000
+        paper.save()
+        job = EngineeringJobService.get_job(Order.objects.get(pk=self.order.pk))
+
+        self.assertGreater(job.cost_data['breakdown']['material_cost'], cost)
+
+    def test_job_recomputed_when_machine_rate_changes(self):
+        printer = MachineSettings.objects.create(
+            machine_name="Heidelberg", machine_type="printer", hourly_rate=100000, setup_time_minutes=30
+        )
+        cost = EngineeringJobService.get_job(self.order).cost_data['breakdown']['machine_cost']
+
+        printer.hourly_rate = 150000
+        printer.save()
+        job = EngineeringJobService.get_job(Order.objects.get(pk=self.order.pk))
+
+        self.assertGreater(job.cost_data['breakdown']['machine_cost'], cost)
@@ -0,0 +1,1518 @@
+"""
+Production Scheduling Tests
+Tests for the in-memory finite-capacity scheduler and working-time calendar
+"""
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import (
+    Client, Order, ProductionStep, MachineSettings, MachineDowntime, Calendar, Shift, User, WorkerTimeLog,
+    EmployeeEfficiency, Material,
+    ProductTemplate, ProductTemplateRouting
+)
+from api.finite_scheduler import FiniteCapacityScheduler, IncrementalRescheduler, ShopSnapshot, ListScheduler
+from api.production_scheduler import ProductionScheduler
+from api.machine_availability import MachineAvailability, AvailabilityIndex
+from api.critical_path import CriticalPath
+from api.production_optimizer import ParallelFlowManager, BottleneckDetector
+from api.bottleneck_monitor import BottleneckMonitor
+from api.worker_assignment import WorkerAssignmentSolver, min_cost_assignment
+from api.workload_rebalancer import WorkloadRebalancer
+from api.efficiency_learner import EfficiencyLearner, net_hours
+from api import step_durations
+from api.maintenance_planner import MAINTENANCE_HOURS, MaintenancePlanner
+from api.work_calendar import WorkingTimeCalendar, WorkingDayIndex, add_working_hours, working_hours_between
+from api.capacity_timeline import CapacityTimeline
+from api.pricing_logic import CapacityAwareCalculator
+from api.setup_sequencer import SetupMatrix, SetupSequencer
+from api.tardiness_optimizer import TardinessOptimizer
+from api.delivery_forecast import BacklogDistribution, DurationModel, DeliveryForecast
+from api.capable_to_promise import PromiseState, CapableToPromise
+from api.shop_simulator import ShopModel, ShopSimulation, run_scenarios
+from api.scheduler_benchmark import SchedulerBenchmark, SyntheticShop, compare
+
+
+class SchedulingFixtureMixin:
+    def make_shop(self, orders=3, steps_per_order=3):
+        self.now = timezone.now().replace(microsecond=0)
+        self.client_obj = Client.objects.create(full_name="Schedule Client")
+        self.printer = MachineSettings.objects.create(
+            machine_name="Heidelberg", machine_type="printer", hourly_rate=100000
+        )
+        self.cutter = MachineSettings.objects.create(
+            machine_name="Polar", machine_type="cutter", hourly_rate=50000
+        )
+        machines = [self.printer, self.cutter, None]
+        names = ['printing', 'cutting', 'packaging']
+
+        self.orders = []
+        for i in range(orders):
+            order = Order.objects.create(
+                client=self.client_obj, order_number=f"SCH-{i}", quantity=1000,
+                deadline=self.now + timedelta(days=i + 1),
+            )
+            previous = None
+            for j in range(steps_per_order):
+                previous = ProductionStep.objects.create(
+                    order=order, step=names[j % 3], machine=machines[j % 3],
+                    depends_on_step=previous, priority=5,
+                )
+            self.orders.append(order)
+
+
+class FiniteCapacitySchedulerTestCase(SchedulingFixtureMixin, TestCase):
+    def assert_feasible(self):
+        steps = list(ProductionStep.objects.filter(status='pending'))
+        by_id = {s.id: s for s in steps}
+        for step in steps:
+            self.assertIsNotNone(step.estimated_start)
+            self.assertGreaterEqual(step.estimated_start, self.now)
+            if step.depends_on_step_id in by_id:
+                self.assertGreaterEqual(step.estimated_start, by_id[step.depends_on_step_id].estimated_end)
+        for machine in (self.printer, self.cutter):
+            queue = sorted((s for s in steps if s.machine_id == machine.id), key=lambda s: s.queue_position)
+            for earlier, later in zip(queue, queue[1:]):
+                self.assertLessEqual(earlier.estimated_end, later.estimated_start)
+
+    def test_replan_is_feasible_and_uses_one_update(self):
+        self.make_shop()
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = FiniteCapacityScheduler.replan(now=self.now)
+
+        self.assertEqual(result['scheduled'], 9)
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+        self.assert_feasible()
+
+    def test_query_count_does_not_grow_with_steps(self):
+        self.make_shop(orders=20)
+        with CaptureQueriesContext(connection) as ctx:
+            FiniteCapacityScheduler.replan(now=self.now)
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+
+    def test_full_replan_of_two_thousand_steps_is_fast(self):
+        from time import perf_counter
+        self.make_shop(orders=0)
+        orders = Order.objects.bulk_create([
+            Order(client=self.client_obj, order_number=f"BIG-{i}", quantity=1000,
+                  deadline=self.now + timedelta(days=i % 10 + 1))
+            for i in range(1000)
+        ])
+        printing = ProductionStep.objects.bulk_create([
+            ProductionStep(order=order, step='printing', machine=self.printer, priority=5) for order in orders
+        ])
+        ProductionStep.objects.bulk_create([
+            ProductionStep(order_id=step.order_id, step='cutting', machine=self.cutter, depends_on_step=step, priority=5)
+            for step in printing
+        ])
+
+        started = perf_counter()
+        result = FiniteCapacityScheduler.replan(now=self.now)
+        elapsed = perf_counter() - started
+
+        self.assertEqual(result['scheduled'], 2000)
+        self.assertLess(elapsed, 1.0)
+        self.assert_feasible()
+        # An unchanged plan is not written again
+        with CaptureQueriesContext(connection) as ctx:
+            FiniteCapacityScheduler.replan(now=self.now)
+        self.assertFalse([
+            q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "api_productionstep"')
+        ])
+
+    def test_earlier_deadline_goes_first(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        result = FiniteCapacityScheduler.replan(now=self.now)
+
+        first, second = (ProductionStep.objects.get(order=o) for o in self.orders)
+        self.assertEqual(first.queue_position, 1)
+        self.assertEqual(second.estimated_start, first.estimated_end)
+        self.assertEqual(result['late_steps'], 0)
+
+    def test_downtime_is_avoided(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        MachineDowntime.objects.create(
+            machine=self.printer, reason='maintenance',
+            started_at=self.now, ended_at=self.now + timedelta(hours=3),
+        )
+
+        FiniteCapacityScheduler.replan(now=self.now)
+
+        step = ProductionStep.objects.get(order=self.orders[0])
+        self.assertEqual(step.estimated_start, self.now + timedelta(hours=3))
+
+
+    def test_replan_endpoint_reads_dry_run_false_from_form_data(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='planner', password='x'))
+
+        response = api.post('/api/production/replan/', {'dry_run': 'true'})
+        self.assertTrue(response.data['dry_run'])
+        self.assertIsNone(ProductionStep.objects.get(order=self.orders[0]).estimated_start)
+
+        response = api.post('/api/production/replan/', {'dry_run': 'false'})
+        self.assertFalse(response.data['dry_run'])
+        self.assertIsNotNone(ProductionStep.objects.get(order=self.orders[0]).estimated_start)
+
+class IncrementalReschedulerTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_shop(orders=3)
+        FiniteCapacityScheduler.replan(now=self.now)
+
+    def plan(self):
+        return {s.id: (s.estimated_start, s.estimated_end) for s in ProductionStep.objects.all()}
+
+    def test_early_completion_pulls_successors_in(self):
+        first = ProductionStep.objects.get(order=self.orders[0], step='printing')
+        first.status = 'completed'
+        first.completed_at = self.now + timedelta(minutes=20)
+        first.save()
+
+        changed = IncrementalRescheduler(now=first.completed_at).reschedule([first.id])
+
+        follower = ProductionStep.objects.get(depends_on_step=first)
+        self.assertIn(follower.id, changed)
+        self.assertEqual(follower.estimated_start, self.now + timedelta(minutes=20))
+        # Next job on the printer moves up as well
+        next_print = ProductionStep.objects.get(order=self.orders[1], step='printing')
+        self.assertEqual(next_print.estimated_start, self.now + timedelta(minutes=20))
+
+    def test_unchanged_step_stops_propagation(self):
+        last = ProductionStep.objects.get(order=self.orders[2], step='packaging')
+        before = self.plan()
+
+        with self.assertNumQueries(3):  # the step, its extra dependencies and its predecessor
+            changed = IncrementalRescheduler(now=self.now).reschedule([last.id])
+
+        self.assertEqual(changed, [])
+        self.assertEqual(self.plan(), before)
+
+    def test_downtime_shifts_machine_queue(self):
+        downtime = MachineDowntime.objects.create(
+            machine=self.cutter, reason='breakdown',
+            started_at=self.now, ended_at=self.now + timedelta(hours=10),
+        )
+        changed = IncrementalRescheduler(now=self.now).reschedule(
+            ProductionStep.objects.filter(machine=self.cutter, queue_position=1).values_list('id', flat=True)
+        )
+
+        self.assertTrue(changed)
+        for step in ProductionStep.objects.filter(machine=self.cutter):
+            self.assertGreaterEqual(step.estimated_start, downtime.ended_at)
+        untouched = ProductionStep.objects.filter(machine=self.printer).values_list('id', flat=True)
+        self.assertFalse(set(changed) & set(untouched))
+
+
+    def test_batched_propagation_matches_on_demand(self):
+        MachineDowntime.objects.create(
+            machine=self.cutter, reason='breakdown',
+            started_at=self.now, ended_at=self.now + timedelta(hours=10),
+        )
+        folder = MachineSettings.objects.create(machine_name="Folder", machine_type="folder", hourly_rate=1)
+        elsewhere = ProductionStep.objects.create(
+            order=Order.objects.first(), step='folding', machine=folder, queue_position=1,
+            estimated_start=self.now, estimated_end=self.now + timedelta(hours=1),
+        )
+        seeds = list(ProductionStep.objects.filter(machine=self.cutter, queue_position=1).values_list('id', flat=True))
+        on_demand = IncrementalRescheduler(now=self.now)
+        on_demand.reschedule(seeds, commit=False)
+
+        with CaptureQueriesContext(connection) as ctx:
+            batched = IncrementalRescheduler(now=self.now).around(seeds)
+            batched.reschedule(seeds, commit=False)
+
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+        times = lambda r: {k: (v['estimated_start'], v['estimated_end']) for k, v in r.changed.items()}
+        self.assertTrue(batched.changed)
+        self.assertEqual(times(batched), times(on_demand))
+        # Machines the change never reaches are not loaded
+        self.assertNotIn(elsewhere.id, batched.rows)
+
+
+class WorkingTimeCalendarTestCase(TestCase):
+    MONDAY = date(2026, 11, 2)
+
+    def setUp(self):
+        WorkingTimeCalendar.invalidate()
+        WorkingDayIndex.invalidate()
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+    def test_default_day_skips_nights_and_weekends(self):
+        friday = self.MONDAY + timedelta(days=4)
+        result = add_working_hours(self.at(friday, 17), 2)
+        self.assertEqual(result, self.at(self.MONDAY + timedelta(days=7), 10))
+
+    def test_holiday_is_skipped(self):
+        Calendar.objects.create(date=self.MONDAY + timedelta(days=1), is_working_day=False)
+        result = add_working_hours(self.at(self.MONDAY, 17), 2)
+        self.assertEqual(result, self.at(self.MONDAY + timedelta(days=2), 10))
+        self.assertEqual(Calendar.add_working_days(self.MONDAY, 1), self.MONDAY + timedelta(days=2))
+
+    def test_overnight_shift_and_capacity_multiplier(self):
+        Shift.objects.create(name="Day", start_time=time(8), end_time=time(20), capacity_multiplier=Decimal('1.0'))
+        Shift.objects.create(name="Night", start_time=time(20), end_time=time(4), capacity_multiplier=Decimal('0.5'))
+
+        # 20:00-04:00 at half rate is 4 effective hours
+        start = self.at(self.MONDAY, 20)
+        self.assertAlmostEqual(working_hours_between(start, self.at(self.MONDAY + timedelta(days=1), 4)), 4.0)
+        self.assertEqual(add_working_hours(start, 2), self.at(self.MONDAY + timedelta(days=1), 0))
+        # Next working moment after the night shift is the day shift at 08:00
+        self.assertEqual(add_working_hours(start, 5), self.at(self.MONDAY + timedelta(days=1), 9))
+
+    def test_add_and_between_are_consistent(self):
+        start = self.at(self.MONDAY, 11, 30)
+        for hours in (0.5, 7, 9, 40, 123.25):
+            end = add_working_hours(start, hours)
+            self.assertAlmostEqual(working_hours_between(start, end), hours, places=6)
+
+    def test_warm_lookups_do_not_query(self):
+        start = self.at(self.MONDAY, 9)
+        add_working_hours(start, 1)
+        Calendar.add_working_days(self.MONDAY, 1)
+        with self.assertNumQueries(0):
+            for hours in range(1, 200):
+                add_working_hours(start, hours)
+            Calendar.add_working_days(self.MONDAY, 10)
+
+    def test_calendar_change_invalidates_index(self):
+        start = self.at(self.MONDAY, 17)
+        self.assertEqual(add_working_hours(start, 2), self.at(self.MONDAY + timedelta(days=1), 10))
+
+        Calendar.objects.create(date=self.MONDAY + timedelta(days=1), is_working_day=False)
+
+        self.assertEqual(add_working_hours(start, 2), self.at(self.MONDAY + timedelta(days=2), 10))
+
+
+class WorkingDayIndexTestCase(TestCase):
+    def setUp(self):
+        WorkingDayIndex.invalidate()
+
+    def brute_force_count(self, start, end):
+        holidays = set(Calendar.objects.filter(is_working_day=False).values_list('date', flat=True))
+        day, count = start, 0
+        while day <= end:
+            count += day.weekday() < 5 and day not in holidays
+            day += timedelta(days=1)
+        return count
+
+    def test_counts_and_offsets_across_years(self):
+        Calendar.objects.create(date=date(2026, 12, 31), is_working_day=False)
+        Calendar.objects.create(date=date(2027, 1, 1), is_working_day=False)
+
+        for start, end in ((date(2026, 12, 1), date(2027, 1, 31)), (date(2026, 3, 7), date(2026, 3, 8)),
+                           (date(2025, 6, 1), date(2027, 6, 1))):
+            self.assertEqual(Calendar.get_working_days_count(start, end), self.brute_force_count(start, end))
+        # Wed 30 Dec 2026 + 1 working day skips both holidays and the weekend
+        self.assertEqual(Calendar.add_working_days(date(2026, 12, 30), 1), date(2027, 1, 4))
+        self.assertEqual(Calendar.add_working_days(date(2026, 12, 30), 0), date(2026, 12, 30))
+        self.assertEqual(Calendar.add_working_days(date(2026, 1, 2), 260), date(2027, 1, 5))
+
+    def test_one_query_per_year_then_none(self):
+        with self.assertNumQueries(2):
+            Calendar.get_working_days_count(date(2026, 6, 1), date(2027, 6, 1))
+        with self.assertNumQueries(0):
+            for offset in range(0, 200, 7):
+                Calendar.add_working_days(date(2026, 1, 1) + timedelta(days=offset), offset)
+
+    def test_calendar_change_drops_its_year(self):
+        monday = date(2026, 11, 2)
+        self.assertEqual(Calendar.add_working_days(monday, 1), monday + timedelta(days=1))
+        Calendar.objects.create(date=monday + timedelta(days=1), is_working_day=False)
+        self.assertEqual(Calendar.add_working_days(monday, 1), monday + timedelta(days=2))
+
+
+class CapacityTimelineTestCase(SchedulingFixtureMixin, TestCase):
+    MONDAY = date(2026, 11, 2)
+
+    def setUp(self):
+        WorkingTimeCalendar.invalidate()
+        CapacityTimeline.invalidate()
+        Shift.objects.create(name="Day", start_time=time(8), end_time=time(17), capacity_multiplier=Decimal('1.0'))
+        self.make_shop(orders=2, steps_per_order=1)
+        first, second = (ProductionStep.objects.get(order=o) for o in self.orders)
+        ProductionStep.objects.filter(id=first.id).update(
+            estimated_start=self.at(0, 10), estimated_end=self.at(0, 14)
+        )
+        # Monday 16:00 -> Wednesday 10:00 is 1 + 9 + 2 working hours
+        ProductionStep.objects.filter(id=second.id).update(
+            estimated_start=self.at(0, 16), estimated_end=self.at(2, 10)
+        )
+        MachineDowntime.objects.create(
+            machine=self.cutter, reason='maintenance',
+            started_at=self.at(1, 6), ended_at=self.at(1, 12),
+        )
+
+    def at(self, day_offset, hour):
+        day = self.MONDAY + timedelta(days=day_offset)
+        return timezone.make_aware(datetime.combine(day, time(hour)))
+
+    def timeline(self):
+        return CapacityTimeline.get(covering=(self.MONDAY, self.MONDAY + timedelta(days=6)))
+
+    def test_load_and_downtime_are_spread_over_days(self):
+        days = self.timeline().daily(self.MONDAY, self.MONDAY + timedelta(days=2), self.printer.id)
+        self.assertEqual([d['scheduled_hours'] for d in days], [5.0, 9.0, 2.0])
+        self.assertEqual([d['free_hours'] for d in days], [4.0, 0.0, 7.0])
+
+        cutter = self.timeline().daily(self.MONDAY + timedelta(days=1), self.MONDAY + timedelta(days=1), self.cutter.id)
+        self.assertEqual(cutter[0]['available_hours'], 5.0)
+
+    def test_range_totals_and_weekend(self):
+        week = self.timeline().totals(self.MONDAY, self.MONDAY + timedelta(days=6), [self.printer.id])
+        self.assertEqual(week['available_hours'], 45.0)
+        self.assertEqual(week['scheduled_hours'], 16.0)
+        self.assertEqual(self.timeline().shop_hours(self.MONDAY + timedelta(days=5), self.MONDAY + timedelta(days=6)), 0.0)
+
+    def test_warm_queries_do_not_hit_the_database(self):
+        timeline = self.timeline()
+        with self.assertNumQueries(0):
+            for offset in range(7):
+                day = self.MONDAY + timedelta(days=offset)
+                self.timeline().totals(self.MONDAY, day)
+            timeline.machine_summary(self.MONDAY, self.MONDAY + timedelta(days=6))
+
+    def test_downtime_change_invalidates(self):
+        timeline = self.timeline()
+        MachineDowntime.objects.create(machine=self.printer, reason='breakdown', started_at=self.at(3, 8), ended_at=self.at(3, 17))
+        self.assertIsNot(self.timeline(), timeline)
+
+    def test_open_ended_downtime_is_capped_from_now_not_range_start(self):
+        now = timezone.now().replace(microsecond=0)
+        week_ago = now - timedelta(days=7)
+        MachineDowntime.objects.create(machine=self.printer, reason='breakdown', started_at=now - timedelta(hours=1))
+        MachineDowntime.objects.create(
+            machine=self.printer, reason='cleaning', started_at=now - timedelta(days=3),
+            ended_at=now - timedelta(days=3) + timedelta(hours=1),
+        )
+
+        windows = ShopSnapshot.downtime_windows([self.printer.id], now, since=week_ago)[self.printer.id]
+
+        self.assertEqual(windows, [
+            (now - timedelta(days=3), now - timedelta(days=3) + timedelta(hours=1)),
+            (now - timedelta(hours=1), now + timedelta(hours=2)),
+        ])
+        self.assertEqual(len(ShopSnapshot.downtime_windows([self.printer.id], now)[self.printer.id]), 1)
+
+    def test_capacity_status_counts_unscheduled_steps(self):
+        ProductionStep.objects.create(order=self.orders[0], step='printing', machine=self.printer, estimated_duration_minutes=600)
+
+        capacity = CapacityAwareCalculator.get_capacity_status()
+
+        self.assertEqual(capacity['unscheduled_hours'], 10.0)
+        self.assertEqual(len(capacity['machines']), 2)
+        self.assertGreater(capacity['capacity_percentage'], 0)
+
+
+class SetupSequencerTestCase(TestCase):
+    KRAFT = {'paper_type': 'Kraft', 'paper_density': 300, 'print_colors': '4+0'}
+    COATED = {'paper_type': 'Coated', 'paper_density': 250, 'print_colors': '1+0'}
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.client_obj = Client.objects.create(full_name="Setup Client")
+        self.press = MachineSettings.objects.create(
+            machine_name="Press", machine_type="printer", hourly_rate=100000, setup_time_minutes=30
+        )
+
+    def add_step(self, position, specs, priority=5, deadline_hours=240):
+        order = Order.objects.create(
+            client=self.client_obj, order_number=f"SET-{position}", quantity=1000,
+            deadline=self.now + timedelta(hours=deadline_hours), **specs
+        )
+        return ProductionStep.objects.create(
+            order=order, step='printing', machine=self.press, priority=priority,
+            queue_position=position, estimated_duration_minutes=90,
+        )
+
+    def queue(self):
+        return list(
+            ProductionStep.objects.filter(machine=self.press).order_by('queue_position').values_list('id', flat=True)
+        )
+
+    def test_optimize_endpoint_returns_the_new_queue(self):
+        steps = [self.add_step(i, self.KRAFT if i % 2 else self.COATED) for i in range(1, 5)]
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user(username='planner', password='x'))
+
+        response = api.post('/api/production/optimize/', {'machine_id': self.press.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['queue']], [str(step_id) for step_id in self.queue()])
+        self.assertEqual({row['id'] for row in response.data['queue']}, {str(step.id) for step in steps})
+
+    def test_optimizing_twice_keeps_run_times(self):
+        for i in range(1, 5):
+            self.add_step(i, self.KRAFT)
+
+        SetupSequencer(self.press, now=self.now).optimize()
+        first = dict(ProductionStep.objects.values_list('id', 'estimated_duration_minutes'))
+        report = SetupSequencer(self.press, now=self.now).optimize()
+
+        self.assertEqual(dict(ProductionStep.objects.values_list('id', 'estimated_duration_minutes')), first)
+        self.assertEqual(sorted(first.values()), [60, 60, 60, 90])  # one cold setup, then same family
+        self.assertEqual(report['setup_minutes_saved'], 0)
+        for step in ProductionStep.objects.all():
+            self.assertEqual(step.estimated_duration_minutes - step.setup_minutes, 60)
+
+    def test_matrix_is_sequence_dependent(self):
+        kraft = SetupMatrix.family_of('Kraft', 300, '4+0', None)
+        coated = SetupMatrix.family_of('coated ', 250, '1+0', 'none')
+        self.assertEqual(SetupMatrix.changeover(kraft, kraft), 0.0)
+        self.assertGreater(SetupMatrix.changeover(coated, kraft), SetupMatrix.changeover(kraft, coated))
+        self.assertEqual(SetupMatrix.changeover(None, kraft), 1.0)
+
+    def test_alternating_queue_is_grouped(self):
+        steps = [self.add_step(i, self.KRAFT if i % 2 else self.COATED) for i in range(1, 7)]
+
+        report = SetupSequencer(self.press, now=self.now).optimize()
+
+        self.assertEqual(report['changeovers_before'], 6)
+        self.assertEqual(report['changeovers_after'], 2)
+        self.assertGreater(report['setup_minutes_saved'], 0)
+        self.assertGreater(report['setup_waste_sheets_saved'], 0)
+        families = [ProductionStep.objects.get(id=i).order.paper_type for i in self.queue()]
+        self.assertEqual(len([1 for a, b in zip(families, families[1:]) if a != b]), 1)
+        # Times follow the new order with the reduced setups
+        ordered = ProductionStep.objects.filter(machine=self.press).order_by('queue_position')
+        self.assertEqual(ordered[1].estimated_start, ordered[0].estimated_end)
+        self.assertEqual(ordered[1].estimated_duration_minutes, 60)
+        self.assertEqual(len(steps), report['steps'])
+
+    def test_urgent_and_due_steps_are_not_delayed(self):
+        self.add_step(1, self.KRAFT)
+        tight = self.add_step(2, self.COATED, deadline_hours=3)
+        self.add_step(3, self.KRAFT)
+        urgent = self.add_step(4, self.KRAFT, priority=1)
+
+        SetupSequencer(self.press, now=self.now).optimize()
+
+        queue = self.queue()
+        self.assertEqual(queue[0], urgent.id)
+        tight.refresh_from_db()
+        self.assertLessEqual(tight.estimated_end, tight.order.deadline)
+
+    def test_followers_move_in_one_batch(self):
+        cutter = MachineSettings.objects.create(machine_name="Guillotine", machine_type="cutter", hourly_rate=1)
+        followers = []
+        for i in range(1, 9):
+            printing = self.add_step(i, self.KRAFT if i % 2 else self.COATED)
+            followers.append(ProductionStep.objects.create(
+                order=printing.order, step='cutting', machine=cutter, depends_on_step=printing,
+                queue_position=i, estimated_duration_minutes=30,
+                estimated_start=self.now, estimated_end=self.now + timedelta(minutes=30),
+            ))
+
+        with CaptureQueriesContext(connection) as ctx:
+            SetupSequencer(self.press, now=self.now).optimize()
+
+        # Independent of how many followers move: no per-step lookups, and
+        # only the machines the followers are on are loaded
+        self.assertLessEqual(len(ctx.captured_queries), 15)
+        for follower in ProductionStep.objects.filter(id__in=[f.id for f in followers]).select_related('depends_on_step'):
+            self.assertGreaterEqual(follower.estimated_start, follower.depends_on_step.estimated_end)
+
+    def test_budget_holds_when_every_move_breaks_the_due_dates(self):
+        from time import perf_counter
+        for i in range(1, 7):
+            self.add_step(i, self.KRAFT if i % 2 else self.COATED)
+        sequencer = SetupSequencer(self.press, now=self.now)
+        sequencer._load()
+        sequencer.evaluate = lambda sequence: (0.0, 1e9, 0)
+
+        _, iterations, timed_out = sequencer._local_search(list(range(6)), [(0, 6)], 0.0, perf_counter())
+
+        self.assertTrue(timed_out)
+        self.assertEqual(iterations, 0)
+
+    def test_dry_run_writes_nothing(self):
+        for i in range(1, 5):
+            self.add_step(i, self.KRAFT if i % 2 else self.COATED)
+        before = self.queue()
+
+        report = SetupSequencer(self.press, now=self.now).optimize(commit=False)
+
+        self.assertEqual(self.queue(), before)
+        self.assertNotEqual([str(i) for i in before], report['order'])
+
+
+class TardinessOptimizerTestCase(TestCase):
+    MONDAY = date(2026, 11, 2)
+
+    def setUp(self):
+        WorkingTimeCalendar.invalidate()
+        # Round-the-clock shift so the expected times stay simple
+        Shift.objects.create(name="Full", start_time=time(0), end_time=time(0), capacity_multiplier=Decimal('1.0'))
+        self.now = timezone.make_aware(datetime.combine(self.MONDAY, time(0)))
+        self.client_obj = Client.objects.create(full_name="Tardiness Client")
+        self.press_a = MachineSettings.objects.create(machine_name="Press A", machine_type="printer", hourly_rate=1)
+        self.press_b = MachineSettings.objects.create(machine_name="Press B", machine_type="printer", hourly_rate=1)
+        self.cutter = MachineSettings.objects.create(machine_name="Cutter", machine_type="cutter", hourly_rate=1)
+
+    def add_order(self, i, deadline_hours, cutting=False):
+        order = Order.objects.create(
+            client=self.client_obj, order_number=f"TRD-{i}", quantity=1000,
+            deadline=self.now + timedelta(hours=deadline_hours),
+        )
+        printing = ProductionStep.objects.create(
+            order=order, step='printing', machine=self.press_a,
+        )
+        if cutting:
+            ProductionStep.objects.create(
+                order=order, step='cutting', machine=self.cutter, depends_on_step=printing,
+            )
+        return order
+
+    def test_second_press_cuts_tardiness(self):
+        # One-hour jobs all due after an hour: 0 + 1 + 2 + 3 hours late on one press
+        for i in range(4):
+            self.add_order(i, deadline_hours=1)
+
+        report = TardinessOptimizer.run(now=self.now, time_limit_ms=500)
+
+        self.assertEqual(report['baseline_weighted_tardiness_hours'], 6.0)
+        self.assertLess(report['weighted_tardiness_hours'], report['baseline_weighted_tardiness_hours'])
+        self.assertGreater(report['improvement_hours'], 0)
+        self.assertGreaterEqual(report['reassigned_steps'], 1)
+        for press in (self.press_a, self.press_b):
+            queue = list(ProductionStep.objects.filter(machine=press).order_by('queue_position'))
+            for earlier, later in zip(queue, queue[1:]):
+                self.assertLessEqual(earlier.estimated_end, later.estimated_start)
+        self.assertTrue(ProductionStep.objects.filter(machine=self.press_b).exists())
+
+    def test_dependencies_downtime_and_calendar_are_respected(self):
+        Shift.objects.all().delete()
+        Shift.objects.create(name="Day", start_time=time(8), end_time=time(17), capacity_multiplier=Decimal('1.0'))
+        MachineDowntime.objects.create(
+            machine=self.cutter, reason='maintenance',
+            started_at=self.now + timedelta(hours=11), ended_at=self.now + timedelta(hours=13),
+        )
+        for i in range(3):
+            self.add_order(i, deadline_hours=12, cutting=True)
+
+        TardinessOptimizer.run(now=self.now, time_limit_ms=300)
+
+        for step in ProductionStep.objects.filter(step='cutting').select_related('depends_on_step'):
+            self.assertGreaterEqual(step.estimated_start, step.depends_on_step.estimated_end)
+            self.assertFalse(
+                step.estimated_start < self.now + timedelta(hours=13) and step.estimated_end > self.now + timedelta(hours=11)
+            )
+        for step in ProductionStep.objects.all():
+            self.assertGreaterEqual(timezone.localtime(step.estimated_start).hour, 8)
+
+    def test_dry_run_is_bounded_and_writes_nothing(self):
+        for i in range(6):
+            self.add_order(i, deadline_hours=1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            report = TardinessOptimizer.run(now=self.now, time_limit_ms=200, commit=False)
+
+        self.assertLess(report['elapsed_ms'], 1000)
+        self.assertEqual(report['overshoot_ms'], max(0.0, round(report['elapsed_ms'] - 200, 1)))
+        self.assertFalse(ProductionStep.objects.filter(estimated_start__isnull=False).exists())
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+
+
+class DeliveryForecastTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        WorkingTimeCalendar.invalidate()
+        DurationModel.invalidate()
+        BacklogDistribution.invalidate()
+
+    def test_history_fit_and_fallbacks(self):
+        rows = [('printing', 'press-1', 90, 60)] * 4 + [('printing', 'press-1', 60, 60)] * 4
+        rows += [('cutting', 'cutter-1', 30, 60)] * 2
+
+        model = DurationModel(rows)
+
+        mu, sigma = model.lookup('printing', 'press-1')
+        self.assertGreater(mu, 0)
+        self.assertGreater(sigma, 0)
+        # Too few cutting samples: falls back to everything pooled
+        self.assertEqual(model.lookup('cutting', 'cutter-1'), model.lookup(None, None))
+
+    def test_queue_pushes_percentiles_out(self):
+        self.make_shop(orders=10, steps_per_order=1)
+        ProductionStep.objects.update(estimated_duration_minutes=60)
+        model = DurationModel([])
+
+        forecast = DeliveryForecast(now=self.now, seed=1, model=model).predict([('printing', 2), ('packaging', 1)])
+
+        hours = forecast['working_hours']
+        self.assertLessEqual(hours['p50'], hours['p80'])
+        self.assertLessEqual(hours['p80'], hours['p95'])
+        # Ten queued hours on the only printer come first
+        self.assertGreater(hours['p50'], 11)
+        self.assertLessEqual(forecast['p50'], forecast['p95'])
+        self.assertGreater(forecast['p50'], self.now)
+
+    def test_quote_forecast_is_fast(self):
+        self.make_shop(orders=100, steps_per_order=3)
+        DurationModel.get()
+        DeliveryForecast(now=self.now).predict([('printing', 1)])  # warm calendar and backlog
+
+        with self.assertNumQueries(0):
+            forecast = DeliveryForecast(now=self.now).predict(
+                [('printing', 3), ('cutting', 1), ('gluing', 1), ('packaging', 0.5)]
+            )
+        self.assertLess(forecast['elapsed_ms'], 100)
+        self.assertEqual(forecast['samples'], 2000)
+
+    def test_backlog_keeps_mean_and_variance_of_its_steps(self):
+        import numpy as np
+        self.make_shop(orders=40, steps_per_order=1)
+        ProductionStep.objects.update(estimated_duration_minutes=90)
+        model = DurationModel([('printing', None, 80, 60)] * 5 + [('printing', None, 50, 60)] * 5)
+        mu, sigma = model.lookup('printing', self.printer.id)
+
+        distribution = BacklogDistribution.build(now=self.now, model=model)
+        sampled = distribution.sample(np.random.default_rng(2), 200000)[:, distribution.column[self.printer.id]]
+
+        step_mean = 1.5 * np.exp(mu + sigma ** 2 / 2)
+        step_variance = step_mean ** 2 * np.expm1(sigma ** 2)
+        self.assertAlmostEqual(sampled.mean() / (40 * step_mean), 1, places=2)
+        self.assertAlmostEqual(sampled.var() / (40 * step_variance), 1, delta=0.05)
+        self.assertEqual(distribution.sample(np.random.default_rng(2), 10)[:, distribution.column[self.cutter.id]].max(), 0)
+
+    def test_written_plan_drops_backlog(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        backlog = BacklogDistribution.get()
+        self.assertIs(BacklogDistribution.get(), backlog)
+
+        FiniteCapacityScheduler.replan(now=self.now)
+        self.assertIsNot(BacklogDistribution.get(), backlog)
+
+
+class CapableToPromiseTestCase(SchedulingFixtureMixin, TestCase):
+    QUOTE = [('printing', 2), ('cutting', 1), ('packaging', 0.5)]
+
+    def setUp(self):
+        WorkingTimeCalendar.invalidate()
+        DurationModel.invalidate()
+        PromiseState.invalidate()
+
+    def test_busy_printer_pushes_completion(self):
+        self.make_shop(orders=10, steps_per_order=1)
+        ProductionStep.objects.update(estimated_duration_minutes=120)
+        FiniteCapacityScheduler.replan(now=self.now)
+        busy_until = max(s.estimated_end for s in ProductionStep.objects.filter(machine=self.printer))
+
+        promise = CapableToPromise(now=self.now).promise(self.QUOTE)
+
+        printing, cutting, packaging = promise['steps']
+        self.assertEqual(printing['machine_id'], str(self.printer.id))
+        self.assertGreaterEqual(printing['start'], busy_until)
+        self.assertEqual(cutting['machine_id'], str(self.cutter.id))
+        self.assertIsNone(packaging['machine_id'])
+        for earlier, later in zip(promise['steps'], promise['steps'][1:]):
+            self.assertLessEqual(earlier['end'], later['start'])
+        self.assertEqual(promise['earliest_completion'], packaging['end'])
+        self.assertGreater(promise['earliest_completion'], add_working_hours(self.now, 3.5))
+
+        band = promise['confidence_band']
+        self.assertLessEqual(band['p10'], band['p50'])
+        self.assertLessEqual(band['p50'], band['p90'])
+
+    def test_material_shortage_delays_start(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        paper = Material.objects.create(name="Karton", category='qogoz')
+        Material.objects.filter(pk=paper.pk).update(usable_stock=10)
+
+        enough = CapableToPromise(now=self.now).promise(self.QUOTE, {'paper_kg': 5, 'ink_kg': 1})
+        short = CapableToPromise(now=self.now).promise(self.QUOTE, {'paper_kg': 50})
+
+        # Ink is not stocked at all, so it is not tracked
+        self.assertEqual(enough['material_shortages'], {})
+        self.assertEqual(short['material_shortages'], {'qogoz': 40.0})
+        self.assertGreater(short['material_ready'], self.now)
+        self.assertGreaterEqual(short['steps'][0]['start'], short['material_ready'])
+        self.assertGreater(short['earliest_completion'], enough['earliest_completion'])
+
+    def test_warm_promise_is_fast_and_read_only(self):
+        self.make_shop(orders=100, steps_per_order=3)
+        FiniteCapacityScheduler.replan(now=self.now)
+        CapableToPromise(now=self.now).promise(self.QUOTE)  # warm state
+
+        with self.assertNumQueries(0):
+            promise = CapableToPromise(now=self.now).promise(
+                [('printing', 3), ('lamination', 1), ('cutting', 1), ('gluing', 1), ('packaging', 0.5)]
+            )
+        self.assertLess(promise['elapsed_ms'], 50)
+
+    def test_written_plan_drops_state(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        state = PromiseState.get()
+        self.assertIs(PromiseState.get(), state)
+
+        FiniteCapacityScheduler.replan(now=self.now)
+        self.assertIsNot(PromiseState.get(), state)
+
+
+class ShopSimulatorTestCase(TestCase):
+    DAY_SHIFT = [(time(8), time(17), 1.0)]
+
+    def make_model(self, horizon_days=120, orders_per_day=3.0):
+        start = timezone.make_aware(datetime.combine(date(2026, 11, 2), time(0)))
+        machines = [('Press', 'printer'), ('Polar', 'cutter'), ('Folder', 'folder')]
+        return ShopModel(
+            start, horizon_days, machines, {}, {}, self.DAY_SHIFT,
+            None, orders_per_day, [(None, 5000)], timezone.get_default_timezone(),
+        )
+
+    def test_second_shift_shortens_lead_time(self):
+        model = self.make_model()
+        baseline, two_shifts = run_scenarios(model, [
+            {'name': 'baseline'},
+            {'name': 'second shift', 'shifts': self.DAY_SHIFT + [(time(17), time(2), 1.0)]},
+        ], processes=1)
+
+        self.assertEqual(baseline['orders_arrived'], two_shifts['orders_arrived'])
+        self.assertLess(two_shifts['lead_time_days']['p50'], baseline['lead_time_days']['p50'])
+        self.assertLess(two_shifts['average_wip'], baseline['average_wip'])
+        self.assertLess(two_shifts['utilization_by_type']['printer'], baseline['utilization_by_type']['printer'])
+        # Months of simulated time in well under a few seconds
+        self.assertLess(baseline['elapsed_ms'], 3000)
+
+    def test_extra_machine_splits_the_load(self):
+        model = self.make_model(orders_per_day=4.5)
+        baseline = ShopSimulation(model, {}, seed=3).run()
+        extra = ShopSimulation(model, {'name': 'extra press', 'extra_machines': {'printer': 1}}, seed=3).run()
+
+        self.assertEqual(len(extra['machines']), 4)
+        self.assertGreater(baseline['utilization_by_type']['printer'], 0.9)
+        self.assertLess(extra['utilization_by_type']['printer'], baseline['utilization_by_type']['printer'] * 0.85)
+        self.assertGreater(extra['orders_completed'], baseline['orders_completed'])
+
+    def test_parallel_runs_match_serial(self):
+        model = self.make_model(horizon_days=30)
+        scenarios = [{'name': 'a'}, {'name': 'b', 'arrival_rate_multiplier': 1.5}]
+
+        serial = run_scenarios(model, scenarios, seed=7, processes=1)
+        parallel = run_scenarios(model, scenarios, seed=7, processes=2)
+
+        for one, other in zip(serial, parallel):
+            one.pop('elapsed_ms'), other.pop('elapsed_ms')
+            self.assertEqual(one, other)
+
+    def test_model_loads_routing_and_replays_history(self):
+        WorkingTimeCalendar.invalidate()
+        MachineSettings.objects.create(machine_name="Press", machine_type="printer", hourly_rate=1)
+        template = ProductTemplate.objects.create(name="Box", category=ProductTemplate.CATEGORY_CHOICES[0][0])
+        ProductTemplateRouting.objects.create(
+            template=template, sequence=1, step_name='printing',
+            required_machine_type='Printer', estimated_time_per_unit=Decimal('0.05'), setup_time_minutes=20,
+        )
+        client = Client.objects.create(full_name="Sim Client")
+        for i in range(5):
+            Order.objects.create(client=client, order_number=f"SIM-{i}", quantity=500, product_template=template)
+        Order.objects.update(created_at=timezone.now() - timedelta(days=25))
+
+        model = ShopModel.load(horizon_days=30, arrivals='history')
+        result = ShopSimulation(model).run()
+
+        self.assertEqual(model.routings[str(template.id)], [('printing', 'printer', 0.05, 20)])
+        self.assertEqual(result['orders_arrived'], 5)
+        self.assertEqual(result['orders_completed'], 5)
+
+
+class MachineQueueBoardTestCase(SchedulingFixtureMixin, TestCase):
+    def test_board_is_constant_query(self):
+        self.make_shop(orders=2, steps_per_order=3)
+        with self.assertNumQueries(3):
+            ProductionScheduler.get_all_machine_queues()
+
+        for i in range(5):
+            machine = MachineSettings.objects.create(machine_name=f"Extra {i}", machine_type="printer", hourly_rate=1)
+            ProductionStep.objects.create(order=self.orders[0], step='printing', machine=machine)
+        with self.assertNumQueries(3):
+            board = ProductionScheduler.get_all_machine_queues()
+        self.assertEqual(len(board), 7)
+
+    def test_board_groups_counts_and_readiness(self):
+        self.make_shop(orders=2, steps_per_order=3)
+        first = ProductionStep.objects.get(order=self.orders[0], step='printing')
+        first.status = 'completed'
+        first.save()
+        ProductionStep.objects.filter(order=self.orders[1], step='printing').update(status='in_progress')
+
+        board = ProductionScheduler.get_all_machine_queues()
+        printer = board[str(self.printer.id)]
+        cutter = board[str(self.cutter.id)]
+
+        self.assertEqual(len(printer['queue']), 1)
+        self.assertEqual((printer['total_pending'], printer['total_in_progress']), (0, 1))
+        self.assertEqual((cutter['total_pending'], len(cutter['queue'])), (2, 2))
+        ready = {entry['order_number']: entry['is_ready'] for entry in cutter['queue']}
+        self.assertEqual(ready, {'SCH-0': True, 'SCH-1': False})
+        self.assertEqual(cutter['queue'], ProductionScheduler.get_machine_queue(self.cutter))
+
+
+class MachineAvailabilityTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.t0 = timezone.now().replace(microsecond=0)
+
+    def at(self, hours):
+        return self.t0 + timedelta(hours=hours)
+
+    def test_earliest_slot_backfills_gaps(self):
+        busy = MachineAvailability([(self.at(0), self.at(1)), (self.at(2), self.at(3)), (self.at(6), self.at(8))])
+
+        self.assertEqual(busy.earliest_slot(self.at(0), timedelta(hours=1)), self.at(1))
+        self.assertEqual(busy.earliest_slot(self.at(0), timedelta(hours=2)), self.at(3))
+        self.assertEqual(busy.earliest_slot(self.at(0), timedelta(hours=4)), self.at(8))
+        self.assertEqual(busy.earliest_slot(self.at(3.5), timedelta(hours=2)), self.at(3.5))
+        self.assertEqual(busy.earliest_slot(self.at(-2), timedelta(hours=1)), self.at(-2))
+        self.assertEqual(busy.free_at(self.at(6.5)), self.at(8))
+
+    def test_book_merges_and_release_splits(self):
+        busy = MachineAvailability()
+        busy.book(self.at(0), self.at(1))
+        busy.book(self.at(3), self.at(4))
+        busy.book(self.at(1), self.at(2))
+        self.assertEqual(busy.intervals(), [(self.at(0), self.at(2)), (self.at(3), self.at(4))])
+        self.assertEqual(busy.earliest_slot(self.at(0), timedelta(minutes=90)), self.at(4))
+
+        busy.release(self.at(0.5), self.at(1.5))
+        self.assertEqual(len(busy), 3)
+        self.assertEqual(busy.earliest_slot(self.at(0), timedelta(hours=1)), self.at(0.5))
+        self.assertFalse(busy.is_free(self.at(1), self.at(2)))
+
+    def test_matches_linear_scan(self):
+        import random
+        rng = random.Random(3)
+        busy = MachineAvailability()
+        intervals = []
+        for _ in range(300):
+            start = rng.uniform(0, 500)
+            end = start + rng.uniform(0.1, 3)
+            busy.book(self.at(start), self.at(end))
+            intervals.append((start, end))
+        intervals.sort()
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        for _ in range(200):
+            after, hours = rng.uniform(-5, 520), rng.uniform(0, 4)
+            expected = after
+            for start, end in merged:
+                if end <= expected:
+                    continue
+                if start - expected >= hours:
+                    break
+                expected = end
+            slot = busy.earliest_slot(self.at(after), timedelta(hours=hours))
+            self.assertAlmostEqual((slot - self.t0).total_seconds() / 3600, expected, places=4)
+
+    def test_latest_slot_matches_linear_scan(self):
+        import random
+        rng = random.Random(5)
+        busy = MachineAvailability()
+        for _ in range(200):
+            start = rng.uniform(0, 400)
+            busy.book(self.at(start), self.at(start + rng.uniform(0.1, 3)))
+        merged = [((s - self.t0).total_seconds() / 3600, (e - self.t0).total_seconds() / 3600) for s, e in busy.intervals()]
+        bounds = [float('-inf')] + [end for _, end in merged], [start for start, _ in merged] + [float('inf')]
+        for _ in range(300):
+            after = rng.uniform(-10, 410)
+            before = after + rng.uniform(0, 60)
+            hours = rng.uniform(0, 5)
+            expected = None
+            for lo, hi in zip(*bounds):
+                lo, hi = max(lo, after), min(hi, before)
+                if hi - lo >= hours:
+                    expected = hi - hours
+            slot = busy.latest_slot(self.at(after), self.at(before), timedelta(hours=hours))
+            if expected is None:
+                self.assertIsNone(slot)
+            else:
+                self.assertAlmostEqual((slot - self.t0).total_seconds() / 3600, expected, places=4)
+
+    def test_copy_does_not_see_later_bookings(self):
+        busy = MachineAvailability([(self.at(0), self.at(1))])
+        tentative = busy.copy()
+        tentative.book(self.at(1), self.at(3))
+        busy.release(self.at(0), self.at(1))
+
+        self.assertEqual(tentative.intervals(), [(self.at(0), self.at(3))])
+        self.assertEqual(busy.intervals(), [])
+        self.assertEqual(tentative.last_end(), self.at(3))
+        self.assertIsNone(busy.last_end())
+
+    def test_scheduler_backfills_gap_before_later_job(self):
+        self.make_shop(orders=1, steps_per_order=2)
+        ProductionStep.objects.filter(order=self.orders[0]).update(priority=1)
+        ProductionStep.objects.filter(order=self.orders[0], step='printing').update(machine=self.cutter)
+        ProductionStep.objects.filter(order=self.orders[0], step='cutting').update(machine=self.printer)
+        late_order = Order.objects.create(client=self.client_obj, order_number="SCH-LATE", quantity=1000)
+        filler = ProductionStep.objects.create(order=late_order, step='printing', machine=self.printer, priority=9)
+
+        snapshot = ShopSnapshot.load(self.now)
+        backfilled = ListScheduler(snapshot).run()
+        self.assertEqual(backfilled[filler.id].start, self.now)
+
+        appended = ListScheduler(ShopSnapshot.load(self.now), backfill=False).run()
+        self.assertEqual(appended[filler.id].start, self.now + timedelta(hours=2))
+
+    def test_machine_available_time_reuses_gap(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        ProductionStep.objects.filter(order=self.orders[0]).update(
+            estimated_start=self.now, estimated_end=self.now + timedelta(hours=1),
+        )
+        ProductionStep.objects.filter(order=self.orders[1]).update(
+            estimated_start=self.now + timedelta(hours=3), estimated_end=self.now + timedelta(hours=4),
+        )
+
+        with self.assertNumQueries(2):
+            slot = ProductionScheduler.get_machine_available_time(self.printer, duration_minutes=90, after=self.now)
+        self.assertEqual(slot, self.now + timedelta(hours=1))
+        self.assertEqual(
+            ProductionScheduler.get_machine_available_time(self.printer, duration_minutes=150, after=self.now),
+            self.now + timedelta(hours=4),
+        )
+
+
+class CriticalPathTestCase(SchedulingFixtureMixin, TestCase):
+    def test_diamond_slack_waves_and_critical_path(self):
+        graph = CriticalPath([
+            ('A', 2, []), ('B', 3, ['A']), ('C', 1, ['A']), ('D', 1, ['B', 'C']),
+        ])
+        at = {step_id: i for i, step_id in enumerate(graph.ids)}
+
+        self.assertEqual(graph.makespan, 6)
+        self.assertEqual([graph.earliest_start[at[s]] for s in 'ABCD'], [0, 2, 2, 5])
+        self.assertEqual(graph.slack[at['C']], 2)
+        self.assertEqual(graph.latest_start[at['C']], 4)
+        self.assertEqual(graph.critical_path(), ['A', 'B', 'D'])
+        self.assertEqual([[graph.ids[i] for i in wave] for wave in graph.waves()], [['A'], ['B', 'C'], ['D']])
+        self.assertEqual(graph.tail[at['A']], 6)
+
+    def test_cycle_is_broken(self):
+        graph = CriticalPath([('A', 1, ['B']), ('B', 1, ['A']), ('C', 1, [])])
+        self.assertTrue(graph.has_cycle)
+        self.assertEqual(len(graph.order), 3)
+
+    def make_dag_order(self):
+        """printing -> (lamination on the lid || cutting of the insert) -> gluing"""
+        self.make_shop(orders=1, steps_per_order=1)
+        order = self.orders[0]
+        printing = ProductionStep.objects.get(order=order)
+        ProductionStep.objects.filter(id=printing.id).update(estimated_duration_minutes=60)
+        lamination = ProductionStep.objects.create(
+            order=order, step='lamination', depends_on_step=printing, estimated_duration_minutes=180,
+        )
+        cutting = ProductionStep.objects.create(
+            order=order, step='cutting', machine=self.cutter, depends_on_step=printing, estimated_duration_minutes=60,
+        )
+        gluing = ProductionStep.objects.create(
+            order=order, step='gluing', depends_on_step=lamination, estimated_duration_minutes=60,
+        )
+        gluing.extra_dependencies.add(cutting)
+        return printing, lamination, cutting, gluing
+
+    def test_parallel_flow_plan(self):
+        printing, lamination, cutting, gluing = self.make_dag_order()
+
+        with self.assertNumQueries(2):
+            plan = ParallelFlowManager.suggest_parallel_steps(self.orders[0])
+
+        self.assertEqual(plan['makespan_hours'], 5)
+        self.assertEqual(plan['sequential_hours'], 6)
+        self.assertEqual([wave['can_run_parallel'] for wave in plan['waves']], [False, True, False])
+        self.assertEqual(plan['critical_path'], [str(printing.id), str(lamination.id), str(gluing.id)])
+        slack = {row['id']: row['slack_hours'] for row in plan['steps']}
+        self.assertEqual(slack[str(cutting.id)], 2)
+        self.assertFalse(gluing.is_ready_to_start)
+
+    def test_scheduler_waits_for_every_predecessor(self):
+        printing, lamination, cutting, gluing = self.make_dag_order()
+        ProductionStep.objects.filter(id=lamination.id).update(machine=self.printer)
+        ProductionStep.objects.filter(id=gluing.id).update(machine=self.cutter)
+
+        plan = FiniteCapacityScheduler.replan(now=self.now, commit=False)['plan']
+
+        self.assertEqual(plan[cutting.id].start, plan[printing.id].end)
+        self.assertEqual(plan[gluing.id].start, max(plan[lamination.id].end, plan[cutting.id].end))
+        self.assertEqual(set(plan[gluing.id].predecessors), {lamination.id, cutting.id})
+
+    def test_incremental_rescheduler_follows_extra_dependencies(self):
+        printing, lamination, cutting, gluing = self.make_dag_order()
+        FiniteCapacityScheduler.replan(now=self.now)
+        ProductionStep.objects.filter(id=cutting.id).update(estimated_duration_minutes=600)
+
+        changed = IncrementalRescheduler(now=self.now).reschedule([cutting.id])
+
+        cutting.refresh_from_db()
+        gluing.refresh_from_db()
+        self.assertIn(gluing.id, changed)
+        self.assertEqual(gluing.estimated_start, cutting.estimated_end)
+
+    def test_benchmark_orders_with_twenty_plus_steps(self):
+        import random
+        from time import perf_counter
+        rng = random.Random(11)
+        nodes = []
+        for order in range(300):
+            ids = [(order, k) for k in range(24)]
+            for k, step_id in enumerate(ids):
+                preds = rng.sample(ids[max(0, k - 4):k], min(k, rng.randint(1, 3))) if k else []
+                nodes.append((step_id, rng.uniform(0.2, 4), preds))
+
+        started = perf_counter()
+        graph = CriticalPath(nodes)
+        elapsed = perf_counter() - started
+
+        self.assertLess(elapsed, 1.0)
+        at = {step_id: i for i, step_id in enumerate(graph.ids)}
+        for i, (_, duration, preds) in enumerate(nodes):
+            for p in preds:
+                self.assertGreaterEqual(graph.earliest_start[i] + 1e-9, graph.earliest_finish[at[p]])
+            self.assertGreaterEqual(graph.slack[i], -1e-9)
+        self.assertEqual(len(graph.waves()[0]), 300)
+
+
+class BottleneckMonitorTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        BottleneckMonitor.invalidate()
+        self.addCleanup(BottleneckMonitor.invalidate)
+
+    def add_finished(self, order, hours_ago_start, hours_ago_end):
+        step = ProductionStep.objects.create(order=order, step='printing', machine=self.printer)
+        ProductionStep.objects.filter(id=step.id).update(
+            status='completed', started_at=self.now - timedelta(hours=hours_ago_start),
+            completed_at=self.now - timedelta(hours=hours_ago_end),
+            created_at=self.now - timedelta(hours=hours_ago_start + 2),
+        )
+
+    def test_seeded_statistics_flag_overloaded_machine(self):
+        self.make_shop(orders=6, steps_per_order=1)
+        self.add_finished(self.orders[0], 22, 12)
+        self.add_finished(self.orders[0], 12, 2)
+
+        monitor = BottleneckMonitor.build(self.now)
+        with self.assertNumQueries(0):
+            bottlenecks = monitor.detect(self.now)
+
+        printer = next(b for b in bottlenecks if b['type'] == 'machine')
+        self.assertEqual(printer['key'], str(self.printer.id))
+        self.assertEqual(printer['queue_length'], 6)
+        self.assertAlmostEqual(printer['utilization_percent'], 83.3, places=1)
+        self.assertEqual(printer['throughput_per_hour'], round(2 / 24, 2))
+        self.assertEqual(printer['avg_wait_time'], 2.0)
+        self.assertGreater(printer['severity'], 0.6)
+        for key in ('stage', 'avg_wait_time', 'workers_assigned', 'recommendation'):
+            self.assertIn(key, printer)
+
+    def test_status_changes_update_counters_incrementally(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        BottleneckMonitor.get()
+        step = ProductionStep.objects.get(order=self.orders[0])
+
+        step.status = 'in_progress'
+        step.started_at = timezone.now()
+        with self.assertNumQueries(1):  # the UPDATE itself
+            step.save()
+        stats = BottleneckMonitor.get().stats[('machine', self.printer.id)]
+        self.assertEqual((stats.queue, stats.in_progress, stats.running), (1, 1, 1))
+        self.assertEqual(stats.wait_count, 1)
+
+        worker = User.objects.create_user(username='operator1', password='x')
+        WorkerTimeLog.objects.create(production_step=step, worker=worker, action='pause')
+        self.assertEqual(stats.running, 0)
+        WorkerTimeLog.objects.create(production_step=step, worker=worker, action='resume')
+        self.assertEqual(stats.running, 1)
+
+        step.status = 'completed'
+        step.completed_at = timezone.now()
+        step.save()
+        self.assertEqual((stats.queue, stats.in_progress, stats.running), (1, 0, 0))
+        self.assertEqual(stats.metrics(timezone.now().timestamp())['throughput_per_hour'], round(1 / 24, 2))
+
+        step.delete()
+        ProductionStep.objects.get(order=self.orders[1]).delete()
+        self.assertEqual(stats.queue, 0)
+
+    def test_detector_uses_monitor(self):
+        self.make_shop(orders=6, steps_per_order=1)
+        self.add_finished(self.orders[0], 23, 1)
+        bottlenecks = BottleneckDetector.detect_bottlenecks()
+        self.assertTrue(any(b['key'] == str(self.printer.id) for b in bottlenecks))
+
+
+class WorkerAssignmentTestCase(SchedulingFixtureMixin, TestCase):
+    def test_hungarian_matches_brute_force(self):
+        import itertools
+        import numpy as np
+        rng = np.random.default_rng(5)
+        # Small integer costs give ties and rows competing for one cheapest column
+        draws = (lambda n, m: rng.uniform(0, 10, (n, m)), lambda n, m: rng.integers(0, 4, (n, m)).astype(float))
+        for (n, m), draw in itertools.product(((3, 3), (4, 6), (5, 5), (3, 7)), draws):
+            cost = draw(n, m)
+            assignment = min_cost_assignment(cost)
+            self.assertEqual(len(set(assignment)), n)
+            best = min(sum(cost[i, j] for i, j in enumerate(cols)) for cols in itertools.permutations(range(m), n))
+            self.assertAlmostEqual(sum(cost[i, j] for i, j in enumerate(assignment)), best)
+
+    def make_workers(self):
+        self.fast = User.objects.create_user(username='fast', password='x', role='printer')
+        self.slow = User.objects.create_user(username='slow', password='x', role='printer')
+        for worker, rate in ((self.fast, 1000), (self.slow, 400)):
+            EmployeeEfficiency.objects.create(
+                employee=worker, production_stage='printing', units_per_hour=rate,
+                hourly_labor_cost=10000, effective_from=date(2024, 1, 1),
+            )
+
+    def test_batch_assignment_uses_rates_and_load(self):
+        self.make_shop(orders=2, steps_per_order=2)
+        self.make_workers()
+        User.objects.create_user(username='cutter1', password='x', role='cutter')
+
+        WorkerAssignmentSolver.run(now=self.now, commit=False)  # warm the calendar
+        with self.assertNumQueries(5):  # steps, workers, rates, load, UPDATE
+            report = WorkerAssignmentSolver.run(now=self.now)
+
+        # Only the printing steps are ready; both go to the fast printer (1h + 2h < 1h + 2.5h)
+        self.assertEqual(report['assigned'], 2)
+        self.assertEqual(report['assigned_hours_by_worker'], {'fast': 2.0})
+        self.assertEqual(ProductionStep.objects.filter(assigned_to=self.fast).count(), 2)
+        self.assertFalse(ProductionStep.objects.filter(step='cutting', assigned_to__isnull=False).exists())
+
+    def test_busy_worker_gets_less(self):
+        self.make_shop(orders=2, steps_per_order=1)
+        self.make_workers()
+        backlog = Order.objects.create(client=self.client_obj, order_number="SCH-BUSY", quantity=1000)
+        ProductionStep.objects.create(
+            order=backlog, step='printing', status='in_progress', assigned_to=self.fast, estimated_duration_minutes=180,
+        )
+
+        report = WorkerAssignmentSolver.run(now=self.now, commit=False)
+        self.assertEqual(sorted(report['assigned_hours_by_worker']), ['fast', 'slow'])
+
+    def test_smart_assign_picks_fastest_worker(self):
+        from api.production_optimizer import SmartAssignmentEngine
+        self.make_shop(orders=1, steps_per_order=1)
+        self.make_workers()
+        step = ProductionStep.objects.get(order=self.orders[0])
+        self.assertEqual(SmartAssignmentEngine.assign_optimal_worker(step), self.fast)
+
+    def test_hundreds_of_steps_well_under_a_second(self):
+        import numpy as np
+        from time import perf_counter
+        rng = np.random.default_rng(1)
+        solver = WorkerAssignmentSolver()
+        solver.steps = [{'id': i} for i in range(300)]
+        solver.workers = [{'id': w, 'username': f'w{w}'} for w in range(30)]
+        solver.load_hours = {w: float(rng.uniform(0, 8)) for w in range(30)}
+        solver.available_hours = 16.0
+        hours = rng.uniform(0.5, 4, (300, 30))
+        hours[rng.uniform(size=hours.shape) < 0.5] = np.inf
+
+        started = perf_counter()
+        cost, slots = solver.cost_matrix(hours)
+        assignment = min_cost_assignment(cost)
+        elapsed = perf_counter() - started
+
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(len(set(assignment)), 300)
+
+
+class WorkloadRebalancerTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        self.busy = User.objects.create_user(username='busy', password='x', role='printer')
+        self.idle = User.objects.create_user(username='idle', password='x', role='printer')
+        User.objects.create_user(username='cutter1', password='x', role='cutter')
+        for i, minutes in enumerate((240, 120, 120, 60)):
+            order = Order.objects.create(client=self.client_obj, order_number=f"BAL-{i}", quantity=100)
+            ProductionStep.objects.create(
+                order=order, step='printing', machine=self.printer, assigned_to=self.busy,
+                estimated_duration_minutes=minutes,
+            )
+
+    def test_fewest_moves_flatten_load(self):
+        WorkloadRebalancer(now=self.now).load().run()  # warm the calendar
+        with self.assertNumQueries(5):  # workers, machines, two grouped loads, movable steps
+            result = WorkloadRebalancer(now=self.now).load().run()
+
+        moves = [m for m in result['rebalance_suggestions'] if m['type'] == 'worker']
+        # 9h vs 0h: one 4h move leaves 5h/4h, nothing smaller helps
+        self.assertEqual(len(moves), 1)
+        self.assertEqual((moves[0]['from'], moves[0]['to'], moves[0]['hours']), ('busy', 'idle', 4.0))
+        workers = {w['name']: w for w in result['workload_map']['workers']}
+        self.assertEqual(workers['busy']['load_hours_before'], 9.0)
+        self.assertEqual(workers['busy']['load_hours_after'], 5.0)
+        self.assertLess(workers['busy']['projected_finish_after'], workers['busy']['projected_finish_before'])
+        self.assertEqual(result['imbalance']['worker:printer'], {'spread_hours_before': 9.0, 'spread_hours_after': 1.0})
+
+    def test_machine_pool_and_balanced_pools(self):
+        second = MachineSettings.objects.create(machine_name="KBA", machine_type="printer", hourly_rate=1)
+        result = WorkloadRebalancer(now=self.now).load().run()
+
+        machine_moves = [m for m in result['rebalance_suggestions'] if m['type'] == 'machine']
+        self.assertTrue(machine_moves)
+        self.assertTrue(all(m['to_id'] == str(second.id) for m in machine_moves))
+        self.assertFalse([m for m in result['rebalance_suggestions'] if m['pool'] == 'cutter'])
+
+
+class EfficiencyLearnerTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        self.worker = User.objects.create_user(username='printer1', password='x', role='printer')
+        self.today = timezone.localdate()
+        EmployeeEfficiency.objects.create(
+            employee=self.worker, production_stage='printing', units_per_hour=400,
+            hourly_labor_cost=20000, effective_from=self.today - timedelta(days=30),
+        )
+        self.steps = 0
+
+    def finish_step(self, quantity, events, offset_hours=0):
+        """events: [(action, hours after start)]"""
+        self.steps += 1
+        order = Order.objects.create(client=self.client_obj, order_number=f"EFF-{self.steps}", quantity=quantity)
+        step = ProductionStep.objects.create(order=order, step='printing', status='completed', assigned_to=self.worker)
+        start = self.now - timedelta(days=2) + timedelta(hours=offset_hours)
+        for action, hours in events:
+            log = WorkerTimeLog.objects.create(production_step=step, worker=self.worker, action=action)
+            WorkerTimeLog.objects.filter(pk=log.pk).update(timestamp=start + timedelta(hours=hours))
+        return step
+
+    def test_net_time_excludes_pauses(self):
+        events = [('start', 0), ('pause', 1), ('resume', 2), ('pause', 2.5), ('finish', 3)]
+        start = self.now
+        self.assertEqual(net_hours([(a, start + timedelta(hours=h)) for a, h in events]), 1.5)
+
+    def test_rate_is_smoothed_and_outliers_dropped(self):
+        # 1000 units in 2 productive hours -> 500/h
+        self.finish_step(1000, [('start', 0), ('pause', 1), ('resume', 2), ('finish', 3)])
+        # 1000 units in 3 minutes: a forgotten START, not a real rate
+        self.finish_step(1000, [('start', 4), ('finish', 4.05)], offset_hours=1)
+
+        with self.assertNumQueries(4):  # watermark, logs, current rates, bulk_create
+            report = EfficiencyLearner.run(today=self.today)
+
+        self.assertEqual(report['samples'], 2)
+        self.assertEqual(report['rejected'], 1)
+        learned = EmployeeEfficiency.objects.filter(employee=self.worker).order_by('-effective_from').first()
+        self.assertEqual(learned.effective_from, self.today)
+        self.assertEqual(float(learned.units_per_hour), 420.0)  # 0.8 * 400 + 0.2 * 500
+        self.assertEqual(learned.hourly_labor_cost, 20000)
+        self.assertEqual(learned.sample_count, 1)
+
+    def test_runs_only_over_new_logs(self):
+        self.finish_step(1000, [('start', 0), ('finish', 2)])
+        EfficiencyLearner.run(today=self.today)
+
+        report = EfficiencyLearner.run(today=self.today)
+        self.assertEqual(report['samples'], 0)
+
+        self.finish_step(1000, [('start', 0), ('finish', 2)], offset_hours=5)
+        report = EfficiencyLearner.run(today=self.today)
+
+        self.assertEqual(report['samples'], 1)
+        self.assertEqual(report['updated'], 1)
+        rows = EmployeeEfficiency.objects.filter(employee=self.worker)
+        self.assertEqual(rows.count(), 2)
+        learned = rows.get(effective_from=self.today)
+        self.assertEqual(learned.sample_count, 2)
+        self.assertAlmostEqual(float(learned.units_per_hour), 0.8 * 420 + 0.2 * 500, places=2)
+
+
+class StepDurationsTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_shop(orders=1, steps_per_order=1)
+        self.worker = User.objects.create_user(username='operator2', password='x')
+        self.count = 0
+
+    def log_step(self, events, finish=True):
+        """events: [(action, minutes ago, pause reason)]; FINISH is logged now"""
+        self.count += 1
+        order = Order.objects.create(client=self.client_obj, order_number=f"DUR-{self.count}", quantity=100)
+        step = ProductionStep.objects.create(order=order, step='printing', status='completed')
+        now = timezone.now()
+        for action, minutes_ago, reason in events:
+            log = WorkerTimeLog.objects.create(
+                production_step=step, worker=self.worker, action=action, pause_reason=reason,
+            )
+            WorkerTimeLog.objects.filter(pk=log.pk).update(timestamp=now - timedelta(minutes=minutes_ago))
+        if finish:
+            WorkerTimeLog.objects.create(production_step=step, worker=self.worker, action='finish')
+        return step
+
+    def test_finish_materializes_working_and_paused_minutes(self):
+        step = self.log_step([
+            ('start', 180, None), ('pause', 120, 'material_wait'), ('resume', 90, None),
+            ('pause', 60, 'break'), ('resume', 50, None),
+        ])
+
+        step.refresh_from_db()
+        self.assertEqual(step.actual_duration_minutes, 60 + 30 + 50)
+        self.assertEqual(step.paused_minutes, 40)
+        self.assertEqual(step.pause_breakdown, {'material_wait': 30.0, 'break': 10.0})
+
+    def test_workers_sharing_a_step_are_summed(self):
+        helper = User.objects.create_user(username='operator3', password='x')
+        step = ProductionStep.objects.create(order=self.orders[0], step='cutting', status='completed')
+        start = timezone.now() - timedelta(hours=3)
+        for worker, action, minutes in [
+            (self.worker, 'start', 0), (helper, 'start', 30), (self.worker, 'finish', 60), (helper, 'finish', 120),
+        ]:
+            log = WorkerTimeLog.objects.create(production_step=step, worker=worker, action=action)
+            WorkerTimeLog.objects.filter(pk=log.pk).update(timestamp=start + timedelta(minutes=minutes))
+
+        step_durations.materialize([step.id])
+
+        step.refresh_from_db()
+        self.assertEqual(step.actual_duration_minutes, 60 + 90)
+        self.assertEqual(step.paused_minutes, 0)
+
+    def test_backfill_is_one_window_query(self):
+        for _ in range(30):
+            self.log_step([('start', 100, None), ('pause', 70, None), ('resume', 60, None)])
+        ProductionStep.objects.update(actual_duration_minutes=None, paused_minutes=None)
+
+        with CaptureQueriesContext(connection) as ctx:
+            written = step_durations.materialize()
+
+        self.assertEqual(written, 30)
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('LAG(', selects[0])
+        self.assertEqual(
+            set(ProductionStep.objects.filter(order__order_number__startswith='DUR').values_list(
+                'actual_duration_minutes', 'paused_minutes'
+            )),
+            {(90, 10)},
+        )
+
+
+class MaintenancePlannerTestCase(SchedulingFixtureMixin, TestCase):
+    def setUp(self):
+        self.make_shop(orders=6, steps_per_order=1)
+        ProductionStep.objects.update(estimated_duration_minutes=60)
+        MachineSettings.objects.filter(pk=self.printer.pk).update(
+            maintenance_interval_hours=200, current_operating_hours=197
+        )
+
+    def test_latest_free_slot_before_a_moment(self):
+        hour = timedelta(hours=1)
+        availability = MachineAvailability([
+            (self.now + hour, self.now + 2 * hour), (self.now + 6 * hour, self.now + 7 * hour),
+        ])
+
+        self.assertEqual(availability.latest_slot(self.now, self.now + 10 * hour, 2 * hour), self.now + 8 * hour)
+        self.assertEqual(availability.latest_slot(self.now, self.now + 7 * hour, 2 * hour), self.now + 4 * hour)
+        self.assertIsNone(availability.latest_slot(self.now, self.now + 7 * hour, 5 * hour))
+
+    def test_window_is_inserted_where_the_interval_runs_out(self):
+        with CaptureQueriesContext(connection) as dry:
+            result = FiniteCapacityScheduler.replan(now=self.now, commit=False)
+
+        # Three more hours reach the 200 h interval; the fourth step waits for service
+        windows = result['maintenance']
+        self.assertEqual(len(windows), 1)
+        window = windows[0]
+        self.assertEqual(window.machine_id, self.printer.id)
+        self.assertEqual(window.start, self.now + timedelta(hours=3))
+        self.assertEqual(window.end, window.start + timedelta(hours=MAINTENANCE_HOURS))
+        starts = sorted(step.start for step in result['plan'].values() if step.machine_id == self.printer.id)
+        self.assertEqual(starts[3], window.end)
+        self.assertEqual(starts[:3], [self.now + timedelta(hours=h) for h in range(3)])
+        self.assertLessEqual(len(dry.captured_queries), 8)  # no extra queries to plan it
+
+    def test_planned_windows_replace_the_previous_replan(self):
+        FiniteCapacityScheduler.replan(now=self.now)
+        FiniteCapacityScheduler.replan(now=self.now)
+
+        planned = MachineDowntime.objects.filter(is_planned=True)
+        self.assertEqual(planned.count(), 1)
+        self.assertEqual(planned.get().reason, 'maintenance')
+        # The stored window is still honoured by later availability lookups
+        index = AvailabilityIndex.load([self.printer.id], self.now)
+        self.assertFalse(index.machine(self.printer.id).is_free(planned.get().started_at, planned.get().ended_at))
+
+    def test_work_after_an_earlier_window_counts_towards_the_next(self):
+        hour = timedelta(hours=1)
+        snapshot = ShopSnapshot(self.now)
+        snapshot.machines = {1: {'is_active': True, 'maintenance_interval_hours': 10, 'current_operating_hours': 7}}
+        availability = AvailabilityIndex()
+        planner = MaintenancePlanner(snapshot, availability)
+        for start in (6, 7):  # counted, placed late on a free machine
+            self.assertFalse(planner.before_step(1, self.now + start * hour, hour))
+            availability.book(1, self.now + start * hour, self.now + (start + 1) * hour)
+
+        self.assertTrue(planner.before_step(1, self.now + 8 * hour, 2 * hour))
+        planner.after_step(1, self.now + 8 * hour, 2 * hour)
+
+        window = planner.windows[0]
+        self.assertEqual((window.start, window.end), (self.now + 2 * hour, self.now + 6 * hour))
+        self.assertEqual(window.due_hours, 7)
+        # The two counted hours now run after the service, plus the new step
+        self.assertEqual(planner.hours[1], 4)
+
+    def test_elapsed_planned_window_restarts_interval(self):
+        window = MachineDowntime.objects.create(
+            machine=self.printer, reason='maintenance', is_planned=True, is_active=False,
+            started_at=self.now - timedelta(hours=6), ended_at=self.now - timedelta(hours=2),
+        )
+
+        self.assertFalse(FiniteCapacityScheduler.replan(now=self.now, commit=False)['maintenance'])
+        FiniteCapacityScheduler.replan(now=self.now)
+
+        self.printer.refresh_from_db()
+        self.assertEqual(self.printer.current_operating_hours, 0)
+        self.assertEqual(self.printer.last_maintenance_date, window.ended_at)
+        self.assertFalse(MachineDowntime.objects.filter(is_planned=True, started_at__gt=self.now).exists())
+
+    def test_finished_maintenance_restarts_interval(self):
+        downtime = MachineDowntime.objects.create(
+            machine=self.printer, reason='maintenance', started_at=self.now - timedelta(hours=4),
+        )
+        downtime.resolve(None)
+
+        self.printer.refresh_from_db()
+        self.assertEqual(self.printer.current_operating_hours, 0)
+        self.assertFalse(FiniteCapacityScheduler.replan(now=self.now, commit=False)['maintenance'])
+
+
+class SchedulerBenchmarkTestCase(TestCase):
+    def test_synthetic_shop_has_exact_size_and_routed_steps(self):
+        shop = SyntheticShop(50, seed=3).build()
+
+        self.assertEqual(ProductionStep.objects.count(), 50)
+        self.assertEqual(shop.steps, 50)
+        self.assertEqual(MachineSettings.objects.count(), 8)
+        for step in ProductionStep.objects.filter(depends_on_step__isnull=False).select_related('depends_on_step'):
+            self.assertEqual(step.order_id, step.depends_on_step.order_id)
+        # Every machine step sits on a machine of its routing's type
+        routed = ProductionStep.objects.filter(step='printing')
+        self.assertFalse(routed.exclude(machine__machine_type='printer').exists())
+
+    def test_run_reports_every_path_and_compares_with_baseline(self):
+        report = SchedulerBenchmark(40, seed=1, sample_calls=2).run()
+
+        self.assertEqual(set(report['cases']), {
+            'replan', 'calculate_step_times', 'optimize_machine_queue', 'promise_state',
+            'promise', 'realistic_deadline', 'schedule_order_production', 'forecast_backlog', 'delivery_forecast',
+            'tardiness_optimizer', 'critical_path', 'shop_simulation', 'worker_assignment',
+        })
+        self.assertEqual(report['steps'], 40)
+        self.assertEqual(report['quality']['orders'], report['orders'])
+        self.assertEqual(compare(report, report), [])
+
+        baseline = {
+            'cases': {'replan': dict(report['cases']['replan'], queries_per_call=1)},
+            'quality': dict(report['quality'], late_orders=0, makespan_hours=report['quality']['makespan_hours'] / 2),
+        }
+        regressions = {(case, metric) for case, metric, _, _ in compare(report, baseline)}
+        self.assertIn(('replan', 'queries_per_call'), regressions)
+        self.assertIn(('quality', 'makespan_hours'), regressions)
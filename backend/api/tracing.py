@@ -0,0 +1,176 @@
+"""
+Quote Pipeline Stage Timers
+Lightweight wall-time + DB query counters for the pricing hot path.
+
+Usage:
+    with trace_request(request) as trace:      # in the view
+        with stage('nesting'):                 # anywhere below it
+            ...
+
+stage() returns a shared no-op context manager when no trace is active,
+so instrumented code costs one ContextVar lookup when tracing is off.
+A request is traced when settings.QUOTE_TRACING_ENABLED is true or the
+client sends the debug header (X-Quote-Trace: 1). Finished stages feed
+process-level rolling windows read by the admin stats endpoint.
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+
+TRACE_HEADER = 'X-Quote-Trace'
+
+_current_trace = ContextVar('quote_trace', default=None)
+
+
+class QuoteTrace:
+    """Per-request list of (stage, wall ms, queries)"""
+
+    __slots__ = ('name', 'stages', 'queries', 'started', 'total_ms')
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.queries = 0
+        self.started = perf_counter()
+        self.total_ms = None
+
+    def count_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook"""
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'total_ms': round(self.total_ms if self.total_ms is not None else (perf_counter() - self.started) * 1000, 3),
+            'queries': self.queries,
+            'stages': [
+                {'stage': name, 'ms': round(ms, 3), 'queries': queries}
+                for name, ms, queries in self.stages
+            ],
+        }
+
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'started', 'queries')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.queries = self.trace.queries
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (perf_counter() - self.started) * 1000
+        self.trace.stages.append((self.name, elapsed_ms, self.trace.queries - self.queries))
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Time a block as `name` within the active trace (no-op when untraced)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name)
+
+
+def wants_trace(request):
+    return bool(request is not None and request.headers.get(TRACE_HEADER))
+
+
+@contextmanager
+def trace_request(request=None, name='quote'):
+    """
+    Open a trace for the duration of the block. Yields the QuoteTrace, or
+    None when tracing is disabled for this request.
+    """
+    if not (getattr(settings, 'QUOTE_TRACING_ENABLED', False) or wants_trace(request)):
+        yield None
+        return
+
+    trace = QuoteTrace(name)
+    token = _current_trace.set(trace)
+    try:
+        with connection.execute_wrapper(trace.count_query):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.total_ms = (perf_counter() - trace.started) * 1000
+        StageStats.record_trace(trace)
+
+
+class StageStats:
+    """Process-level rolling windows of stage timings"""
+
+    WINDOW = 500
+
+    _lock = threading.Lock()
+    _windows = {}
+
+    @classmethod
+    def record(cls, key, ms, queries):
+        with cls._lock:
+            window = cls._windows.get(key)
+            if window is None:
+                window = cls._windows[key] = deque(maxlen=cls.WINDOW)
+            window.append((ms, queries))
+
+    @classmethod
+    def record_trace(cls, trace):
+        cls.record(trace.name, trace.total_ms, trace.queries)
+        for stage_name, ms, queries in trace.stages:
+            cls.record(f"{trace.name}.{stage_name}", ms, queries)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._windows = {}
+
+    @staticmethod
+    def _percentile(sorted_values, pct):
+        """Nearest-rank percentile of an ascending list"""
+        if not sorted_values:
+            return 0
+        rank = max(1, -(-len(sorted_values) * pct // 100))
+        return sorted_values[int(rank) - 1]
+
+    @classmethod
+    def snapshot(cls):
+        """{key: {'count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'avg_queries'}}"""
+        with cls._lock:
+            windows = {key: list(window) for key, window in cls._windows.items()}
+
+        stats = {}
+        for key, samples in sorted(windows.items()):
+            times = sorted(ms for ms, _ in samples)
+            stats[key] = {
+                'count': len(samples),
+                'p50_ms': round(cls._percentile(times, 50), 3),
+                'p95_ms': round(cls._percentile(times, 95), 3),
+                'p99_ms': round(cls._percentile(times, 99), 3),
+                'max_ms': round(times[-1], 3),
+                'avg_queries': round(sum(q for _, q in samples) / len(samples), 2),
+            }
+        return stats
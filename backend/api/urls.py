@@ -19,11 +19,13 @@ from .qc_views import (
 from .pricing_views import PricingCalculationView
 from .phase3_views import (
     PriceLockView, ManualOverrideView, PriceHistoryView,
-    ScenarioListView, CapacityStatusView, PriceVersionListView
+    ScenarioListView, ScenarioQuoteView, CapacityStatusView, ShopSimulationView, PriceVersionListView,
+    QuoteTimingStatsView
 )
 from .phase4_views import (
     BottleneckAnalysisView, ParallelFlowAnalysisView, MachineDowntimeViewSet,
-    MachineAvailabilityView, SmartAssignmentView, WorkloadRebalanceView
+    MachineAvailabilityView, SmartAssignmentView, WorkloadRebalanceView,
+    BatchAssignmentView
 )
 from .phase5_views import (
     SetupAccountsView, TrialBalanceView, BalanceSheetView,
@@ -45,7 +47,8 @@ from .warehouse_views import (
 from .scheduling_views import (
     get_machine_queue, assign_step_to_machine, optimize_machine_queue,
     calculate_step_times, schedule_order_production, get_production_analytics,
-    update_step_priority, get_machine_availability
+    update_step_priority, get_machine_availability, replan_production,
+    get_capacity_timeline, optimize_production_schedule
 )
 from .auth_views import login, logout, me
 
@@ -95,9 +98,12 @@ urlpatterns = [
     path('orders/<int:order_id>/override-price/', ManualOverrideView.as_view(), name='override-price'),
     path('orders/<int:order_id>/price-history/', PriceHistoryView.as_view(), name='price-history'),
     path('pricing/scenarios/', ScenarioListView.as_view(), name='pricing-scenarios'),
+    path('pricing/scenarios/quote/', ScenarioQuoteView.as_view(), name='pricing-scenarios-quote'),
+    path('pricing/timings/', QuoteTimingStatsView.as_view(), name='pricing-timings'),
     path('pricing/calculate/', PricingCalculationView.as_view(), name='pricing-calculate'),
     path('pricing/versions/', PriceVersionListView.as_view(), name='price-versions'),
     path('production/capacity/', CapacityStatusView.as_view(), name='capacity-status'),
+    path('production/simulate/', ShopSimulationView.as_view(), name='shop-simulation'),
     
     # Phase 4: Production Optimization
     path('production/bottlenecks/', BottleneckAnalysisView.as_view(), name='bottleneck-analysis'),
@@ -107,6 +113,7 @@ urlpatterns = [
     path('production/machines/availability/', MachineAvailabilityView.as_view(), name='machine-availability'),
     path('production/machines/<int:machine_id>/availability/', MachineAvailabilityView.as_view(), name='machine-availability-detail'),
     path('production/steps/<int:step_id>/smart-assign/', SmartAssignmentView.as_view(), name='smart-assign'),
+    path('production/workers/assign-batch/', BatchAssignmentView.as_view(), name='batch-assign'),
     path('production/workload/rebalance/', WorkloadRebalanceView.as_view(), name='workload-rebalance'),
     
     # Phase 5: Financial Module
@@ -159,6 +166,9 @@ urlpatterns = [
     path('production/optimize/', optimize_machine_queue, name='optimize-queue'),
     path('production/calculate-times/', calculate_step_times, name='calculate-times'),
     path('production/schedule/', schedule_order_production, name='schedule-production'),
+    path('production/replan/', replan_production, name='replan-production'),
+    path('production/capacity/timeline/', get_capacity_timeline, name='capacity-timeline'),
+    path('production/optimize-schedule/', optimize_production_schedule, name='optimize-schedule'),
     path('production/analytics/', get_production_analytics, name='production-analytics'),
     path('production/<uuid:step_id>/priority/', update_step_priority, name='update-priority'),
     path('machines/availability/', get_machine_availability, name='machine-availability'),
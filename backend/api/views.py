@@ -20,6 +20,8 @@ from .serializers import (
     SupplierSerializer, MaterialBatchSerializer, WarehouseLogSerializer, SettingsLogSerializer,
     EmployeeEfficiencySerializer, MachineSettingsSerializer
 )
+from .money import Money, Quantity
+from .tracing import stage, trace_request, wants_trace
 from rest_framework.authtoken.models import Token
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -371,11 +373,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         # 1. Calculate and save total_cost
         try:
-            from .services import CalculationService
-            from django.forms.models import model_to_dict
-            order_data = model_to_dict(order)
-            usage = CalculationService.calculate_material_usage(order_data)
-            cost_data = CalculationService.calculate_cost(order_data, usage)
+            from .services import EngineeringJobService
+            cost_data = EngineeringJobService.get_job(order).cost_data
             order.total_cost = cost_data.get('breakdown', {}).get('material_cost', 0) + cost_data.get('breakdown', {}).get('operational_cost', 0)
         except Exception as e:
             print(f"Error calculating cost: {e}")
@@ -389,18 +388,28 @@ class OrderViewSet(viewsets.ModelViewSet):
             # Use Template Routing
             routing = order.product_template.routing_steps.all().order_by('sequence')
             previous_step = None
+            created_steps = {}
             
             for r in routing:
                 # Map routing step names to ProductionStep choices if needed
                 # Ideally they should match. 
                 step_name = r.step_name
                 
+                # Non-linear routing: wait for the listed sequences, otherwise the previous step
+                if r.depends_on_sequences is None:
+                    predecessors = [previous_step] if previous_step else []
+                else:
+                    predecessors = [created_steps[seq] for seq in r.depends_on_sequences if seq in created_steps]
+                
                 step = ProductionStep.objects.create(
                     order=order,
                     step=step_name,
                     status='pending',
-                    depends_on_step=previous_step
+                    depends_on_step=predecessors[0] if predecessors else None
                 )
+                if len(predecessors) > 1:
+                    step.extra_dependencies.set(predecessors[1:])
+                created_steps[r.sequence] = step
                 
                 # Check for specific machine requirement
                 if r.required_machine_type:
@@ -554,9 +563,8 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
             if step.started_at:
                 duration_hrs = (step.completed_at - step.started_at).total_seconds() / 3600.0
                 
-                # Find associated machine (Simplified mapping based on step name)
-                # Ideally, ProductionStep should have a 'machine' FK.
-                # For now, we map step -> machine_type -> active MachineSettings
+                # The step's own machine; steps without one fall back to
+                # step -> machine_type -> first active MachineSettings
                 
                 step_machine_map = {
                     'printing': 'printer',
@@ -565,15 +573,20 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
                     'lamination': 'laminator'
                 }
                 m_type = step_machine_map.get(step.step)
-                if m_type:
-                    # Find active machine of this type
+                machine = step.machine
+                if machine is None and m_type:
                     machine = MachineSettings.objects.filter(machine_type=m_type, is_active=True).first()
-                    if machine:
-                        machine.current_operating_hours = float(machine.current_operating_hours) + duration_hrs
-                        machine.save()
+                if machine:
+                    # Operating hours feed the maintenance planner (see maintenance_planner.py)
+                    machine.current_operating_hours = float(machine.current_operating_hours) + duration_hrs
+                    machine.save()
             
         step.save()
 
+        # Shift downstream estimates (dependents and the machine queue) only as far as they move
+        from .finite_scheduler import IncrementalRescheduler
+        IncrementalRescheduler.on_step_changed(step.id)
+
         # Translate for Logging
         status_map = {
             'pending': 'Kutilmoqda',
@@ -608,19 +621,17 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
                 step.order.status = 'in_production'
                 step.order.save()
             try:
-                from .services import CalculationService
-                from django.forms.models import model_to_dict
+                from .services import EngineeringJobService
                 
                 order = step.order
-                order_data = model_to_dict(order)
-                # Ensure date/decimal fields are handled if needed, but calculate_material_usage handles basics
-                usage = CalculationService.calculate_material_usage(order_data)
+                # Reuse the engineering job computed at approval (recomputed only if specs changed)
+                usage = EngineeringJobService.get_job(order).material_usage
                 
                 def deduct_material_fifo(material_obj, amount_needed):
-                    if not material_obj: return 0, []
+                    if not material_obj: return Money(), []
                     
-                    actual_cost = Decimal('0')
-                    deducted_total = Decimal('0')
+                    actual_cost = Money()
+                    deducted_total = Quantity()
                     logs = []
                     
                     # Get active batches ordered by received_date (FIFO)
@@ -630,21 +641,19 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
                         current_quantity__gt=0
                     ).order_by('received_date')
                     
-                    remaining = Decimal(str(amount_needed))
+                    remaining = Quantity.of(amount_needed)
                     for batch in batches:
-                        if remaining <= 0: break
+                        if remaining <= Quantity(): break
                         
-                        # Use Decimal for all math
-                        qty_in_batch = Decimal(str(batch.current_quantity))
+                        # Fixed-point math, converted to Decimal only when saving
+                        qty_in_batch = Quantity.of(batch.current_quantity)
                         deduct = min(qty_in_batch, remaining)
                         
-                        batch.current_quantity = qty_in_batch - deduct
+                        batch.current_quantity = (qty_in_batch - deduct).to_decimal()
                         remaining -= deduct
                         
                         # Calculate cost for this portion
-                        # Calculate cost for this portion
-                        batch_cost = deduct * Decimal(str(batch.cost_per_unit))
-                        actual_cost += batch_cost
+                        actual_cost += Money.of(batch.cost_per_unit) * deduct
                         deducted_total += deduct
                         
                         if batch.current_quantity <= 0:
@@ -655,21 +664,21 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
                         WarehouseLog.objects.create(
                             material=material_obj,
                             material_batch=batch,
-                            change_amount=deduct,
+                            change_amount=deduct.to_decimal(),
                             type='out',
                             order=order,
                             user=request.user,
                             notes=f"Ishlab chiqarish uchun FIFO yechildi (Buyurtma #{order.order_number})"
                         )
-                        logs.append(f"{material_obj.name} (Batch: {batch.batch_number}): -{deduct}")
+                        logs.append(f"{material_obj.name} (Batch: {batch.batch_number}): -{deduct.to_decimal().normalize()}")
                     
                     # Update global stock
-                    material_obj.current_stock -= deducted_total
+                    material_obj.current_stock -= deducted_total.to_decimal()
                     material_obj.save()
                     
                     return actual_cost, logs
 
-                total_actual_cost = 0
+                total_actual_cost = Money()
                 all_deduction_details = []
 
                 # 1. Deduct Paper
@@ -707,14 +716,14 @@ class ProductionStepViewSet(viewsets.ModelViewSet):
                         all_deduction_details.extend(logs)
 
                 # Update order's actual total_cost based on actual batch prices
-                if total_actual_cost > 0:
-                    order.total_cost = total_actual_cost
+                if total_actual_cost > Money():
+                    order.total_cost = total_actual_cost.to_decimal()
                     order.save()
 
                     ActivityLog.objects.create(
                         user=request.user,
                         action=f"Materiallar FIFO bo'yicha yechildi (#{order.order_number})",
-                        details=", ".join(all_deduction_details) + f" | Jami tannarx: {total_actual_cost}"
+                        details=", ".join(all_deduction_details) + f" | Jami tannarx: {order.total_cost}"
                     )
             except Exception as e:
                 print(f"Error deducting materials: {e}")
@@ -793,70 +802,10 @@ class CalculateOrderView(APIView):
 
     def post(self, request):
         try:
-            data = request.data
-            scenario = data.get('scenario', 'Standard')
-            
-            # Material usage calculation
-            usage = CalculationService.calculate_material_usage(data)
-            
-            # Base cost calculation
-            cost_data = CalculationService.calculate_cost(data, usage)
-            base_price = cost_data.get('total_price', 0)
-            
-            # Apply scenario pricing
-            final_price = ScenarioPricingService.calculate_with_scenario(base_price, scenario)
-            scenario_multiplier = ScenarioPricingService.get_scenario_multiplier(scenario)
-            
-            # Calculate estimated deadline based on quantity and complexity
-            from django.utils import timezone
-            from datetime import timedelta
-            
-            quantity = int(data.get('quantity', 0))
-            
-            # Simple formula: 1-2 days per 1000 items + base 1 day
-            base_days = 1
-            production_days = max(1, quantity // 1000) 
-            
-            # Add complexity factors
-            if data.get('lacquer_type') and data.get('lacquer_type') != 'none':
-                production_days += 1  # Extra day for lacquering
-            
-            # Scenario adjustments
-            if scenario == 'Express':
-                production_days = max(1, production_days - 1)
-            elif scenario == 'VIP':
-                production_days = max(1, production_days - 2)
-            elif scenario == 'Economy':
-                production_days += 2
-            
-            total_days = base_days + production_days
-            estimated_deadline = timezone.now().date() + timedelta(days=total_days)
-            
-            # Capacity status (simplified)
-            capacity_status = {
-                'current_load': Order.objects.filter(status__in=['in_production', 'approved']).count(),
-                'max_capacity': 20,
-                'status': 'normal'
-            }
-            
-            if capacity_status['current_load'] > 15:
-                capacity_status['status'] = 'high'
-                total_days += 1
-                estimated_deadline = timezone.now().date() + timedelta(days=total_days)
-            
-            response_data = {
-                "materials": usage,
-                "cost": {
-                    **cost_data,
-                    'base_price': base_price,
-                    'scenario': scenario,
-                    'scenario_multiplier': scenario_multiplier,
-                    'final_price': final_price
-                },
-                "estimated_days": total_days,
-                "estimated_deadline": estimated_deadline.isoformat(),
-                "capacity_status": capacity_status
-            }
+            with trace_request(request, 'quote') as trace:
+                response_data = self._calculate(request.data)
+            if trace is not None and wants_trace(request):
+                response_data['trace'] = trace.as_dict()
             return Response(response_data)
         except Exception as e:
             print(f"Calculate error: {e}")
@@ -864,6 +813,82 @@ class CalculateOrderView(APIView):
             traceback.print_exc()
             return Response({"error": str(e)}, status=400)
 
+    def _calculate(self, data):
+        scenario = data.get('scenario', 'Standard')
+        with stage('settings'):
+            settings = PricingSettings.load_readonly()
+        
+        # Material usage calculation
+        usage = CalculationService.calculate_material_usage(data, settings)
+        
+        # Base cost calculation
+        cost_data = CalculationService.calculate_cost(data, usage, settings=settings)
+        base_price = cost_data.get('total_price', 0)
+        
+        # Apply scenario pricing
+        scenario_multiplier = ScenarioPricingService.get_scenario_multiplier(scenario, settings)
+        final_price = ScenarioPricingService.calculate_with_scenario(base_price, scenario, settings)
+        
+        # Estimated deadline from the capable-to-promise date (P90), moved by
+        # the scenario's days and a day's margin under high load
+        from django.utils import timezone
+        
+        quantity = int(data.get('quantity', 0))
+        has_lacquer = bool(data.get('lacquer_type')) and data.get('lacquer_type') != 'none'
+        
+        # Capacity status (simplified)
+        with stage('capacity'):
+            current_load = Order.objects.filter(status__in=['in_production', 'approved']).count()
+        capacity_status = {
+            'current_load': current_load,
+            'max_capacity': 20,
+            'status': 'high' if current_load > 15 else 'normal'
+        }
+        
+        from .delivery_forecast import DeliveryForecast
+        quote_steps = DeliveryForecast.steps_for_quote(cost_data, quantity, has_lacquer)
+        
+        # Capable-to-promise: the routing placed on the current machine plan
+        with stage('ctp'):
+            from .capable_to_promise import CapableToPromise
+            promise = CapableToPromise().promise(quote_steps, usage)
+        shift_days = ScenarioPricingService.scenario_day_shift(quantity, has_lacquer, scenario)
+        if capacity_status['status'] == 'high':
+            shift_days += 1
+        estimated_deadline = ScenarioPricingService.promised_deadline(promise, shift_days)
+        total_days = max((estimated_deadline - timezone.localdate()).days, 0)
+        
+        with stage('forecast'):
+            forecast = DeliveryForecast().predict(quote_steps)
+        
+        response_data = {
+            "materials": usage,
+            "cost": {
+                **cost_data,
+                'base_price': base_price,
+                'scenario': scenario,
+                'scenario_multiplier': scenario_multiplier,
+                'final_price': final_price
+            },
+            "estimated_days": total_days,
+            "estimated_deadline": estimated_deadline.isoformat(),
+            "delivery_forecast": {
+                'p50': forecast['p50'],
+                'p80': forecast['p80'],
+                'p95': forecast['p95'],
+                'working_hours': forecast['working_hours'],
+            },
+            "capable_to_promise": {
+                'earliest_completion': promise['earliest_completion'],
+                'confidence_band': promise['confidence_band'],
+                'material_ready': promise['material_ready'],
+                'material_shortages': promise['material_shortages'],
+                'steps': promise['steps'],
+            },
+            "capacity_status": capacity_status
+        }
+        return response_data
+
 
 
 
@@ -0,0 +1,379 @@
+"""
+Working-Time Calendar Engine
+Interval index of business hours built from Calendar days and active Shifts.
+
+Working time is expanded once into disjoint, sorted segments with a
+capacity rate (sum of the multipliers of the shifts covering it; overnight
+shifts run into the next day) plus a prefix sum of effective seconds.
+"Add N working hours" and "working hours between t1 and t2" are then two
+binary searches. Working days are kept as a sorted list of ordinals so
+"add N working days" is a single bisect as well.
+
+Working days on their own (no hours) are also kept per year as a bitmap
+with prefix sums (WorkingDayIndex), so day counts and day offsets do
+not need the hour segments of the whole horizon.
+
+The engine is cached per process and dropped whenever a Calendar or Shift
+row is saved or deleted (see signals.py); it also expires after
+MAX_AGE_SECONDS so other processes' edits are picked up.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+# Used when no Shift is active (matches the historical 9:00-18:00 day)
+DEFAULT_SHIFT = (dt_time(9, 0), dt_time(18, 0), 1.0)
+
+
+class WorkingTimeCalendar:
+    MAX_AGE_SECONDS = 300
+    HORIZON_PAST_DAYS = 31
+    HORIZON_FUTURE_DAYS = 366
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, first_day, last_day, day_rows, shifts, tz=None):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.tz = tz or timezone.get_default_timezone()
+        self.built_at = time.monotonic()
+        self._build_days(day_rows)
+        self._build_segments(day_rows, shifts)
+        self._arrays = None
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def get(cls, covering=None):
+        """
+        Process-wide instance. `covering` is an optional (first_date, last_date)
+        that the horizon must include; the engine is rebuilt wider if not.
+        """
+        instance = cls._instance
+        if instance is not None and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS:
+            if covering is None or instance.covers(*covering):
+                return instance
+
+        with cls._lock:
+            instance = cls._instance
+            fresh = instance is not None and time.monotonic() - instance.built_at <= cls.MAX_AGE_SECONDS
+            if fresh and (covering is None or instance.covers(*covering)):
+                return instance
+
+            today = timezone.localdate()
+            first_day = today - timedelta(days=cls.HORIZON_PAST_DAYS)
+            last_day = today + timedelta(days=cls.HORIZON_FUTURE_DAYS)
+            if fresh:
+                first_day, last_day = min(first_day, instance.first_day), max(last_day, instance.last_day)
+            if covering is not None:
+                first_day = min(first_day, covering[0] - timedelta(days=7))
+                last_day = max(last_day, covering[1] + timedelta(days=cls.HORIZON_FUTURE_DAYS // 2))
+
+            cls._instance = cls.build(first_day, last_day)
+            return cls._instance
+
+    @classmethod
+    def invalidate(cls, *args, **kwargs):
+        """Signal-compatible: drop the cached engine"""
+        cls._instance = None
+
+    @classmethod
+    def build(cls, first_day, last_day):
+        """Two queries: Calendar rows in range and active shifts"""
+        from api.models import Calendar, Shift
+
+        day_rows = {
+            day: (is_working, shift_count)
+            for day, is_working, shift_count in Calendar.objects.filter(
+                date__gte=first_day, date__lte=last_day
+            ).values_list('date', 'is_working_day', 'shift_count')
+        }
+        shifts = [
+            (start, end, float(multiplier))
+            for start, end, multiplier in Shift.objects.filter(is_active=True).order_by(
+                'start_time'
+            ).values_list('start_time', 'end_time', 'capacity_multiplier')
+        ]
+        return cls(first_day, last_day, day_rows, shifts)
+
+    def covers(self, first_day, last_day):
+        return self.first_day <= first_day and last_day <= self.last_day
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def is_working(day, day_rows):
+        """Calendar row wins; days without a row are working Monday-Friday"""
+        row = day_rows.get(day)
+        if row is not None:
+            return row[0]
+        return day.weekday() < 5
+
+    def _build_days(self, day_rows):
+        days = []
+        day = self.first_day
+        while day <= self.last_day:
+            if self.is_working(day, day_rows):
+                days.append(day.toordinal())
+            day += timedelta(days=1)
+        self._working_days = days
+
+    def _epoch(self, day, clock):
+        return timezone.make_aware(datetime.combine(day, clock), self.tz).timestamp()
+
+    def _build_segments(self, day_rows, shifts):
+        shifts = shifts or [DEFAULT_SHIFT]
+        events = {}
+        day = self.first_day
+        while day <= self.last_day:
+            if self.is_working(day, day_rows):
+                row = day_rows.get(day)
+                day_shifts = shifts[:row[1]] if row is not None else shifts
+                for start_time, end_time, multiplier in day_shifts:
+                    start = self._epoch(day, start_time)
+                    end_day = day if end_time > start_time else day + timedelta(days=1)
+                    end = self._epoch(end_day, end_time)
+                    if end > start and multiplier > 0:
+                        events[start] = events.get(start, 0.0) + multiplier
+                        events[end] = events.get(end, 0.0) - multiplier
+            day += timedelta(days=1)
+
+        starts, ends, rates, prefix = [], [], [], []
+        total = 0.0
+        rate = 0.0
+        points = sorted(events)
+        for current, following in zip(points, points[1:]):
+            rate = round(rate + events[current], 6)
+            if rate > 1e-9:
+                if ends and ends[-1] == current and rates[-1] == rate:
+                    ends[-1] = following  # extend the previous segment
+                else:
+                    starts.append(current)
+                    ends.append(following)
+                    rates.append(rate)
+                    prefix.append(total)
+                total += rate * (following - current)
+
+        self._starts = starts
+        self._ends = ends
+        self._rates = rates
+        self._prefix = prefix
+        # Cumulative effective seconds at the end of each segment
+        self._prefix_end = [p + r * (e - s) for p, r, s, e in zip(prefix, rates, starts, ends)]
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _to_epoch(self, moment):
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, self.tz)
+        return moment.timestamp()
+
+    def _from_epoch(self, seconds):
+        return datetime.fromtimestamp(seconds, tz=self.tz)
+
+    def _cumulative(self, seconds):
+        i = bisect_right(self._starts, seconds) - 1
+        if i < 0:
+            return 0.0
+        return self._prefix[i] + self._rates[i] * (min(seconds, self._ends[i]) - self._starts[i])
+
+    def day_start_epochs(self, first_day, days):
+        """Local-midnight epoch seconds for `days` + 1 consecutive day boundaries"""
+        return np.array([
+            self._epoch(first_day + timedelta(days=i), dt_time(0, 0)) for i in range(days + 1)
+        ])
+
+    def cumulative_hours_at(self, seconds):
+        """Vectorized _cumulative over an array of epoch seconds, in hours"""
+        seconds = np.asarray(seconds, dtype=float)
+        if not self._starts:
+            return np.zeros_like(seconds)
+        if self._arrays is None:
+            self._arrays = tuple(
+                np.array(values, dtype=float)
+                for values in (self._starts, self._ends, self._rates, self._prefix)
+            )
+        starts, ends, rates, prefix = self._arrays
+        i = np.searchsorted(starts, seconds, side='right') - 1
+        safe = np.maximum(i, 0)
+        value = prefix[safe] + rates[safe] * (np.minimum(seconds, ends[safe]) - starts[safe])
+        return np.where(i >= 0, value, 0.0) / 3600.0
+
+    def working_hours_between(self, start, end):
+        """Capacity-weighted working hours in [start, end)"""
+        if end <= start:
+            return 0.0
+        return (self._cumulative(self._to_epoch(end)) - self._cumulative(self._to_epoch(start))) / 3600.0
+
+    def add_working_hours(self, start, hours):
+        """
+        Earliest moment by which `hours` capacity-weighted working hours have
+        elapsed after `start`. Returns None past the horizon.
+        """
+        if hours <= 0:
+            return start
+        moment = self.add_seconds_at(self._to_epoch(start), hours * 3600.0)
+        return None if moment is None else self._from_epoch(moment)
+
+    def next_working_moment(self, moment):
+        """`moment` if it is inside working time, otherwise the start of the next segment"""
+        seconds = self._to_epoch(moment)
+        following = self.next_working_at(seconds)
+        if following is None or following == seconds:
+            return None if following is None else moment
+        return self._from_epoch(following)
+
+    # Epoch-second variants for hot loops (no datetime conversions)
+
+    def add_seconds_at(self, seconds, effective_seconds):
+        """add_working_hours on epoch seconds; None past the horizon"""
+        target = self._cumulative(seconds) + effective_seconds
+        j = bisect_left(self._prefix_end, target)
+        if j >= len(self._starts):
+            return None
+        return max(self._starts[j] + (target - self._prefix[j]) / self._rates[j], seconds)
+
+    def next_working_at(self, seconds):
+        """next_working_moment on epoch seconds; None past the horizon"""
+        i = bisect_right(self._starts, seconds) - 1
+        if i >= 0 and seconds < self._ends[i]:
+            return seconds
+        if i + 1 < len(self._starts):
+            return self._starts[i + 1]
+        return None
+
+    def add_working_days(self, start_date, days_to_add):
+        """Same semantics as Calendar.add_working_days (start day excluded); None past the horizon"""
+        if days_to_add <= 0:
+            return start_date
+        i = bisect_right(self._working_days, start_date.toordinal()) + days_to_add - 1
+        if i >= len(self._working_days):
+            return None
+        return date.fromordinal(self._working_days[i])
+
+
+class WorkingDayYear:
+    """One year of working days: a day bitmap, its prefix sums and working-day positions"""
+
+    __slots__ = ('first_day', 'bits', 'prefix', 'positions', 'built_at')
+
+    def __init__(self, year, day_rows):
+        """day_rows: [(date, is_working_day)] Calendar rows inside the year"""
+        self.first_day = date(year, 1, 1)
+        days = (date(year + 1, 1, 1) - self.first_day).days
+        # Days without a Calendar row are working Monday-Friday
+        bits = (np.arange(days) + self.first_day.weekday()) % 7 < 5
+        for day, is_working in day_rows:
+            bits[(day - self.first_day).days] = is_working
+        self.bits = bits
+        self.prefix = np.concatenate(([0], np.cumsum(bits)))  # working days before day i
+        self.positions = np.flatnonzero(bits)  # day index of the k-th working day
+        self.built_at = time.monotonic()
+
+    def index(self, day):
+        return (day - self.first_day).days
+
+
+class WorkingDayIndex:
+    """
+    Process-level working-day bitmaps, one per year, loaded on first use with
+    one query. Counting working days in a range is two prefix-sum reads per
+    year touched, and "N working days after a date" is one array read.
+    A saved or deleted Calendar row drops its year (see signals.py).
+    """
+
+    MAX_AGE_SECONDS = 300
+
+    _lock = threading.Lock()
+    _years = {}
+
+    @classmethod
+    def year(cls, year):
+        entry = cls._years.get(year)
+        if entry is not None and time.monotonic() - entry.built_at <= cls.MAX_AGE_SECONDS:
+            return entry
+        with cls._lock:
+            entry = cls._years.get(year)
+            if entry is None or time.monotonic() - entry.built_at > cls.MAX_AGE_SECONDS:
+                from api.models import Calendar
+                entry = WorkingDayYear(
+                    year, Calendar.objects.filter(date__year=year).values_list('date', 'is_working_day')
+                )
+                cls._years = {**cls._years, year: entry}
+            return entry
+
+    @classmethod
+    def invalidate(cls, *args, instance=None, **kwargs):
+        """Signal-compatible: drop the instance's year, or every year"""
+        with cls._lock:
+            if instance is not None and getattr(instance, 'date', None):
+                cls._years = {y: entry for y, entry in cls._years.items() if y != instance.date.year}
+            else:
+                cls._years = {}
+
+    @classmethod
+    def count(cls, start_date, end_date):
+        """Working days in the inclusive range"""
+        total = 0
+        for year in range(start_date.year, end_date.year + 1):
+            entry = cls.year(year)
+            a = entry.index(max(start_date, entry.first_day))
+            b = entry.index(min(end_date, date(year, 12, 31)))
+            if b >= a:
+                total += int(entry.prefix[b + 1] - entry.prefix[a])
+        return total
+
+    @classmethod
+    def add(cls, start_date, days_to_add):
+        """Same semantics as Calendar.add_working_days (start day excluded)"""
+        if days_to_add <= 0:
+            return start_date
+        entry = cls.year(start_date.year)
+        k = int(entry.prefix[entry.index(start_date) + 1]) + days_to_add - 1
+        year = start_date.year
+        while k >= len(entry.positions):
+            k -= len(entry.positions)
+            year += 1
+            if year > start_date.year + 100:
+                return None
+            entry = cls.year(year)
+        return date.fromordinal(entry.first_day.toordinal() + int(entry.positions[k]))
+
+
+def add_working_hours(start, hours):
+    """Module-level helper that widens the horizon when needed"""
+    local_start = timezone.localtime(start).date() if timezone.is_aware(start) else start.date()
+    span = int(hours // 4) + 14
+    while True:
+        engine = WorkingTimeCalendar.get(covering=(local_start, local_start + timedelta(days=span)))
+        result = engine.add_working_hours(start, hours)
+        if result is not None or span > 3650 * 4:
+            return result
+        span *= 2
+
+
+def working_hours_between(start, end):
+    def day_of(moment):
+        return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+    engine = WorkingTimeCalendar.get(covering=(day_of(start), day_of(end)))
+    return engine.working_hours_between(start, end)
+
+
+def add_working_days(start_date, days_to_add):
+    return WorkingDayIndex.add(start_date, days_to_add)
+
+
+def working_days_count(start_date, end_date):
+    return WorkingDayIndex.count(start_date, end_date)
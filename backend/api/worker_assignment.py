@@ -0,0 +1,284 @@
+"""
+Batch Worker Assignment
+Assigns unassigned ready steps to workers as one min-cost matching.
+
+Processing time of step s by worker w comes from the worker's latest
+EmployeeEfficiency rate for the step's stage (quantity / units_per_hour);
+workers without a rate for the stage but with a matching role use the
+stage's median rate, slowed down by UNRATED_FACTOR. Each worker also
+carries the remaining estimated hours of the open steps already assigned
+to them.
+
+Minimising the total completion time of the new steps is an assignment
+problem: a worker gets K slots, and putting step s in the k-th slot from
+the end costs k * p(s, w) (it delays itself and the k - 1 steps after it)
+plus the worker's current load. Hours beyond the working time left in the
+planning horizon (shift calendar) are charged OVERLOAD_PENALTY extra. The
+rectangular matrix is solved with the shortest augmenting path Hungarian
+method, started from the row minima, its inner loop vectorised with NumPy
+on preallocated buffers.
+
+The shop state is loaded in four queries and assignments are written with
+one bulk_update.
+"""
+
+from datetime import timedelta
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+from django.db.models import Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.finite_scheduler import OPEN_STATUSES, DEFAULT_DURATION_MINUTES
+from api.models import EmployeeEfficiency, ProductionStep, User
+from api.work_calendar import working_hours_between
+
+# ProductionStep.step -> (User.role, EmployeeEfficiency.production_stage)
+STEP_WORKFORCE = {
+    'queue': ('warehouse', None),
+    'printing': ('printer', 'printing'),
+    'drying': ('finishing', 'drying'),
+    'lamination': ('finishing', 'finishing'),
+    'cutting': ('cutter', 'cutting'),
+    'die_cutting': ('cutter', 'cutting'),
+    'gluing': ('finishing', 'gluing'),
+    'qc': ('qc', None),
+    'packaging': ('finishing', 'packaging'),
+    'ready': ('warehouse', None),
+    'dispatch': ('warehouse', None),
+}
+
+DEFAULT_HORIZON_HOURS = 24
+UNRATED_FACTOR = 1.25
+OVERLOAD_PENALTY = 4.0
+INELIGIBLE = 1e9
+
+
+def min_cost_assignment(cost):
+    """
+    Rows to distinct columns minimising total cost, for an n x m matrix with
+    n <= m. Returns a list of column indices, one per row.
+    """
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    if n == 0:
+        return []
+    if n > m:
+        raise ValueError("min_cost_assignment needs at least as many columns as rows")
+
+    # Start from row minima: every row whose cheapest column no earlier row
+    # took is matched at once, and only the rest need an augmenting path.
+    # With v = 0 the potentials stay feasible and unmatched columns keep v = 0,
+    # as the rectangular problem needs.
+    u = cost.min(axis=1)
+    v = np.zeros(m)
+    owner = np.full(m, -1)  # row matched to each column
+    cheapest = cost.argmin(axis=1)
+    columns, first = np.unique(cheapest, return_index=True)
+    owner[columns] = first
+    matched = np.zeros(n, dtype=bool)
+    matched[first] = True
+
+    minv = np.empty(m)
+    way = np.empty(m, dtype=int)
+    blocked = np.empty(m)
+    reduced = np.empty(m)
+    better = np.empty(m, dtype=bool)
+    for i in np.flatnonzero(~matched):
+        # Grow a shortest-path tree from row i until it reaches a free column.
+        # Potential updates are applied lazily: `total` is the sum of deltas so
+        # far, minv is stored shifted by it, and a tree column's owner/v move by
+        # the deltas since the column joined (total - entered[column]).
+        # `blocked` is -v, or +inf once the column is in the tree.
+        minv.fill(np.inf)
+        way.fill(-1)  # previous column on the path, -1 = row i itself
+        np.negative(v, out=blocked)
+        tree, entered = [], []
+        total = 0.0
+        j0, i0, u_i0 = -1, i, u[i]
+        while True:
+            np.add(cost[i0], blocked, out=reduced)
+            reduced += total - u_i0
+            np.less(reduced, minv, out=better)
+            np.copyto(way, j0, where=better)
+            np.minimum(minv, reduced, out=minv)
+
+            j1 = int(np.argmin(minv))
+            total = minv[j1]
+            blocked[j1] = np.inf
+            minv[j1] = np.inf
+            tree.append(j1)
+            entered.append(total)
+            if owner[j1] == -1:
+                break
+            j0, i0 = j1, owner[j1]
+            u_i0 = u[i0]
+
+        columns = np.array(tree)
+        shift = total - np.array(entered)
+        u[i] += total
+        u[owner[columns[:-1]]] += shift[:-1]
+        v[columns] -= shift
+        # Augment along the path back to row i
+        j = j1
+        while j != -1:
+            previous = way[j]
+            owner[j] = owner[previous] if previous != -1 else i
+            j = previous
+
+    assignment = [0] * n
+    for j in np.flatnonzero(owner >= 0):
+        assignment[owner[j]] = int(j)
+    return assignment
+
+
+class WorkerAssignmentSolver:
+    def __init__(self, now=None, step_ids=None, horizon_hours=DEFAULT_HORIZON_HOURS):
+        """
+        step_ids: assign exactly these steps (assigned or not); by default every
+        pending, unassigned step whose predecessors are completed.
+        """
+        self.now = now or timezone.now()
+        self.step_ids = step_ids
+        self.horizon_hours = horizon_hours
+        self.steps = []
+        self.workers = []
+        self.assignments = []
+        self.elapsed_ms = 0.0
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def load(self):
+        steps = ProductionStep.objects.filter(step__in=list(STEP_WORKFORCE))
+        if self.step_ids is not None:
+            steps = steps.filter(id__in=self.step_ids)
+        else:
+            steps = steps.filter(status='pending', assigned_to__isnull=True).filter(
+                Q(depends_on_step__isnull=True) | Q(depends_on_step__status='completed')
+            ).exclude(extra_dependencies__status__in=OPEN_STATUSES)
+        self.steps = list(steps.order_by('priority', 'created_at').values(
+            'id', 'step', 'priority', 'estimated_duration_minutes', 'order__quantity',
+        ))
+
+        roles = {STEP_WORKFORCE[row['step']][0] for row in self.steps}
+        self.workers = list(
+            User.objects.filter(is_active=True, role__in=roles).order_by('id').values('id', 'username', 'role')
+        ) if roles else []
+        worker_ids = [worker['id'] for worker in self.workers]
+
+        self.rates = {}
+        for row in EmployeeEfficiency.objects.filter(employee_id__in=worker_ids).order_by(
+            '-effective_from', '-id'
+        ).values('employee_id', 'production_stage', 'units_per_hour'):
+            if row['units_per_hour'] and row['units_per_hour'] > 0:
+                self.rates.setdefault((row['employee_id'], row['production_stage']), float(row['units_per_hour']))
+
+        self.load_hours = {
+            worker_id: minutes / 60.0
+            for worker_id, minutes in ProductionStep.objects.filter(
+                assigned_to_id__in=worker_ids, status__in=OPEN_STATUSES,
+            ).exclude(id__in=[row['id'] for row in self.steps]).values('assigned_to_id').annotate(
+                minutes=Sum(Coalesce('estimated_duration_minutes', Value(DEFAULT_DURATION_MINUTES)))
+            ).values_list('assigned_to_id', 'minutes')
+        }
+        self.available_hours = working_hours_between(self.now, self.now + timedelta(hours=self.horizon_hours))
+        return self
+
+    # ------------------------------------------------------------------
+    # Cost model
+    # ------------------------------------------------------------------
+
+    def processing_hours(self):
+        """(steps, workers) matrix of hours; inf where the worker cannot do the step"""
+        stage_rates = {}
+        for (_, stage), rate in self.rates.items():
+            stage_rates.setdefault(stage, []).append(rate)
+        stage_median = {stage: median(rates) for stage, rates in stage_rates.items()}
+
+        hours = np.full((len(self.steps), len(self.workers)), np.inf)
+        for s, row in enumerate(self.steps):
+            role, stage = STEP_WORKFORCE[row['step']]
+            quantity = float(row['order__quantity'] or 0)
+            fallback = (row['estimated_duration_minutes'] or DEFAULT_DURATION_MINUTES) / 60.0
+            for w, worker in enumerate(self.workers):
+                rate = self.rates.get((worker['id'], stage)) if stage else None
+                if rate and quantity:
+                    hours[s, w] = quantity / rate
+                elif worker['role'] == role:
+                    if stage in stage_median and quantity:
+                        hours[s, w] = quantity / stage_median[stage] * UNRATED_FACTOR
+                    else:
+                        hours[s, w] = fallback
+        return hours
+
+    def cost_matrix(self, hours):
+        """Steps x (workers * slots): slot k from the end costs k * p + load (+ overload)"""
+        n, workers = hours.shape
+        slots = min(n, max(1, -(-n // max(workers, 1)) * 2))
+        load = np.array([self.load_hours.get(worker['id'], 0.0) for worker in self.workers])
+        k = np.arange(1, slots + 1)
+
+        p = hours[:, :, None]
+        cost = k[None, None, :] * p + load[None, :, None]
+        overload = np.clip(load[None, :, None] + k[None, None, :] * p - self.available_hours, 0, None)
+        cost = cost + OVERLOAD_PENALTY * overload
+        cost = np.where(np.isfinite(p), cost, INELIGIBLE)
+        return cost.reshape(n, workers * slots), slots
+
+    # ------------------------------------------------------------------
+    # Solve / write
+    # ------------------------------------------------------------------
+
+    def solve(self):
+        started = perf_counter()
+        self.assignments = []
+        if self.steps and self.workers:
+            hours = self.processing_hours()
+            cost, slots = self.cost_matrix(hours)
+            if cost.shape[1] < cost.shape[0]:
+                cost = np.hstack((cost, np.full((cost.shape[0], cost.shape[0] - cost.shape[1]), INELIGIBLE)))
+            for s, column in enumerate(min_cost_assignment(cost)):
+                if cost[s, column] >= INELIGIBLE:
+                    continue
+                w = column // slots
+                self.assignments.append((self.steps[s]['id'], self.workers[w]['id'], float(hours[s, w])))
+        self.elapsed_ms = round((perf_counter() - started) * 1000, 2)
+        return self.assignments
+
+    def write(self):
+        ProductionStep.objects.bulk_update(
+            [ProductionStep(id=step_id, assigned_to_id=worker_id) for step_id, worker_id, _ in self.assignments],
+            ['assigned_to'],
+            batch_size=500,
+        )
+        return len(self.assignments)
+
+    def report(self):
+        names = {worker['id']: worker['username'] for worker in self.workers}
+        per_worker = {}
+        for _, worker_id, hours in self.assignments:
+            per_worker[names[worker_id]] = round(per_worker.get(names[worker_id], 0.0) + hours, 2)
+        return {
+            'steps_considered': len(self.steps),
+            'workers_considered': len(self.workers),
+            'assigned': len(self.assignments),
+            'unassigned': len(self.steps) - len(self.assignments),
+            'assigned_hours_by_worker': per_worker,
+            'assignments': [
+                {'step_id': str(step_id), 'worker_id': worker_id, 'worker': names[worker_id], 'hours': round(hours, 2)}
+                for step_id, worker_id, hours in self.assignments
+            ],
+            'elapsed_ms': self.elapsed_ms,
+        }
+
+    @classmethod
+    def run(cls, now=None, step_ids=None, commit=True):
+        solver = cls(now=now, step_ids=step_ids).load()
+        solver.solve()
+        if commit and solver.assignments:
+            solver.write()
+        return solver.report()
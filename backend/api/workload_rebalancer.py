@@ -0,0 +1,184 @@
+"""
+Workload Rebalancer
+Projected queue hours per worker and per machine, and the fewest step
+moves that flatten them.
+
+Loads come from two grouped queries over open steps (per assignee and per
+machine); the pending steps that could move are one more values() query,
+so the cost does not grow with a loop over staff. Resources are pooled by
+role (workers) and machine type (machines) - a step only moves inside its
+pool.
+
+Rebalancing is greedy: while the pool's spread (max - min load) is above
+MIN_SPREAD_HOURS, take the most loaded resource and try moving each of
+its pending steps to the LOOKAHEAD least loaded ones; keep the move that
+gives the lowest resulting peak of the two, and stop when no move lowers
+it by at least MIN_GAIN_HOURS or MAX_MOVES is reached. Projected finish
+times are the loads laid onto the shift calendar from now.
+"""
+
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.finite_scheduler import OPEN_STATUSES, DEFAULT_DURATION_MINUTES
+from api.models import MachineSettings, ProductionStep, User
+from api.work_calendar import add_working_hours
+
+MIN_SPREAD_HOURS = 2.0
+MIN_GAIN_HOURS = 0.25
+LOOKAHEAD = 3
+MAX_MOVES = 50
+WORKER_ROLES = ('warehouse', 'cutter', 'printer', 'finishing', 'qc')
+
+
+class Resource:
+    __slots__ = ('kind', 'id', 'name', 'pool', 'hours', 'steps', 'movable')
+
+    def __init__(self, kind, resource_id, name, pool):
+        self.kind = kind
+        self.id = resource_id
+        self.name = name
+        self.pool = pool
+        self.hours = 0.0
+        self.steps = 0
+        self.movable = []  # [(hours, step row)]
+
+
+class WorkloadRebalancer:
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.resources = {}
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def load(self):
+        hours = Coalesce('estimated_duration_minutes', Value(DEFAULT_DURATION_MINUTES))
+        open_steps = ProductionStep.objects.filter(status__in=OPEN_STATUSES)
+
+        for worker_id, username, role in User.objects.filter(
+            is_active=True, role__in=WORKER_ROLES
+        ).values_list('id', 'username', 'role'):
+            self.resources[('worker', worker_id)] = Resource('worker', worker_id, username, role)
+        for machine_id, name, machine_type in MachineSettings.objects.filter(is_active=True).values_list(
+            'id', 'machine_name', 'machine_type'
+        ):
+            self.resources[('machine', machine_id)] = Resource('machine', machine_id, name, machine_type)
+
+        for kind, field in (('worker', 'assigned_to_id'), ('machine', 'machine_id')):
+            for resource_id, minutes, count in open_steps.filter(**{f'{field}__isnull': False}).values(field).annotate(
+                minutes=Sum(hours), count=Count('id')
+            ).values_list(field, 'minutes', 'count'):
+                resource = self.resources.get((kind, resource_id))
+                if resource:
+                    resource.hours = minutes / 60.0
+                    resource.steps = count
+
+        for row in open_steps.filter(status='pending').exclude(
+            assigned_to__isnull=True, machine__isnull=True
+        ).values(
+            'id', 'step', 'assigned_to_id', 'machine_id', 'estimated_duration_minutes', 'order__order_number',
+        ):
+            step_hours = (row['estimated_duration_minutes'] or DEFAULT_DURATION_MINUTES) / 60.0
+            for kind, resource_id in (('worker', row['assigned_to_id']), ('machine', row['machine_id'])):
+                resource = self.resources.get((kind, resource_id))
+                if resource:
+                    resource.movable.append((step_hours, row))
+        return self
+
+    # ------------------------------------------------------------------
+    # Rebalancing
+    # ------------------------------------------------------------------
+
+    def pools(self):
+        pools = {}
+        for resource in self.resources.values():
+            pools.setdefault((resource.kind, resource.pool), []).append(resource)
+        return pools
+
+    @staticmethod
+    def _best_move(source, receivers):
+        """(new peak, step index, receiver) of the move that lowers the pair's peak most"""
+        best = None
+        for receiver in receivers:
+            for index, (step_hours, _) in enumerate(source.movable):
+                peak = max(source.hours - step_hours, receiver.hours + step_hours)
+                if best is None or peak < best[0]:
+                    best = (peak, index, receiver)
+        return best
+
+    def rebalance(self):
+        """Moves per pool; mutates resource loads to the 'after' state"""
+        moves = []
+        for (kind, pool), members in self.pools().items():
+            if len(members) < 2:
+                continue
+            while len(moves) < MAX_MOVES:
+                members.sort(key=lambda r: (-r.hours, str(r.id)))
+                source = members[0]
+                if source.hours - members[-1].hours <= MIN_SPREAD_HOURS or not source.movable:
+                    break
+                receivers = sorted(members[1:], key=lambda r: (r.hours, str(r.id)))[:LOOKAHEAD]
+                best = self._best_move(source, receivers)
+                if best is None or source.hours - best[0] < MIN_GAIN_HOURS:
+                    break
+                _, index, receiver = best
+                step_hours, row = source.movable.pop(index)
+                source.hours -= step_hours
+                source.steps -= 1
+                receiver.hours += step_hours
+                receiver.steps += 1
+                receiver.movable.append((step_hours, row))
+                moves.append({
+                    'type': kind,
+                    'pool': pool,
+                    'step_id': str(row['id']),
+                    'step': row['step'],
+                    'order_number': row['order__order_number'],
+                    'hours': round(step_hours, 2),
+                    'from_id': str(source.id),
+                    'from': source.name,
+                    'to_id': str(receiver.id),
+                    'to': receiver.name,
+                })
+        return moves
+
+    # ------------------------------------------------------------------
+    # Report
+    # ------------------------------------------------------------------
+
+    def run(self):
+        before = {key: resource.hours for key, resource in self.resources.items()}
+        moves = self.rebalance()
+
+        workload = {'workers': [], 'machines': []}
+        finish_cache = {}
+
+        def finish(load):
+            load = round(load, 4)
+            if load not in finish_cache:
+                finish_cache[load] = add_working_hours(self.now, load)
+            return finish_cache[load]
+
+        for key, resource in sorted(self.resources.items(), key=lambda item: (item[1].pool, item[1].name)):
+            workload['workers' if resource.kind == 'worker' else 'machines'].append({
+                'id': str(resource.id),
+                'name': resource.name,
+                'pool': resource.pool,
+                'steps': resource.steps,
+                'load_hours_before': round(before[key], 2),
+                'load_hours_after': round(resource.hours, 2),
+                'projected_finish_before': finish(before[key]),
+                'projected_finish_after': finish(resource.hours),
+            })
+
+        imbalance = {}
+        for (kind, pool), members in self.pools().items():
+            if len(members) > 1:
+                imbalance[f'{kind}:{pool}'] = {
+                    'spread_hours_before': round(max(before[(kind, m.id)] for m in members) - min(before[(kind, m.id)] for m in members), 2),
+                    'spread_hours_after': round(max(m.hours for m in members) - min(m.hours for m in members), 2),
+                }
+        return {'workload_map': workload, 'rebalance_suggestions': moves, 'imbalance': imbalance}
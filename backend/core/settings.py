@@ -1,5 +1,6 @@
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ MIDDLEWARE = [
 APPEND_SLASH = True
 
 CORS_ALLOW_ALL_ORIGINS = True # For MVP. In prod, set CORS_ALLOWED_ORIGINS
+CORS_ALLOW_HEADERS = (*default_headers, 'x-quote-trace')
 CSRF_TRUSTED_ORIGINS = os.environ.get('CSRF_TRUSTED_ORIGINS', 'http://localhost:3000,https://*.onrender.com').split(',')
 
 ROOT_URLCONF = 'core.urls'
@@ -127,3 +129,7 @@ SPECTACULAR_SETTINGS = {
 
 # Telegram Bot
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
+
+# Quote pipeline stage timers (api/tracing.py). When off, only requests with
+# the X-Quote-Trace header are traced.
+QUOTE_TRACING_ENABLED = os.environ.get('QUOTE_TRACING_ENABLED', 'False') == 'True'